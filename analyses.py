@@ -0,0 +1,528 @@
+# Overview: The CTA L analyses behind menu options 1-12, without any input() or print().
+# Each function takes a database connection plus the values the menu would have
+# prompted for, and returns plain Python data. Anything the menu reports as
+# "**..." is raised as an AnalysisError carrying the same message.
+
+import functools
+import sqlite3
+
+import comparison
+import daynumbers
+import network
+import queries
+import rankings
+import spatial
+import stations
+
+##################################################################
+#
+# AnalysisError
+#
+# Raised when an analysis can't produce a result, e.g. the station
+# wasn't found. The message matches what the menu prints after "**".
+# suggestions holds the closest station names for a mistyped name.
+#
+class AnalysisError(Exception):
+    def __init__(self, message, suggestions=None):
+        super().__init__(message)
+        self.message = message
+        self.suggestions = suggestions or []
+
+#columnar.ColumnStore answering the Ridership aggregations, or None for SQLite
+_columnStore = None
+
+##################################################################
+#
+# use_column_store
+#
+# Given a columnar.ColumnStore (or None), makes options 2, 3, 6, 7
+# and 8 read from it instead of SQLite.
+#
+def use_column_store(store):
+    global _columnStore
+    _columnStore = store
+
+#partitions.PartitionSet holding Ridership one year per file, or None
+_partitions = None
+
+##################################################################
+#
+# use_partitions
+#
+# Given a partitions.PartitionSet (or None), makes options 2, 3, 6,
+# 7 and 8 read from the year partitions instead of the connection's
+# database, which is then their catalog.
+#
+def use_partitions(partitionSet):
+    global _partitions
+    _partitions = partitionSet
+
+#whichever of the column store and the partitions is in use, or None for SQLite
+def ridership_store():
+    return _columnStore if _columnStore is not None else _partitions
+
+#resultcache.ResultCache holding earlier results, or None to always recompute
+_resultCache = None
+
+##################################################################
+#
+# use_result_cache
+#
+# Given a resultcache.ResultCache (or None), makes the analyses
+# below return cached results for arguments they've seen before.
+#
+def use_result_cache(cache):
+    global _resultCache
+    _resultCache = cache
+
+#querycontrol.QueryGuard the analyses run under, or None to run them directly
+_queryGuard = None
+
+##################################################################
+#
+# use_query_guard
+#
+# Given a querycontrol.QueryGuard (or None), makes the analyses
+# below run under it: with its time limit, progress reports and
+# cancellation.
+#
+def use_query_guard(guard):
+    global _queryGuard
+    _queryGuard = guard
+
+#rollups.RollupKeeper keeping RidershipRollup current, or None if it's only refreshed at startup
+_rollupKeeper = None
+
+##################################################################
+#
+# use_rollup_keeper
+#
+# Given a rollups.RollupKeeper (or None), makes options 2, 3, 6, 7
+# and 12 bring the rollup up to date before they read it, so rows
+# written after startup are counted.
+#
+def use_rollup_keeper(keeper):
+    global _rollupKeeper
+    _rollupKeeper = keeper
+
+#decorator for the analyses answered from RidershipRollup: bring it up to date
+#first, before the result cache is consulted; year partitions have their own
+def reads_rollup(function):
+    @functools.wraps(function)
+    def wrapper(dbConn, *args):
+        if _rollupKeeper is not None and _partitions is None:
+            try:
+                _rollupKeeper.current(dbConn)
+            except sqlite3.Error:
+                raise AnalysisError("Ridership rollup could not be brought up to date...")
+        return function(dbConn, *args)
+    return wrapper
+
+#decorator: look the result up in the result cache by function and arguments,
+#with defaulted arguments filled in so f(a) and f(a, default) share an entry;
+#results that have to be computed run under the query guard
+def cached(function):
+    numArgs = function.__code__.co_argcount - 1
+    defaults = function.__defaults__ or ()
+    @functools.wraps(function)
+    def wrapper(dbConn, *args):
+        compute = lambda: function(dbConn, *args)
+        if _queryGuard is not None:
+            compute = functools.partial(_queryGuard.run, dbConn, compute)
+        if _resultCache is None:
+            return compute()
+        key = (function.__name__,) + args + defaults[len(defaults) - (numArgs - len(args)):]
+        return _resultCache.get(dbConn, key, compute)
+    return wrapper
+
+#share of total as a percentage, 0 when there's nothing to share
+def percentage(part, total):
+    return part / total * 100 if total else 0
+
+##################################################################
+#
+# resolve_station
+#
+# Given a station name pattern (wildcards _ and %), returns the one
+# (Station_ID, Station_Name) it matches.
+#
+def resolve_station(dbConn, pattern):
+    resolver = stations.get_resolver(dbConn)
+    found = resolver.like(pattern)
+    if len(found) == 0:
+        raise AnalysisError("No station found...", [s[2] for s in resolver.suggest(pattern)])
+    if len(found) > 1:
+        raise AnalysisError("Multiple stations found...")
+    return found[0]
+
+##################################################################
+#
+# option 1: stations matching a partial name
+#
+@cached
+def find_stations(dbConn, pattern):
+    resolver = stations.get_resolver(dbConn)
+    found = resolver.like(pattern)
+    if len(found) == 0:
+        raise AnalysisError("No stations found...", [s[2] for s in resolver.suggest(pattern)])
+    return {"columns": ["station_id", "station_name"], "rows": found}
+
+##################################################################
+#
+# option 2: ridership split by type of day for one station
+#
+@reads_rollup
+@cached
+def day_type_ridership(dbConn, name):
+    resolver = stations.get_resolver(dbConn)
+    stationIDs = resolver.exact(name)
+    dayTypes = {}
+    store = ridership_store()
+    dbCursor = dbConn.cursor()
+    #every station with that exact name counts, as in a join on Station_Name
+    for stationID in stationIDs:
+        if store is not None:
+            stationTypes = store.day_type_ridership(stationID)
+        else:
+            dbCursor.execute(queries.DAY_TYPE_RIDERSHIP, [stationID])
+            stationTypes = dict(dbCursor.fetchall())
+        for dayType, riders in stationTypes.items():
+            dayTypes[dayType] = dayTypes.get(dayType, 0) + (riders or 0)
+    if dayTypes.get('W') is None:
+        suggestions = [s[2] for s in resolver.suggest(name)] if len(stationIDs) == 0 else []
+        raise AnalysisError("No data found...", suggestions)
+    #every type of day counts toward the total, not only the three shown
+    total = sum(dayTypes.values())
+    rows = []
+    for label, dayType in [("weekday", 'W'), ("saturday", 'A'), ("sunday/holiday", 'U')]:
+        riders = dayTypes.get(dayType, 0)
+        rows.append((label, riders, percentage(riders, total)))
+    return {"station_name": name, "total": total,
+            "columns": ["type_of_day", "riders", "percentage"], "rows": rows}
+
+##################################################################
+#
+# option 3: weekday ridership of every station, busiest first
+#
+@reads_rollup
+@cached
+def weekday_ranking(dbConn):
+    store = ridership_store()
+    if store is not None:
+        #per Station_ID -> per Station_Name, like the SQL's Group By
+        resolver = stations.get_resolver(dbConn)
+        perStation = store.weekday_ridership()
+        byName = {}
+        for stationID, riders in perStation:
+            name = resolver.name_of(stationID)
+            if name is not None:
+                byName[name] = byName.get(name, 0) + riders
+        weekDayRiders = sorted(byName.items(), key=lambda station: -station[1])
+        total = sum(riders for stationID, riders in perStation) if perStation else None
+    else:
+        dbCursor = dbConn.cursor()
+        dbCursor.execute(queries.WEEKDAY_RIDERSHIP_BY_STATION)
+        found = dbCursor.fetchall()
+        weekDayRiders = [(name, riders) for name, riders, total in found]
+        total = found[0][2] if len(found) > 0 else None
+    rows = [(name, riders, percentage(riders, total)) for name, riders in weekDayRiders]
+    return {"total": total, "columns": ["station_name", "riders", "percentage"], "rows": rows}
+
+##################################################################
+#
+# option 4: stops on a line going one direction
+#
+def line_color(dbConn, color):
+    colorCheck = network.get_network(dbConn).line_color(color)
+    if colorCheck is None:
+        raise AnalysisError("No such line...")
+    return colorCheck
+
+@cached
+def line_stops(dbConn, color, direction):
+    color = line_color(dbConn, color)
+    stops = network.get_network(dbConn).stops_on(color, direction)
+    if len(stops) == 0:
+        raise AnalysisError("That line does not run in the direction chosen...")
+    rows = [(stop.name, stop.direction, stop.ada) for stop in stops]
+    return {"line": color, "direction": direction,
+            "columns": ["stop_name", "direction", "ada"], "rows": rows}
+
+##################################################################
+#
+# option 5: number of stops per line color and direction
+#
+@cached
+def stop_counts(dbConn):
+    model = network.get_network(dbConn)
+    totalStops = len(model.stops)
+    rows = [(color, direction, count, percentage(count, totalStops))
+            for color, direction, count in model.stop_counts()]
+    return {"total_stops": totalStops,
+            "columns": ["color", "direction", "stops", "percentage"], "rows": rows}
+
+##################################################################
+#
+# option 6: yearly ridership at one station
+#
+@reads_rollup
+@cached
+def yearly_ridership(dbConn, stationID, name):
+    store = ridership_store()
+    if store is not None:
+        rows = store.yearly_ridership(stationID)
+    else:
+        dbCursor = dbConn.cursor()
+        dbCursor.execute(queries.YEARLY_RIDERSHIP, [stationID])
+        rows = dbCursor.fetchall()
+    return {"station_id": stationID, "station_name": name,
+            "columns": ["year", "riders"], "rows": rows}
+
+##################################################################
+#
+# option 7: monthly ridership at one station within a year
+#
+@reads_rollup
+@cached
+def monthly_ridership(dbConn, stationID, name, year):
+    store = ridership_store()
+    if store is not None:
+        rows = store.monthly_ridership(stationID, year)
+    else:
+        dbCursor = dbConn.cursor()
+        dbCursor.execute(queries.MONTHLY_RIDERSHIP, [stationID, year])
+        rows = dbCursor.fetchall()
+    return {"station_id": stationID, "station_name": name, "year": year,
+            "columns": ["month", "riders"], "rows": rows}
+
+##################################################################
+#
+# option 8: daily ridership of two or more stations side by side for
+# a year, aligned on the date (see comparison.py)
+#
+@cached
+def compare_stations(dbConn, year, *stationList):
+    store = ridership_store()
+    if store is not None:
+        seriesList = [store.daily_ridership(stationID, year) for stationID, name in stationList]
+    else:
+        #every station's year in one query
+        stationIDs = [stationID for stationID, name in stationList]
+        dbCursor = dbConn.cursor()
+        byStation = {}
+        if daynumbers.has_day_numbers(dbConn):
+            yearStart, yearEnd = daynumbers.year_days(year)
+            dbCursor.execute(queries.daily_ridership_by_day_of(len(stationIDs)), stationIDs + [yearStart, yearEnd])
+            for stationID, day, riders in dbCursor.fetchall():
+                byStation.setdefault(stationID, []).append((daynumbers.day_date(day), riders))
+        else:
+            yearStart, yearEnd = queries.year_range(year)
+            dbCursor.execute(queries.daily_ridership_of(len(stationIDs)), stationIDs + [yearStart, yearEnd])
+            for stationID, day, riders in dbCursor.fetchall():
+                byStation.setdefault(stationID, []).append((day, riders))
+        seriesList = [byStation.get(stationID, []) for stationID in stationIDs]
+    dates, values, present = comparison.align(seriesList)
+    summary = comparison.summarize(values, present)
+    result = {"year": year, "stations": [], "dates": dates}
+    for i, (stationID, name) in enumerate(stationList):
+        series = seriesList[i]
+        result["stations"].append({"station_id": stationID, "station_name": name,
+                                   "first_days": series[:5], "last_days": series[-5:],
+                                   "total": sum(values[i]), "missing_days": len(dates) - sum(present[i]),
+                                   "rolling_mean": summary["rolling_means"][i]})
+    #one row per calendar day: (day number, riders at each station)
+    result["columns"] = ["day"] + [f"riders_{i + 1}" for i in range(len(stationList))]
+    result["rows"] = [(d + 1,) + tuple(series[d] for series in values) for d in range(len(dates))]
+    result["differences"] = summary["differences"]
+    result["correlation"] = summary["correlation"]
+    return result
+
+##################################################################
+#
+# option 9: stations within a radius of a point
+#
+def check_latitude(latitude):
+    try:
+        latitude = float(latitude)
+    except ValueError:
+        raise AnalysisError("Latitude entered is not a number...")
+    if latitude > 43 or latitude < 40:
+        raise AnalysisError("Latitude entered is out of bounds...")
+    return latitude
+
+def check_longitude(longitude):
+    try:
+        longitude = float(longitude)
+    except ValueError:
+        raise AnalysisError("Longitude entered is not a number...")
+    if longitude < -88 or longitude > -87:
+        raise AnalysisError("Longitude entered is out of bounds...")
+    return longitude
+
+@cached
+def nearby_stations(dbConn, latitude, longitude, miles=1.0):
+    latitude = check_latitude(latitude)
+    longitude = check_longitude(longitude)
+    nearby = spatial.get_index(dbConn).within(latitude, longitude, float(miles))
+    if len(nearby) == 0:
+        raise AnalysisError("No stations found...")
+    rows = [(stop[1], stop[2], stop[3], distance) for stop, distance in nearby]
+    return {"latitude": latitude, "longitude": longitude, "miles": float(miles),
+            "columns": ["station_name", "latitude", "longitude", "miles"], "rows": rows}
+
+#"5" -> 5; asking for the nearest stations means at least one
+def check_count(count):
+    try:
+        count = int(count)
+    except (TypeError, ValueError):
+        raise AnalysisError("Number of stations entered is not a number...")
+    if count < 1:
+        raise AnalysisError("Number of stations entered is not a positive number...")
+    return count
+
+#the count stations closest to the point within the given miles, nearest first
+@cached
+def nearest_stations(dbConn, latitude, longitude, count, miles=1.0):
+    latitude = check_latitude(latitude)
+    longitude = check_longitude(longitude)
+    count = check_count(count)
+    nearest = spatial.get_index(dbConn).nearest(latitude, longitude, count, float(miles))
+    if len(nearest) == 0:
+        raise AnalysisError("No stations found...")
+    rows = [(stop[1], stop[2], stop[3], distance) for stop, distance in nearest]
+    return {"latitude": latitude, "longitude": longitude, "miles": float(miles), "nearest": count,
+            "columns": ["station_name", "latitude", "longitude", "miles"], "rows": rows}
+
+##################################################################
+#
+# option 10: handicap accessible stops on a line
+#
+@cached
+def ada_stops(dbConn, color):
+    color = line_color(dbConn, color)
+    model = network.get_network(dbConn)
+    stops = model.ada_stops(color)
+    if len(stops) == 0:
+        raise AnalysisError("That line has no handicap accessible stops...")
+    rows = [(stop.name, stop.direction, model.stations[stop.stationID].name if stop.stationID in model.stations else None)
+            for stop in stops]
+    return {"line": color, "columns": ["stop_name", "direction", "station_name"], "rows": rows}
+
+##################################################################
+#
+# option 11: stations served by more than one line
+#
+@cached
+def transfer_stations(dbConn):
+    found = network.get_network(dbConn).transfer_stations()
+    rows = [(station.name, len(station.colors), ", ".join(station.colors)) for station in found]
+    return {"columns": ["station_name", "lines", "colors"], "rows": rows}
+
+##################################################################
+#
+# option 12: station leaderboard for a type of day, range of years
+# and line color, a page at a time (see rankings.py)
+#
+#every station's riders and share of the total for one set of filters,
+#computed once and kept in the result cache for the pages that follow
+@reads_rollup
+@cached
+def station_totals(dbConn, dayType, firstYear, lastYear, color):
+    stationIDs = network.get_network(dbConn).stations_served_by(color) if color is not None else None
+    where, params = queries.ranking_filter(dayType, firstYear, lastYear, stationIDs)
+    if _partitions is not None:
+        #per Station_ID -> per Station_Name, like the SQL's Group By
+        resolver = stations.get_resolver(dbConn)
+        byName = {}
+        for stationID, riders in _partitions.station_riders(where, params, firstYear, lastYear):
+            name = resolver.name_of(stationID)
+            if name is not None:
+                byName[name] = byName.get(name, 0) + riders
+        total = sum(byName.values())
+        rows = [(name, riders, percentage(riders, total)) for name, riders in byName.items()]
+    else:
+        dbCursor = dbConn.cursor()
+        dbCursor.execute(queries.station_totals_of(where), params)
+        found = dbCursor.fetchall()
+        total = found[0][3] if len(found) > 0 else 0
+        rows = [(name, riders or 0, share) for name, riders, share, stationTotal in found]
+    return {"total": total or 0, "rows": rows}
+
+def station_ranking(dbConn, order="top", count=None, cursor=None, dayType=None, firstYear=None, lastYear=None, color=None):
+    try:
+        dayType = rankings.day_type(dayType)
+        firstYear = rankings.year(firstYear)
+        lastYear = rankings.year(lastYear)
+        count = rankings.limit(count)
+    except rankings.RankingError as e:
+        raise AnalysisError(str(e))
+    if firstYear is not None and lastYear is not None and firstYear > lastYear:
+        raise AnalysisError("First year entered is after the last year...")
+    if color is not None and color.strip() != "":
+        color = line_color(dbConn, color)
+    else:
+        color = None
+    totals = station_totals(dbConn, dayType, firstYear, lastYear, color)
+    if len(totals["rows"]) == 0:
+        raise AnalysisError("No ridership found for that ranking...")
+    try:
+        rows, nextCursor = rankings.page(totals["rows"], order, count, cursor)
+    except rankings.RankingError as e:
+        raise AnalysisError(str(e))
+    return {"order": order, "day_type": dayType, "first_year": firstYear, "last_year": lastYear, "line": color,
+            "total": totals["total"], "stations": len(totals["rows"]), "next_cursor": nextCursor,
+            "columns": ["rank", "station_name", "riders", "percentage"], "rows": rows}
+
+##################################################################
+#
+# run
+#
+# Given a menu option number and a dict of parameters (station,
+# station2, stations, year, line, direction, latitude, longitude,
+# miles, nearest, and option 12's order, limit, cursor, day_type, first_year
+# and last_year), runs that analysis and returns its result. stations
+# lists any stations option 8 compares beyond station and station2;
+# nearest makes option 9 return only that many of the closest stops.
+#
+def run(dbConn, option, params):
+    def need(key):
+        if params.get(key) is None:
+            raise AnalysisError(f"Option {option} needs a value for {key}...")
+        return params[key]
+    if option == 1:
+        return find_stations(dbConn, need("station"))
+    elif option == 2:
+        return day_type_ridership(dbConn, need("station"))
+    elif option == 3:
+        return weekday_ranking(dbConn)
+    elif option == 4:
+        return line_stops(dbConn, need("line"), need("direction"))
+    elif option == 5:
+        return stop_counts(dbConn)
+    elif option == 6:
+        stationID, name = resolve_station(dbConn, need("station"))
+        return yearly_ridership(dbConn, stationID, name)
+    elif option == 7:
+        stationID, name = resolve_station(dbConn, need("station"))
+        return monthly_ridership(dbConn, stationID, name, need("year"))
+    elif option == 8:
+        year = need("year")
+        stationList = [resolve_station(dbConn, need("station")), resolve_station(dbConn, need("station2"))]
+        for pattern in params.get("stations") or []:
+            stationList.append(resolve_station(dbConn, pattern))
+        return compare_stations(dbConn, year, *stationList)
+    elif option == 9:
+        if params.get("nearest") is not None:
+            return nearest_stations(dbConn, need("latitude"), need("longitude"), params["nearest"],
+                                    params.get("miles") or 1.0)
+        return nearby_stations(dbConn, need("latitude"), need("longitude"), params.get("miles") or 1.0)
+    elif option == 10:
+        return ada_stops(dbConn, need("line"))
+    elif option == 11:
+        return transfer_stations(dbConn)
+    elif option == 12:
+        return station_ranking(dbConn, params.get("order") or "top", params.get("limit"), params.get("cursor"),
+                               params.get("day_type"), params.get("first_year"), params.get("last_year"),
+                               params.get("line"))
+    else:
+        raise AnalysisError("Error, unknown command, try again...")
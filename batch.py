@@ -0,0 +1,238 @@
+# Overview: Non-interactive entry points for the CTA L analysis app.
+#
+#   python3 main.py run option6 --station "UIC-Halsted" --format json
+#   python3 main.py batch commands.txt --format csv
+#
+# "batch" reads one command per line (e.g. option7 --station Clark% --year 2010)
+# from a file, or from stdin when no file or "-" is given. One connection is
+# opened, the commands run back-to-back, and each result is written to stdout as
+# soon as it's ready, with no prompts and no plots.
+
+import argparse
+import csv
+import json
+import os
+import shlex
+import sqlite3
+import sys
+
+import analyses
+import columnar
+import partitions
+import querycontrol
+import resultcache
+import rollups
+
+COMMANDS = ("run", "batch")
+DATABASE = 'CTA2_L_daily_ridership.db'
+
+##################################################################
+#
+# CommandParser
+#
+# argparse parser for a single command. Bad arguments raise an
+# AnalysisError instead of exiting, so one bad line in a batch
+# doesn't stop the rest.
+#
+class CommandParser(argparse.ArgumentParser):
+    def error(self, message):
+        raise analyses.AnalysisError(message)
+
+#"option6" or "6" -> 6
+def option_number(text):
+    number = text.lower()
+    if number.startswith("option"):
+        number = number[len("option"):]
+    if not number.isdigit() or not 1 <= int(number) <= 12:
+        raise argparse.ArgumentTypeError(f"unknown option '{text}', expected option1-option12")
+    return int(number)
+
+##################################################################
+#
+# add_command_arguments
+#
+# Adds the menu option and the values its prompts would ask for.
+#
+def add_command_arguments(parser):
+    parser.add_argument("option", type=option_number, help="menu option, option1-option12")
+    parser.add_argument("--station", help="station name, wildcards _ and %% (options 1, 2, 6, 7, 8)")
+    parser.add_argument("--station2", help="second station name (option 8)")
+    parser.add_argument("--stations", nargs="+", help="more stations to compare (option 8)")
+    parser.add_argument("--year", help="year (options 7, 8)")
+    parser.add_argument("--line", help="line color (options 4, 10, 12)")
+    parser.add_argument("--direction", help="direction N/S/W/E (option 4)")
+    parser.add_argument("--latitude", "--lat", help="latitude (option 9)")
+    parser.add_argument("--longitude", "--lon", help="longitude (option 9)")
+    parser.add_argument("--miles", type=float, default=1.0, help="search radius in miles (option 9)")
+    parser.add_argument("--nearest", type=int, help="only the N closest stops within --miles (option 9)")
+    parser.add_argument("--order", choices=["top", "bottom"], default="top", help="busiest or quietest first (option 12)")
+    parser.add_argument("--limit", help="stations per page, default 10 (option 12)")
+    parser.add_argument("--cursor", help="next_cursor of the previous page (option 12)")
+    parser.add_argument("--day-type", help="W, A, U or all (option 12)")
+    parser.add_argument("--first-year", help="first year counted (option 12)")
+    parser.add_argument("--last-year", help="last year counted (option 12)")
+
+#the analyses.run() parameters out of parsed arguments
+def params_of(args):
+    keys = ["station", "station2", "stations", "year", "line", "direction", "latitude", "longitude", "miles",
+            "nearest", "order", "limit", "cursor", "day_type", "first_year", "last_year"]
+    return {key: getattr(args, key) for key in keys}
+
+_commandParser = CommandParser(prog="command", add_help=False)
+add_command_arguments(_commandParser)
+
+##################################################################
+#
+# JsonWriter / CsvWriter
+#
+# Write one result or error per command. JSON output is one object
+# per line; CSV output is a header row per result, every row tagged
+# with the command that produced it.
+#
+class JsonWriter:
+    def __init__(self, stream):
+        self.stream = stream
+
+    def result(self, command, params, result):
+        self.stream.write(json.dumps({"command": command, "params": params, "result": result}) + "\n")
+        self.stream.flush()
+
+    def error(self, command, message):
+        self.stream.write(json.dumps({"command": command, "error": message}) + "\n")
+        self.stream.flush()
+
+class CsvWriter:
+    def __init__(self, stream):
+        self.stream = stream
+        self.writer = csv.writer(stream)
+
+    def result(self, command, params, result):
+        self.writer.writerow(["command"] + result["columns"])
+        for row in result["rows"]:
+            self.writer.writerow([command] + list(row))
+        self.stream.flush()
+
+    def error(self, command, message):
+        self.writer.writerow(["command", "error"])
+        self.writer.writerow([command, message])
+        self.stream.flush()
+
+WRITERS = {"json": JsonWriter, "csv": CsvWriter}
+
+##################################################################
+#
+# run_command
+#
+# Given a connection, a menu option and its parameters, runs the
+# analysis and writes its result or error. Returns True on success.
+#
+def run_command(dbConn, command, option, params, writer):
+    try:
+        result = analyses.run(dbConn, option, params)
+    except analyses.AnalysisError as e:
+        writer.error(command, e.message)
+        return False
+    writer.result(command, params, result)
+    return True
+
+##################################################################
+#
+# run_commands
+#
+# Given a connection, an iterable of command lines and a writer,
+# runs each command and writes its result. Blank lines and lines
+# starting with # are skipped. Returns the number that failed.
+#
+def run_commands(dbConn, lines, writer):
+    failed = 0
+    for line in lines:
+        command = line.strip()
+        if command == "" or command.startswith("#"):
+            continue
+        try:
+            args = _commandParser.parse_args(shlex.split(command))
+        except (analyses.AnalysisError, ValueError) as e:
+            #bad arguments, or unbalanced quotes from shlex
+            failed += 1
+            writer.error(command, e.message if isinstance(e, analyses.AnalysisError) else str(e))
+            continue
+        if not run_command(dbConn, command, args.option, params_of(args), writer):
+            failed += 1
+    return failed
+
+##################################################################
+#
+# build_parser
+#
+def build_parser():
+    parser = argparse.ArgumentParser(prog="main.py", description="Run CTA L analyses without the menu.")
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+    runParser = subparsers.add_parser("run", help="run one analysis")
+    add_command_arguments(runParser)
+    batchParser = subparsers.add_parser("batch", help="run one analysis per line of a file or stdin")
+    batchParser.add_argument("file", nargs="?", default="-", help="command file, - for stdin (default)")
+    for subparser in [runParser, batchParser]:
+        subparser.add_argument("--format", choices=sorted(WRITERS), default="json", help="output format")
+        subparser.add_argument("--db", default=DATABASE, help="path to the CTA database")
+        subparser.add_argument("--partitions", metavar="CATALOG",
+                               help="use the year partitions of this catalog instead of --db (see main.py partition)")
+        subparser.add_argument("--columnar", action="store_true",
+                               help="answer ridership aggregations from the memory-mapped columnar engine (needs numpy)")
+        subparser.add_argument("--cache-stats", action="store_true", help="print result cache hits and misses to stderr")
+        subparser.add_argument("--query-timeout", type=float, help="seconds an analysis may run before it is stopped")
+        resultcache.add_arguments(subparser)
+    return parser
+
+##################################################################
+#
+# main
+#
+# Given the command line arguments after main.py, runs the requested
+# commands. Returns the process exit code: 0 if every command
+# succeeded, 1 otherwise.
+#
+def main(argv):
+    args = build_parser().parse_args(argv)
+    dbPath = args.partitions or args.db
+    #connecting would create an empty file at a wrong path
+    if not os.path.exists(dbPath):
+        print(f"**{dbPath} not found...", file=sys.stderr)
+        return 2
+    dbConn = sqlite3.connect(dbPath)
+    if args.partitions is not None:
+        if not partitions.is_catalog(dbConn):
+            print(f"**{args.partitions} is not a partition catalog...", file=sys.stderr)
+            return 2
+        analyses.use_partitions(partitions.open_catalog(dbConn, args.partitions))
+    if not rollups.has_ridership(dbConn):
+        print(f"**{dbPath} has no Ridership table...", file=sys.stderr)
+        return 2
+    rollups.refresh_rollups(dbConn)
+    analyses.use_rollup_keeper(rollups.RollupKeeper(dbConn))
+    if args.columnar and args.partitions is None:
+        if not columnar.available():
+            print("**numpy is not installed, using SQLite...", file=sys.stderr)
+        else:
+            analyses.use_column_store(columnar.open_store(dbConn, args.db))
+    cache = resultcache.open_cache(dbConn, not args.no_cache, args.cache_size, args.cache_file)
+    analyses.use_result_cache(cache)
+    #a runaway analysis fails like any other command and the batch goes on
+    if args.query_timeout is not None:
+        analyses.use_query_guard(querycontrol.QueryGuard(args.query_timeout))
+    writer = WRITERS[args.format](sys.stdout)
+    try:
+        if args.mode == "run":
+            ok = run_command(dbConn, f"option{args.option}", args.option, params_of(args), writer)
+            failed = 0 if ok else 1
+        elif args.file == "-":
+            failed = run_commands(dbConn, sys.stdin, writer)
+        else:
+            with open(args.file) as commandFile:
+                failed = run_commands(dbConn, commandFile, writer)
+    finally:
+        if cache is not None:
+            cache.save(dbConn)
+            if args.cache_stats:
+                print(resultcache.describe(cache.stats()), file=sys.stderr)
+        dbConn.close()
+    return 0 if failed == 0 else 1
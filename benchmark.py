@@ -0,0 +1,207 @@
+# Overview: Per-option benchmark for the CTA L analyses.
+#
+#   python3 generate_db.py cta_10x.db --scale 10
+#   python3 benchmark.py cta_1x.db cta_10x.db --output bench.json
+#   python3 benchmark.py cta_10x.db --baseline bench.json
+#
+# Runs every menu option non-interactively (through analyses.run) against each
+# database, with sample inputs drawn from the data, and records latency
+# percentiles and peak memory per option to a JSON file. With --baseline, the
+# median latencies are compared to an earlier run and the exit code is 1 if any
+# option got slower than the allowed tolerance.
+
+import argparse
+import json
+import os
+import platform
+import resource
+import sqlite3
+import sys
+import time
+import tracemalloc
+
+import analyses
+import columnar
+import network
+import rollups
+import spatial
+import stations
+
+##################################################################
+#
+# sample_params
+#
+# Given a connection, returns for each option a list of parameter
+# dicts to cycle through, drawn from the stations, years and lines
+# actually in the database.
+#
+def sample_params(dbConn, count):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("Select Station_Name From Stations Order By Station_ID;")
+    names = [row[0] for row in dbCursor.fetchall()] or ["none"]
+    step = max(1, len(names) // count)
+    names = names[::step][:count]
+    dbCursor.execute("Select Min(Year), Max(Year) From RidershipRollup;")
+    firstYear, lastYear = dbCursor.fetchone()
+    if firstYear is None:
+        firstYear = lastYear = 2001
+    years = [str(firstYear + (i * 7) % (lastYear - firstYear + 1)) for i in range(len(names))]
+    dbCursor.execute("Select Color From Lines Order By Line_ID;")
+    colors = [row[0] for row in dbCursor.fetchall()] or ["Red"]
+    dbCursor.execute("Select Avg(Latitude), Avg(Longitude) From Stops;")
+    latitude, longitude = dbCursor.fetchone()
+    params = {option: [] for option in range(1, 13)}
+    for i in range(len(names)):
+        name = names[i]
+        other = names[(i + 1) % len(names)]
+        params[1].append({"station": name[:3] + "%"})
+        params[2].append({"station": name})
+        params[3].append({})
+        params[4].append({"line": colors[i % len(colors)], "direction": "NSEW"[i % 4]})
+        params[5].append({})
+        params[6].append({"station": name})
+        params[7].append({"station": name, "year": years[i]})
+        params[8].append({"station": name, "station2": other, "year": years[i]})
+        params[9].append({"latitude": (latitude or 41.88) + (i % 5 - 2) * 0.01,
+                          "longitude": (longitude or -87.63) + (i % 3 - 1) * 0.01, "miles": 1.0})
+        params[10].append({"line": colors[i % len(colors)]})
+        params[11].append({})
+        params[12].append({"order": ("top", "bottom")[i % 2], "limit": str(5 + i % 10), "day_type": "WAU"[i % 3],
+                           "first_year": years[i], "line": colors[i % len(colors)] if i % 2 else None})
+    return params
+
+#value at a percentile of an already sorted list
+def percentile(values, p):
+    if len(values) == 0:
+        return 0
+    return values[min(len(values) - 1, int(round((len(values) - 1) * p / 100)))]
+
+##################################################################
+#
+# time_option
+#
+# Given a connection, an option and its parameter dicts, runs it
+# repeat times and returns latency percentiles (ms) and peak Python
+# memory (bytes) while it ran.
+#
+def time_option(dbConn, option, paramList, repeat):
+    latencies = []
+    errors = 0
+    tracemalloc.start()
+    for i in range(repeat):
+        params = paramList[i % len(paramList)]
+        started = time.perf_counter()
+        try:
+            analyses.run(dbConn, option, params)
+        except analyses.AnalysisError:
+            #e.g. a line that doesn't run that way; still a real request
+            errors += 1
+        latencies.append((time.perf_counter() - started) * 1000)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    latencies.sort()
+    return {"runs": repeat, "errors": errors,
+            "mean_ms": sum(latencies) / len(latencies), "min_ms": latencies[0],
+            "p50_ms": percentile(latencies, 50), "p90_ms": percentile(latencies, 90),
+            "p95_ms": percentile(latencies, 95), "p99_ms": percentile(latencies, 99),
+            "max_ms": latencies[-1], "peak_python_bytes": peak}
+
+##################################################################
+#
+# benchmark_database
+#
+# Given a database path and settings, returns the benchmark record
+# for it: table sizes, setup times and per-option results.
+#
+def benchmark_database(path, repeat, useColumnar, log):
+    #the shared station and stop indexes and network model belong to one database
+    stations.reset()
+    spatial.reset()
+    network.reset()
+    analyses.use_column_store(None)
+    record = {"database": os.path.abspath(path), "setup_ms": {}}
+    started = time.perf_counter()
+    dbConn = sqlite3.connect(path)
+    rollups.refresh_rollups(dbConn)
+    record["setup_ms"]["refresh_rollups"] = (time.perf_counter() - started) * 1000
+    if useColumnar:
+        started = time.perf_counter()
+        analyses.use_column_store(columnar.open_store(dbConn, path))
+        record["setup_ms"]["open_columnar"] = (time.perf_counter() - started) * 1000
+    dbCursor = dbConn.cursor()
+    record["rows"] = {}
+    for table in ["Stations", "Stops", "Lines", "StopDetails", "Ridership"]:
+        dbCursor.execute(f"Select Count(*) From {table};")
+        record["rows"][table] = dbCursor.fetchone()[0]
+    paramList = sample_params(dbConn, 25)
+    record["options"] = {}
+    for option in range(1, 13):
+        #first call loads the shared indexes; time it on its own
+        started = time.perf_counter()
+        try:
+            analyses.run(dbConn, option, paramList[option][0])
+        except analyses.AnalysisError:
+            pass
+        firstCall = (time.perf_counter() - started) * 1000
+        result = time_option(dbConn, option, paramList[option], repeat)
+        result["first_call_ms"] = firstCall
+        record["options"][f"option{option}"] = result
+        log(f"  option{option}: p50 {result['p50_ms']:.2f} ms, p95 {result['p95_ms']:.2f} ms, "
+            f"peak {result['peak_python_bytes'] / 1024:.0f} KiB")
+    dbConn.close()
+    record["max_rss_kib"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return record
+
+##################################################################
+#
+# compare
+#
+# Given this run and a baseline run, returns a list of messages for
+# every option whose median latency grew by more than tolerance.
+#
+def compare(results, baseline, tolerance):
+    before = {os.path.basename(r["database"]): r for r in baseline.get("databases", [])}
+    regressions = []
+    for record in results["databases"]:
+        old = before.get(os.path.basename(record["database"]))
+        if old is None:
+            continue
+        for option, result in record["options"].items():
+            oldResult = old["options"].get(option)
+            if oldResult is None or oldResult["p50_ms"] <= 0:
+                continue
+            ratio = result["p50_ms"] / oldResult["p50_ms"]
+            if ratio > 1 + tolerance:
+                regressions.append(f"{os.path.basename(record['database'])} {option}: p50 "
+                                   f"{oldResult['p50_ms']:.2f} ms -> {result['p50_ms']:.2f} ms ({ratio:.2f}x)")
+    return regressions
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark every CTA L menu option.")
+    parser.add_argument("databases", nargs="+", help="database files to benchmark")
+    parser.add_argument("--repeat", type=int, default=50, help="runs per option")
+    parser.add_argument("--columnar", action="store_true", help="use the columnar engine (needs numpy)")
+    parser.add_argument("--output", default="bench_output.json", help="where to write the results")
+    parser.add_argument("--baseline", help="earlier results to compare median latencies against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown, 0.25 = 25%%")
+    args = parser.parse_args(argv)
+    log = lambda message: print(message, file=sys.stderr)
+    results = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+               "sqlite": sqlite3.sqlite_version, "repeat": args.repeat, "columnar": args.columnar,
+               "databases": []}
+    for path in args.databases:
+        log(f"Benchmarking {path}")
+        results["databases"].append(benchmark_database(path, args.repeat, args.columnar, log))
+    with open(args.output, "w") as outputFile:
+        json.dump(results, outputFile, indent=2)
+    log(f"Results written to {args.output}")
+    if args.baseline:
+        with open(args.baseline) as baselineFile:
+            regressions = compare(results, json.load(baselineFile), args.tolerance)
+        for message in regressions:
+            print("**Regression: " + message)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,134 @@
+# Overview: Per-table change counters for the CTA L analysis app.
+# New rows show up as a higher Max(rowid), which is how the rollups, the cached
+# statistics and the saved result cache spot them cheaply. An Update or a Delete
+# in the middle of a table doesn't move that watermark, so triggers on each table
+# count those in the TableChanges table. A table's version is then its rowid
+# watermark plus its change count: any insert, update or delete moves it, made by
+# this app or any other program, and unlike PRAGMA data_version it survives a
+# restart. Changes made before the triggers were installed can't be known, so
+# install() says which tables just got them. Derived keeps the in-memory models
+# built from these tables (station resolver, network model, stop index) in step.
+
+import sqlite3
+import threading
+
+#every table the analyses read
+TABLES = ["Stations", "Stops", "Lines", "StopDetails", "Ridership"]
+
+COUNTERS = """Create Table If Not Exists TableChanges (
+                Name Text Primary Key,
+                Changes Integer Not Null
+              );"""
+
+#columns whose update counts as a change; the day number trigger (see
+#daynumbers.py) fills Day_Number in on every insert, which changes nothing
+COLUMNS = {"Ridership": ["Station_ID", "Ride_Date", "Type_of_Day", "Num_Riders"]}
+
+#"Ridership" -> ("Ridership_Changes_Update", "Ridership_Changes_Delete")
+def trigger_names(table):
+    return (f"{table}_Changes_Update", f"{table}_Changes_Delete")
+
+##################################################################
+#
+# install
+#
+# Given a connection to the CTA database and table names, creates
+# the counter table and each table's triggers if missing. Tables the
+# database doesn't have (a year partition only has Ridership) are
+# skipped. Returns the tables whose triggers were just created:
+# changes made to them earlier were never counted, so anything
+# derived from them has to be rebuilt.
+#
+def install(dbConn, tables):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute(COUNTERS)
+    dbCursor.execute("Select type, name From sqlite_master Where type In ('table', 'trigger');")
+    existing = set(dbCursor.fetchall())
+    created = []
+    for table in tables:
+        updateTrigger, deleteTrigger = trigger_names(table)
+        if ('table', table) not in existing:
+            continue
+        if ('trigger', updateTrigger) in existing and ('trigger', deleteTrigger) in existing:
+            continue
+        count = f"""Begin
+                      Insert Into TableChanges (Name, Changes) Values ('{table}', 1)
+                      On Conflict (Name) Do Update Set Changes = Changes + 1;
+                    End;"""
+        of = f" Of {', '.join(COLUMNS[table])}" if table in COLUMNS else ""
+        dbCursor.execute(f"Create Trigger If Not Exists {updateTrigger} After Update{of} On {table} {count}")
+        dbCursor.execute(f"Create Trigger If Not Exists {deleteTrigger} After Delete On {table} {count}")
+        created.append(table)
+    dbConn.commit()
+    return created
+
+##################################################################
+#
+# versions
+#
+# Given a connection to the CTA database and table names, returns
+# {table: [Max(rowid), changes]}, each one a single index lookup.
+# Works on read-only connections; a database without counters yet
+# counts 0 changes.
+#
+def versions(dbConn, tables):
+    dbCursor = dbConn.cursor()
+    try:
+        dbCursor.execute("Select Name, Changes From TableChanges;")
+        counts = dict(dbCursor.fetchall())
+    except sqlite3.OperationalError:
+        counts = {}
+    result = {}
+    for table in tables:
+        dbCursor.execute(f"Select Max(rowid) From {table};")
+        result[table] = [dbCursor.fetchone()[0] or 0, counts.get(table, 0)]
+    return result
+
+#(data_version, total_changes): moves when anyone commits a change
+def data_version(dbConn):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("Pragma data_version;")
+    return (dbCursor.fetchone()[0], dbConn.total_changes)
+
+##################################################################
+#
+# Derived
+#
+# Something built from a few tables and shared by every connection
+# (the station resolver, the network model, the stop index). get()
+# builds it on first use and again whenever one of the tables, or
+# the database file, is not what it was built from. A connection
+# whose data_version hasn't moved since its last get() skips even
+# that check. Safe to use from several threads.
+#
+class Derived:
+    def __init__(self, tables, load):
+        self.tables = tables
+        self.load = load
+        self.lock = threading.Lock()
+        self.value = None
+        self.builtFrom = None
+        #id(dbConn) -> data_version when it last matched builtFrom
+        self.seen = {}
+
+    def get(self, dbConn):
+        version = data_version(dbConn)
+        with self.lock:
+            if self.value is not None and self.seen.get(id(dbConn)) == version:
+                return self.value
+            dbCursor = dbConn.cursor()
+            dbCursor.execute("Pragma database_list;")
+            builtFrom = (dbCursor.fetchone()[2], versions(dbConn, self.tables))
+            if self.value is None or builtFrom != self.builtFrom:
+                self.value = self.load(dbConn)
+                self.builtFrom = builtFrom
+                self.seen = {}
+            self.seen[id(dbConn)] = version
+            return self.value
+
+    #forget what was built, so the next get() loads it again
+    def reset(self):
+        with self.lock:
+            self.value = None
+            self.builtFrom = None
+            self.seen = {}
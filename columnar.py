@@ -0,0 +1,211 @@
+# Overview: Optional columnar engine for the CTA L analysis app.
+# The four Ridership columns the analyses aggregate over are exported once into
+# compact typed NumPy arrays on disk (dates as day numbers, day types as small
+# codes), sorted by station then date. On startup the arrays are memory-mapped,
+# and options 2, 3, 6, 7 and 8 are answered with vectorized group-bys instead of
+# SQLite row iteration. The export is rebuilt whenever the database file changes.
+# Needs numpy; without it available() is False and the app sticks to SQLite.
+
+import importlib.util
+import json
+import os
+
+import daynumbers
+
+#numpy, imported on first use so startup doesn't pay for it
+np = None
+
+#Type_of_Day -> small code; anything else becomes OTHER
+DAY_TYPES = {'W': 0, 'A': 1, 'U': 2}
+OTHER_DAY_TYPE = 3
+COLUMNS = ["station_id", "day", "day_type", "riders"]
+#rows pulled from SQLite per fetchmany() while exporting
+EXPORT_BATCH = 100000
+#bumped when export_store() changes which rows it writes, so older exports are redone
+EXPORT_FORMAT = 2
+
+##################################################################
+#
+# available
+#
+# True if numpy is installed and the engine can be used.
+#
+def available():
+    return importlib.util.find_spec("numpy") is not None
+
+def load_numpy():
+    global np
+    if np is None:
+        import numpy
+        np = numpy
+    return np
+
+#directory holding the arrays for a database file
+def store_directory(dbPath):
+    return dbPath + ".columns"
+
+#what the database file looks like right now; a change means re-export
+def database_signature(dbPath):
+    signature = {"format": EXPORT_FORMAT}
+    for suffix in ["", "-wal"]:
+        if os.path.exists(dbPath + suffix):
+            stat = os.stat(dbPath + suffix)
+            signature["file" + suffix] = [stat.st_size, stat.st_mtime_ns]
+    return signature
+
+##################################################################
+#
+# export_store
+#
+# Given a connection and the directory to write to, streams the
+# Ridership columns into arrays, sorts them by station then day,
+# and saves one .npy file per column plus meta.json. Rows without
+# a station, a valid date or a rider count are left out, as the
+# rollup and the SQL queries leave them out of their sums.
+#
+def export_store(dbConn, directory, signature):
+    os.makedirs(directory, exist_ok=True)
+    dbCursor = dbConn.cursor()
+    #days since 1970-01-01, same as numpy's datetime64[D]; stored already on a migrated database
+    day = "Day_Number" if daynumbers.has_day_numbers(dbConn) else daynumbers.DAY_NUMBER_OF_RIDE_DATE
+    where = f"Station_ID Is Not Null And Ride_Date Is Not Null And {day} Is Not Null And Num_Riders Is Not Null"
+    dbCursor.execute(f"Select Count(*) From Ridership Where {where};")
+    numRows = dbCursor.fetchone()[0]
+    stationIDs = np.empty(numRows, dtype=np.int32)
+    days = np.empty(numRows, dtype=np.int32)
+    dayTypes = np.empty(numRows, dtype=np.uint8)
+    riders = np.empty(numRows, dtype=np.int64)
+    dbCursor.execute(f"""Select Station_ID, {day}, Type_of_Day, Num_Riders
+                         From Ridership
+                         Where {where};""")
+    filled = 0
+    while filled < numRows:
+        rows = dbCursor.fetchmany(EXPORT_BATCH)
+        if len(rows) == 0:
+            break
+        end = filled + len(rows)
+        stationIDs[filled:end] = [r[0] for r in rows]
+        days[filled:end] = [r[1] for r in rows]
+        dayTypes[filled:end] = [DAY_TYPES.get(r[2], OTHER_DAY_TYPE) for r in rows]
+        riders[filled:end] = [r[3] for r in rows]
+        filled = end
+    #station first, then day
+    order = np.lexsort((days[:filled], stationIDs[:filled]))
+    arrays = {"station_id": stationIDs[:filled][order], "day": days[:filled][order],
+              "day_type": dayTypes[:filled][order], "riders": riders[:filled][order]}
+    for name in COLUMNS:
+        np.save(os.path.join(directory, name + ".npy"), arrays[name])
+    with open(os.path.join(directory, "meta.json"), "w") as metaFile:
+        json.dump({"signature": signature, "rows": int(filled)}, metaFile)
+
+##################################################################
+#
+# ColumnStore
+#
+# Memory-mapped Ridership columns, sorted by station then day.
+# Each method mirrors one of the SQL queries in queries.py.
+#
+class ColumnStore:
+    def __init__(self, directory):
+        self.directory = directory
+        self.stationID = np.load(os.path.join(directory, "station_id.npy"), mmap_mode="r")
+        self.day = np.load(os.path.join(directory, "day.npy"), mmap_mode="r")
+        self.dayType = np.load(os.path.join(directory, "day_type.npy"), mmap_mode="r")
+        self.riders = np.load(os.path.join(directory, "riders.npy"), mmap_mode="r")
+        #where each station's run of rows starts and ends
+        self.stations, self.starts = np.unique(self.stationID, return_index=True)
+        self.ends = np.append(self.starts[1:], len(self.stationID))
+
+    def __len__(self):
+        return len(self.stationID)
+
+    #(start, end) of one station's rows, empty if it has none
+    def _station_slice(self, stationID):
+        i = np.searchsorted(self.stations, stationID)
+        if i == len(self.stations) or self.stations[i] != stationID:
+            return (0, 0)
+        return (int(self.starts[i]), int(self.ends[i]))
+
+    #(start, end) of one station's rows within [firstDay, lastDay)
+    def _station_days(self, stationID, firstDay, lastDay):
+        start, end = self._station_slice(stationID)
+        days = self.day[start:end]
+        return (start + int(np.searchsorted(days, firstDay, "left")),
+                start + int(np.searchsorted(days, lastDay, "left")))
+
+    #sum of values over each run of equal keys; keys must be sorted
+    @staticmethod
+    def _group_sum(keys, values):
+        if len(keys) == 0:
+            return keys, values
+        uniqueKeys, firsts = np.unique(keys, return_index=True)
+        return uniqueKeys, np.add.reduceat(values, firsts)
+
+    #option 2: {Type_of_Day: riders} for one station, every other day type under None
+    def day_type_ridership(self, stationID):
+        start, end = self._station_slice(stationID)
+        dayTypes = self.dayType[start:end]
+        riders = self.riders[start:end]
+        totals = {}
+        for code, n in list(DAY_TYPES.items()) + [(None, OTHER_DAY_TYPE)]:
+            mask = dayTypes == n
+            if mask.any():
+                totals[code] = int(riders[mask].sum())
+        return totals
+
+    #option 3: [(Station_ID, weekday riders)] for every station with weekday rows
+    def weekday_ridership(self):
+        if len(self.starts) == 0:
+            return []
+        isWeekday = self.dayType == DAY_TYPES['W']
+        sums = np.add.reduceat(np.where(isWeekday, self.riders, 0), self.starts)
+        counts = np.add.reduceat(isWeekday.astype(np.int64), self.starts)
+        return [(int(s), int(total)) for s, total, n in zip(self.stations, sums, counts) if n > 0]
+
+    #option 6: [(year as text, riders)] for one station
+    def yearly_ridership(self, stationID):
+        start, end = self._station_slice(stationID)
+        years = self.day[start:end].astype("datetime64[D]").astype("datetime64[Y]").astype(np.int64) + 1970
+        years, sums = self._group_sum(years, self.riders[start:end])
+        return [(str(int(y)), int(total)) for y, total in zip(years, sums)]
+
+    #option 7: [("MM/YYYY", riders)] for one station in one year
+    def monthly_ridership(self, stationID, year):
+        #a year that isn't a number is an empty range
+        firstDay, lastDay = daynumbers.year_days(year)
+        start, end = self._station_days(stationID, firstDay, lastDay)
+        months = self.day[start:end].astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+        months, sums = self._group_sum(months, self.riders[start:end])
+        return [(f"{m % 12 + 1:02d}/{m // 12 + 1970:04d}", int(total)) for m, total in zip(months, sums)]
+
+    #option 8: [("YYYY-MM-DD", riders)] for every day of one station's year,
+    #one row per day like "Group By Ride_Date"
+    def daily_ridership(self, stationID, year):
+        firstDay, lastDay = daynumbers.year_days(year)
+        start, end = self._station_days(stationID, firstDay, lastDay)
+        days, firsts = np.unique(self.day[start:end], return_index=True)
+        riders = self.riders[start:end][firsts]
+        dates = days.astype("datetime64[D]").astype(str)
+        return [(str(d), int(r)) for d, r in zip(dates, riders)]
+
+##################################################################
+#
+# open_store
+#
+# Given a connection and the path of its database file, returns a
+# ColumnStore, exporting the columns first if they are missing or
+# the database file changed since the last export.
+#
+def open_store(dbConn, dbPath):
+    load_numpy()
+    directory = store_directory(dbPath)
+    signature = database_signature(dbPath)
+    meta = None
+    try:
+        with open(os.path.join(directory, "meta.json")) as metaFile:
+            meta = json.load(metaFile)
+    except (OSError, ValueError):
+        pass
+    if meta is None or meta.get("signature") != signature:
+        export_store(dbConn, directory, signature)
+    return ColumnStore(directory)
@@ -0,0 +1,128 @@
+# Overview: Date-aligned comparison of daily ridership series (option 8).
+# Each station's (date, riders) series is laid out on one shared calendar, from
+# the first to the last day any of them has data, so day N means the same date
+# for every station. A station missing a day, or whose riders that day are NULL,
+# gets 0 riders for it, and days where any station is missing are left out of
+# the correlations. Differences,
+# correlations and rolling means are computed with NumPy when it is installed
+# (see columnar.available()) and in plain Python otherwise.
+
+import datetime
+import math
+
+import columnar
+
+#days in each rolling mean
+ROLLING_WINDOW = 7
+
+#every "YYYY-MM-DD" from first to last, inclusive
+def calendar(first, last):
+    day = datetime.date.fromisoformat(first)
+    lastDay = datetime.date.fromisoformat(last)
+    dates = []
+    while day <= lastDay:
+        dates.append(day.isoformat())
+        day += datetime.timedelta(days=1)
+    return dates
+
+##################################################################
+#
+# align
+#
+# Given a list of [(date, riders)] series, returns (dates, values,
+# present): the shared calendar, then per series its riders on each
+# of those days (0 when missing) and whether it had data that day.
+# A day whose riders are None counts as missing.
+#
+def align(seriesList):
+    days = [day for series in seriesList for day, riders in series]
+    if len(days) == 0:
+        return ([], [[] for series in seriesList], [[] for series in seriesList])
+    dates = calendar(min(days), max(days))
+    position = {date: i for i, date in enumerate(dates)}
+    values = []
+    present = []
+    for series in seriesList:
+        riders = [0] * len(dates)
+        has = [False] * len(dates)
+        for day, n in series:
+            if n is not None:
+                riders[position[day]] = n
+                has[position[day]] = True
+        values.append(riders)
+        present.append(has)
+    return (dates, values, present)
+
+##################################################################
+#
+# summarize
+#
+# Given the aligned values and presence flags, returns a dict with
+# "differences" (each series minus the first, per day), "correlation"
+# (matrix over the days every series has, None where undefined) and
+# "rolling_means" (per series, mean of the days present in the last
+# ROLLING_WINDOW days, None before any).
+#
+def summarize(values, present, window=ROLLING_WINDOW):
+    if columnar.available():
+        return _summarize_numpy(values, present, window)
+    return _summarize_python(values, present, window)
+
+def _summarize_numpy(values, present, window):
+    np = columnar.load_numpy()
+    riders = np.array(values, dtype=np.float64).reshape(len(values), -1)
+    has = np.array(present, dtype=bool).reshape(len(values), -1)
+    #a missing day counts 0, never NaN, so the integer differences stay exact
+    riders = np.where(has, np.nan_to_num(riders), 0)
+    differences = (riders[1:] - riders[0]).astype(np.int64)
+    #correlation over the days every series has
+    common = has.all(axis=0)
+    correlation = [[None] * len(values) for series in values]
+    if common.sum() > 1:
+        shared = riders[:, common]
+        centered = shared - shared.mean(axis=1, keepdims=True)
+        norms = np.sqrt((centered ** 2).sum(axis=1))
+        for i in range(len(values)):
+            for j in range(len(values)):
+                if norms[i] > 0 and norms[j] > 0:
+                    correlation[i][j] = float((centered[i] * centered[j]).sum() / (norms[i] * norms[j]))
+    #rolling sums of riders and of days present, as differences of cumulative sums
+    zero = np.zeros((len(values), 1))
+    sums = np.cumsum(np.hstack([zero, np.where(has, riders, 0)]), axis=1)
+    counts = np.cumsum(np.hstack([zero, has.astype(np.float64)]), axis=1)
+    ends = np.arange(1, riders.shape[1] + 1)
+    starts = np.maximum(ends - window, 0)
+    windowSums = sums[:, ends] - sums[:, starts]
+    windowCounts = counts[:, ends] - counts[:, starts]
+    rolling = [[float(s / c) if c > 0 else None for s, c in zip(rowSums, rowCounts)]
+               for rowSums, rowCounts in zip(windowSums, windowCounts)]
+    return {"differences": differences.tolist(), "correlation": correlation, "rolling_means": rolling}
+
+def _summarize_python(values, present, window):
+    differences = [[b - a for a, b in zip(values[0], other)] for other in values[1:]]
+    common = [all(has) for has in zip(*present)]
+    shared = [[v for v, keep in zip(series, common) if keep] for series in values]
+    correlation = [[None] * len(values) for series in values]
+    if sum(common) > 1:
+        means = [sum(series) / len(series) for series in shared]
+        centered = [[v - mean for v in series] for series, mean in zip(shared, means)]
+        norms = [math.sqrt(sum(v * v for v in series)) for series in centered]
+        for i in range(len(values)):
+            for j in range(len(values)):
+                if norms[i] > 0 and norms[j] > 0:
+                    correlation[i][j] = sum(a * b for a, b in zip(centered[i], centered[j])) / (norms[i] * norms[j])
+    rolling = []
+    for series, has in zip(values, present):
+        means = []
+        total = 0
+        count = 0
+        for i in range(len(series)):
+            if has[i]:
+                total += series[i]
+                count += 1
+            if i >= window and has[i - window]:
+                total -= series[i - window]
+                count -= 1
+            means.append(total / count if count > 0 else None)
+        rolling.append(means)
+    return {"differences": differences, "correlation": correlation, "rolling_means": rolling}
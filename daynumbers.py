@@ -0,0 +1,205 @@
+# Overview: Integer day numbers and the Calendar dimension for the CTA L analysis app.
+#
+#   python3 main.py migrate [--db CTA2_L_daily_ridership.db]
+#
+# Ride_Date is stored as text ("YYYY-MM-DD 00:00:00.000"), so filtering or grouping
+# by year and month parsed it on every row. The migration adds Day_Number to
+# Ridership (days since 1970-01-01, the same day the column store and numpy's
+# datetime64[D] use), backfills it a batch of rowids per transaction, indexes it
+# as (Station_ID, Day_Number, Num_Riders), and fills Calendar with one row per day:
+# date, year, month, day of month, weekday and a holiday flag. A trigger numbers
+# rows inserted later. A year or month is then a range of integers, and its
+# calendar fields are one primary key lookup away. Queries call has_day_numbers()
+# and keep using Ride_Date on databases that haven't been migrated.
+
+import argparse
+import datetime
+import sqlite3
+import sys
+import time
+
+#rowids numbered per Update and transaction
+BATCH_ROWS = 100000
+#julianday() of 1970-01-01 00:00
+JULIAN_EPOCH = 2440587.5
+EPOCH = datetime.date(1970, 1, 1).toordinal()
+TRIGGER = "Ridership_Day_Number"
+INDEX = "idx_ridership_station_day"
+
+DAY_NUMBER_OF_RIDE_DATE = f"Cast(julianday(Ride_Date) - {JULIAN_EPOCH} As Integer)"
+
+#Weekday is Monday = 0 through Sunday = 6; a holiday is a day other than
+#Sunday that the CTA counted as Sunday/holiday ('U')
+CALENDAR = """Create Table If Not Exists Calendar (
+                Day_Number Integer Primary Key,
+                Date Text Not Null,
+                Year Integer Not Null,
+                Month Integer Not Null,
+                Day Integer Not Null,
+                Weekday Integer Not Null,
+                Is_Holiday Integer Not Null
+              );"""
+
+#"YYYY-MM-DD..." -> day number
+def day_number(text):
+    return datetime.date.fromisoformat(text[:10]).toordinal() - EPOCH
+
+#day number -> "YYYY-MM-DD"
+def day_date(dayNumber):
+    return datetime.date.fromordinal(EPOCH + dayNumber).isoformat()
+
+##################################################################
+#
+# year_days
+#
+# Given a year typed by the user, returns the half-open range
+# [start, end) of day numbers within that year. A year that isn't
+# a number (or a date) gives an empty range, like year_range in
+# queries.py.
+#
+def year_days(year):
+    year = str(year).strip()
+    if not year.isdigit() or not 1 <= int(year) < 9999:
+        return (0, 0)
+    return (datetime.date(int(year), 1, 1).toordinal() - EPOCH, datetime.date(int(year) + 1, 1, 1).toordinal() - EPOCH)
+
+##################################################################
+#
+# has_day_numbers
+#
+# Given a connection to the CTA database, returns True if it has been
+# migrated. The trigger is created last, so its presence means every
+# row is numbered and the index and Calendar are in place.
+#
+def has_day_numbers(dbConn):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("Select 1 From sqlite_master Where type = 'trigger' And name = ?;", [TRIGGER])
+    return dbCursor.fetchone() is not None
+
+##################################################################
+#
+# fill_calendar
+#
+# Given a connection to a migrated database, adds the Calendar rows
+# for the days of the Ridership rows with afterRowID < rowid <= upToRowID
+# (every row by default), plus any days between them and the last day
+# already there, and flags their holidays. Returns the days added.
+#
+def fill_calendar(dbConn, afterRowID=0, upToRowID=None):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute(CALENDAR)
+    if upToRowID is None:
+        dbCursor.execute("Select Max(rowid) From Ridership;")
+        upToRowID = dbCursor.fetchone()[0] or 0
+    #one pass: every day present, and whether any station had it as a 'U' day
+    dbCursor.execute("""Select Day_Number, Max(Type_of_Day = 'U')
+                        From Ridership
+                        Where rowid > ? And rowid <= ? And Day_Number Is Not Null
+                        Group By Day_Number;""", [afterRowID, upToRowID])
+    sundayTypes = dict(dbCursor.fetchall())
+    if len(sundayTypes) == 0:
+        return 0
+    dbCursor.execute("Select Max(Day_Number) From Calendar;")
+    lastDay = dbCursor.fetchone()[0]
+    first = min(sundayTypes) if lastDay is None else min(min(sundayTypes), lastDay + 1)
+    rows = []
+    for dayNumber in range(first, max(sundayTypes) + 1):
+        date = datetime.date.fromordinal(EPOCH + dayNumber)
+        holiday = 1 if sundayTypes.get(dayNumber) and date.weekday() != 6 else 0
+        rows.append((dayNumber, date.isoformat(), date.year, date.month, date.day, date.weekday(), holiday))
+    dbCursor.execute("Select Count(*) From Calendar;")
+    before = dbCursor.fetchone()[0]
+    #a day seen again keeps its row; a new 'U' count can still make it a holiday
+    dbCursor.executemany("""Insert Into Calendar (Day_Number, Date, Year, Month, Day, Weekday, Is_Holiday)
+                            Values (?, ?, ?, ?, ?, ?, ?)
+                            On Conflict (Day_Number) Do Update
+                            Set Is_Holiday = Max(Is_Holiday, excluded.Is_Holiday)
+                            Where excluded.Is_Holiday > Is_Holiday;""", rows)
+    dbCursor.execute("Select Count(*) From Calendar;")
+    return dbCursor.fetchone()[0] - before
+
+##################################################################
+#
+# migrate
+#
+# Given a connection to the CTA database, adds and backfills
+# Day_Number, indexes it, fills Calendar and installs the trigger.
+# Safe to run again: only rows still without a number are updated.
+# Calls progress(rowsDone, maxRowID) after each batch. Returns the
+# number of rows numbered.
+#
+def migrate(dbConn, batchRows=BATCH_ROWS, progress=None):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("Pragma table_info(Ridership);")
+    if "day_number" not in [row[1].lower() for row in dbCursor.fetchall()]:
+        dbCursor.execute("Alter Table Ridership Add Column Day_Number Integer;")
+    dbCursor.execute("Select Max(rowid) From Ridership;")
+    maxRowID = dbCursor.fetchone()[0] or 0
+    numbered = 0
+    #rowid ranges, so each batch is a short walk of the table b-tree
+    for low in range(0, maxRowID, batchRows):
+        dbCursor.execute(f"""Update Ridership Set Day_Number = {DAY_NUMBER_OF_RIDE_DATE}
+                             Where rowid > ? And rowid <= ? And Day_Number Is Null;""", [low, low + batchRows])
+        numbered += dbCursor.rowcount
+        dbConn.commit()
+        if progress is not None:
+            progress(min(low + batchRows, maxRowID), maxRowID)
+    dbCursor.execute(f"Create Index If Not Exists {INDEX} On Ridership (Station_ID, Day_Number, Num_Riders);")
+    fill_calendar(dbConn, 0, maxRowID)
+    #rows inserted since the backfill started, then the trigger, in one transaction
+    dbCursor.execute(f"""Update Ridership Set Day_Number = {DAY_NUMBER_OF_RIDE_DATE}
+                         Where rowid > ? And Day_Number Is Null;""", [maxRowID])
+    numbered += dbCursor.rowcount
+    dbCursor.execute(f"""Create Trigger If Not Exists {TRIGGER} After Insert On Ridership
+                         When New.Day_Number Is Null
+                         Begin
+                           Update Ridership Set Day_Number = Cast(julianday(New.Ride_Date) - {JULIAN_EPOCH} As Integer)
+                           Where rowid = New.rowid;
+                         End;""")
+    dbConn.commit()
+    fill_calendar(dbConn, maxRowID)
+    dbCursor.execute("Analyze;")
+    dbConn.commit()
+    return numbered
+
+#the command line needs batch and rollups, which import this module
+def build_parser():
+    import batch
+    parser = argparse.ArgumentParser(prog="main.py migrate",
+                                     description="Add integer day numbers and the Calendar table to the CTA database.")
+    parser.add_argument("--db", default=batch.DATABASE, help="path to the CTA database")
+    parser.add_argument("--batch-size", type=int, default=BATCH_ROWS, help="rows per transaction")
+    parser.add_argument("--quiet", action="store_true", help="only print the final summary")
+    return parser
+
+##################################################################
+#
+# main
+#
+# Given the command line arguments after "migrate", migrates the
+# database and rebuilds the rollups from the day numbers.
+#
+def main(argv):
+    import rollups
+    args = build_parser().parse_args(argv)
+    dbConn = sqlite3.connect(args.db)
+    started = time.perf_counter()
+    def progress(rowsDone, maxRowID):
+        if not args.quiet:
+            print(f"  {rowsDone:,} of {maxRowID:,} rows numbered", file=sys.stderr)
+    try:
+        numbered = migrate(dbConn, args.batch_size, progress)
+        dbCursor = dbConn.cursor()
+        dbCursor.execute("Select Count(*), Sum(Is_Holiday) From Calendar;")
+        days, holidays = dbCursor.fetchone()
+        print(f"{numbered:,} ride entries numbered, {days:,} calendar days ({holidays or 0:,} holidays) "
+              f"in {time.perf_counter() - started:.1f} s")
+        started = time.perf_counter()
+        rollups.rebuild_rollups(dbConn)
+        print(f"Rollups rebuilt in {time.perf_counter() - started:.1f} s")
+    except sqlite3.OperationalError as e:
+        print(f"**Could not migrate: {e}", file=sys.stderr)
+        return 1
+    finally:
+        dbConn.close()
+    return 0
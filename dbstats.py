@@ -0,0 +1,106 @@
+# Overview: Cached general statistics for the CTA L analysis app.
+# The counts, date range and total ridership shown at startup take several full
+# table scans, so they are stored in the AppMetadata table and recomputed only
+# when the data changes. A change is spotted through each table's rowid
+# watermark and change count (see changes.py, the same signal the rollups use)
+# across runs, and through PRAGMA data_version / total_changes within a run.
+
+import json
+import sqlite3
+
+import changes
+import daynumbers
+
+#tables whose version decides whether the cached stats are stale
+TABLES = ["Stations", "Stops", "Ridership"]
+
+#id(dbConn) -> ((data_version, total_changes), stats) for this process
+_seen = {}
+
+##################################################################
+#
+# create_metadata
+#
+# Given a connection to the CTA database, creates the key/value
+# metadata table if it doesn't exist yet.
+#
+def create_metadata(dbConn):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("""Create Table If Not Exists AppMetadata (
+                          Name Text Primary Key,
+                          Value Text Not Null);""")
+
+##################################################################
+#
+# compute_stats
+#
+# Given a connection to the CTA database, runs the full-table
+# queries behind the general statistics and returns them as a dict.
+#
+def compute_stats(dbConn):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("Select count(*) From Stations;")
+    stations = dbCursor.fetchone()[0]
+    dbCursor.execute("Select count(*) From Stops")
+    stops = dbCursor.fetchone()[0]
+    if daynumbers.has_day_numbers(dbConn):
+        #integers instead of DATE() on every row
+        dbCursor.execute("""Select count(*), MIN(Day_Number), MAX(Day_Number), SUM(Num_Riders)
+                            From Ridership""")
+        row = list(dbCursor.fetchone())
+        row[1:3] = [daynumbers.day_date(day) if day is not None else None for day in row[1:3]]
+    else:
+        dbCursor.execute("""Select count(*), MIN(DATE(Ride_Date)), MAX(DATE(Ride_Date)), SUM(Num_Riders)
+                            From Ridership""")
+        row = dbCursor.fetchone()
+    return {"stations": stations, "stops": stops, "ride_entries": row[0],
+            "start_date": row[1], "end_date": row[2], "total_riders": row[3]}
+
+##################################################################
+#
+# get_stats
+#
+# Given a connection to the CTA database, returns the general
+# statistics, recomputing and storing them only if the data changed
+# since they were last stored (or refresh is True).
+#
+def get_stats(dbConn, refresh=False):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("Pragma data_version;")
+    version = (dbCursor.fetchone()[0], dbConn.total_changes)
+    seen = _seen.get(id(dbConn))
+    if not refresh and seen is not None and seen[0] == version:
+        return seen[1]
+    cached = None
+    try:
+        create_metadata(dbConn)
+        #changes made before the triggers existed weren't counted
+        if changes.install(dbConn, TABLES):
+            refresh = True
+    except sqlite3.OperationalError:
+        #read-only connection: whatever counters there are will do
+        pass
+    versions = changes.versions(dbConn, TABLES)
+    try:
+        dbCursor.execute("Select Value From AppMetadata Where Name = 'general_statistics';")
+        row = dbCursor.fetchone()
+        cached = json.loads(row[0]) if row is not None else None
+    except sqlite3.OperationalError:
+        #read-only connection to a database without the table yet
+        pass
+    if refresh or cached is None or cached.get("versions") != versions:
+        stats = compute_stats(dbConn)
+        try:
+            dbCursor.execute("""Insert Or Replace Into AppMetadata (Name, Value)
+                                Values ('general_statistics', ?);""",
+                             [json.dumps({"versions": versions, "stats": stats})])
+            dbConn.commit()
+        except sqlite3.OperationalError:
+            #read-only connection: use the fresh stats without storing them
+            pass
+    else:
+        stats = cached["stats"]
+    #read again so our own write doesn't look like a change next time
+    dbCursor.execute("Pragma data_version;")
+    _seen[id(dbConn)] = ((dbCursor.fetchone()[0], dbConn.total_changes), stats)
+    return stats
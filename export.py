@@ -0,0 +1,334 @@
+# Overview: Streaming export of Ridership slices and analysis results.
+#
+#   python3 main.py export ridership --station "Clark%" --from 2015-01-01 --to 2019-12-31 --format csv -o clark.csv
+#   python3 main.py export ridership --format columnar -o ridership.zip
+#   python3 main.py export option6 --station UIC-Halsted --format ndjson
+#
+# Ride entries are pulled from SQLite with fetchmany() a batch at a time and
+# written out before the next batch is read, so memory stays flat however many
+# rows there are. An analysis result is built whole by analyses.run() (it may
+# come from the result cache) and then written out in batches; those results are
+# at most a few thousand rows. The rollups are brought up to date first, as in
+# the menu and batch modes. CSV and NDJSON are written as they come (gzipped if
+# the output ends in .gz). The columnar format is a zip holding one deflated file
+# per column (int64 or float64 little-endian, or int32 codes into a dictionary
+# for text) plus schema.json; columns are spooled to temporary files while
+# streaming and zipped at the end. A meter on stderr reports rows/s as the export
+# runs.
+
+import argparse
+import array
+import csv
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import zipfile
+
+import analyses
+import batch
+import rollups
+import stations
+
+#rows per fetchmany()
+BATCH_ROWS = 10000
+FORMATS = ["csv", "ndjson", "columnar"]
+#stored for a NULL in an integer column
+NULL_INT = -2 ** 63
+RIDERSHIP_COLUMNS = ["station_id", "station_name", "ride_date", "type_of_day", "num_riders"]
+
+##################################################################
+#
+# stream
+#
+# Given a cursor with a query already executed, yields its rows in
+# lists of at most size rows.
+#
+def stream(dbCursor, size=BATCH_ROWS):
+    while True:
+        rows = dbCursor.fetchmany(size)
+        if len(rows) == 0:
+            return
+        yield rows
+
+##################################################################
+#
+# ridership_slice
+#
+# Given a connection and optional filters, executes the query for
+# the matching ride entries and returns the cursor, ready to stream.
+# stationIDs limits the stations; firstDay and lastDay are inclusive
+# "YYYY-MM-DD" dates; dayType is W, A or U.
+#
+def ridership_slice(dbConn, stationIDs=None, firstDay=None, lastDay=None, dayType=None):
+    conditions = []
+    params = []
+    if stationIDs is not None:
+        conditions.append(f"Ridership.Station_ID In ({', '.join(['?'] * len(stationIDs))})")
+        params += stationIDs
+    #half-open ranges on the raw column, so the (Station_ID, Ride_Date) index applies
+    if firstDay is not None:
+        conditions.append("Ridership.Ride_Date >= ?")
+        params.append(firstDay)
+    if lastDay is not None:
+        conditions.append("Ridership.Ride_Date < date(?, '+1 day')")
+        params.append(lastDay)
+    if dayType is not None:
+        conditions.append("Ridership.Type_of_Day = ?")
+        params.append(dayType)
+    where = "Where " + " And ".join(conditions) if len(conditions) > 0 else ""
+    #with stations given the index already returns them in station, date order
+    order = "Order By Ridership.Station_ID, Ridership.Ride_Date" if stationIDs is not None else ""
+    dbCursor = dbConn.cursor()
+    dbCursor.execute(f"""Select Ridership.Station_ID, Stations.Station_Name,
+                                strftime('%Y-%m-%d', Ridership.Ride_Date), Ridership.Type_of_Day, Ridership.Num_Riders
+                         From Ridership
+                         Left Join Stations On Stations.Station_ID = Ridership.Station_ID
+                         {where}
+                         {order};""", params)
+    return dbCursor
+
+##################################################################
+#
+# TextWriter
+#
+# CSV or NDJSON rows to a file or stdout, gzipped for a .gz name.
+#
+class TextWriter:
+    def __init__(self, path, columns, format):
+        self.columns = columns
+        self.format = format
+        if path == "-":
+            self.file = sys.stdout
+        elif path.endswith(".gz"):
+            self.file = gzip.open(path, "wt", newline="", encoding="utf-8")
+        else:
+            self.file = open(path, "w", newline="", encoding="utf-8")
+        if format == "csv":
+            self.csv = csv.writer(self.file)
+            self.csv.writerow(columns)
+
+    def write(self, rows):
+        if self.format == "csv":
+            self.csv.writerows(rows)
+        else:
+            self.file.write("".join(json.dumps(dict(zip(self.columns, row))) + "\n" for row in rows))
+
+    def close(self):
+        if self.file is not sys.stdout:
+            self.file.close()
+        else:
+            self.file.flush()
+
+##################################################################
+#
+# ColumnarWriter
+#
+# Zip file with one compressed binary file per column. Each batch is
+# appended to per-column spool files, which are zipped on close.
+#
+class ColumnarWriter:
+    def __init__(self, path, columns):
+        if path == "-":
+            raise ValueError("the columnar format needs an output file (-o)")
+        self.path = path
+        self.columns = columns
+        self.types = [None] * len(columns)
+        #text column -> {value: code}; dates, day types and names repeat a lot
+        self.dictionaries = [{} for column in columns]
+        self.rows = 0
+        self.directory = tempfile.mkdtemp(prefix="cta-export-")
+        self.spools = [open(os.path.join(self.directory, f"{i}.bin"), "wb") for i in range(len(columns))]
+
+    #int, float or text, from the first value that isn't NULL
+    @staticmethod
+    def type_of(values):
+        for value in values:
+            if isinstance(value, bool) or isinstance(value, int):
+                return "int64"
+            if isinstance(value, float):
+                return "float64"
+            if value is not None:
+                return "text"
+        return None
+
+    def write(self, rows):
+        for i, values in enumerate(zip(*rows)):
+            if self.types[i] is None:
+                self.types[i] = self.type_of(values)
+            kind = self.types[i] or "int64"
+            if kind == "int64" and any(isinstance(v, float) for v in values):
+                raise ValueError(f"column {self.columns[i]} mixes integers and decimals")
+            if kind == "int64":
+                data = array.array("q", [NULL_INT if v is None else int(v) for v in values])
+            elif kind == "float64":
+                data = array.array("d", [float("nan") if v is None else float(v) for v in values])
+            else:
+                codes = self.dictionaries[i]
+                data = array.array("i", [codes.setdefault(None if v is None else str(v), len(codes)) for v in values])
+            if sys.byteorder != "little":
+                data.byteswap()
+            self.spools[i].write(data.tobytes())
+        self.rows += len(rows)
+
+    def close(self):
+        for spool in self.spools:
+            spool.close()
+        schema = {"rows": self.rows, "null_int": NULL_INT, "columns": []}
+        with zipfile.ZipFile(self.path, "w", zipfile.ZIP_DEFLATED) as archive:
+            for i, column in enumerate(self.columns):
+                kind = self.types[i] or "int64"
+                entry = {"name": column, "file": f"{column}.bin",
+                         "dtype": "<i4" if kind == "text" else ("<i8" if kind == "int64" else "<f8")}
+                if kind == "text":
+                    entry["dictionary"] = list(self.dictionaries[i])
+                schema["columns"].append(entry)
+                #copied through in chunks, so a big column never sits in memory
+                with open(os.path.join(self.directory, f"{i}.bin"), "rb") as spool, \
+                        archive.open(entry["file"], "w", force_zip64=True) as member:
+                    shutil.copyfileobj(spool, member, 1024 * 1024)
+            archive.writestr("schema.json", json.dumps(schema))
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+##################################################################
+#
+# read_columnar
+#
+# Given the path of a columnar export, returns {column: list of
+# values}, text decoded through its dictionary. For checking and
+# small files; large ones are better read column by column with
+# numpy.frombuffer(archive.read(file), dtype).
+#
+def read_columnar(path):
+    with zipfile.ZipFile(path) as archive:
+        schema = json.loads(archive.read("schema.json"))
+        result = {}
+        for entry in schema["columns"]:
+            data = array.array({"<i4": "i", "<i8": "q", "<f8": "d"}[entry["dtype"]])
+            data.frombytes(archive.read(entry["file"]))
+            if sys.byteorder != "little":
+                data.byteswap()
+            if "dictionary" in entry:
+                result[entry["name"]] = [entry["dictionary"][code] for code in data]
+            else:
+                result[entry["name"]] = [None if v == NULL_INT and entry["dtype"] == "<i8" else v for v in data]
+        return result
+
+##################################################################
+#
+# Meter
+#
+# Prints rows written and rows/s to stderr at most once a second.
+#
+class Meter:
+    def __init__(self, quiet):
+        self.quiet = quiet
+        self.rows = 0
+        self.started = time.perf_counter()
+        self.shown = self.started
+
+    def add(self, count):
+        self.rows += count
+        now = time.perf_counter()
+        if not self.quiet and now - self.shown >= 1.0:
+            self.shown = now
+            print(f"  {self.rows:,} rows, {self.rows / (now - self.started):,.0f} rows/s", file=sys.stderr)
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        return f"{self.rows:,} rows in {elapsed:.1f} s ({self.rows / max(elapsed, 1e-9):,.0f} rows/s)"
+
+#writer for a format and output path
+def open_writer(format, path, columns):
+    if format == "columnar":
+        return ColumnarWriter(path, columns)
+    return TextWriter(path, columns, format)
+
+##################################################################
+#
+# export_batches
+#
+# Given an iterable of row batches, the column names and where to
+# write, streams every batch out. Returns the Meter.
+#
+def export_batches(batches, columns, format, path, quiet=False):
+    writer = open_writer(format, path, columns)
+    meter = Meter(quiet)
+    try:
+        for rows in batches:
+            writer.write(rows)
+            meter.add(len(rows))
+    finally:
+        writer.close()
+    return meter
+
+def add_output_arguments(parser):
+    parser.add_argument("--format", choices=FORMATS, default="csv", help="output format")
+    parser.add_argument("--output", "-o", default="-", help="output file, - for stdout (default)")
+    parser.add_argument("--db", default=batch.DATABASE, help="path to the CTA database")
+    parser.add_argument("--batch-size", type=int, default=BATCH_ROWS, help="rows per fetch")
+    parser.add_argument("--quiet", action="store_true", help="no progress meter")
+
+def build_ridership_parser():
+    parser = argparse.ArgumentParser(prog="main.py export ridership", description="Export raw ride entries.")
+    parser.add_argument("what", choices=["ridership"])
+    parser.add_argument("--station", action="append", help="station name, wildcards _ and %% (repeatable)")
+    parser.add_argument("--from", dest="first", help="first day, YYYY-MM-DD")
+    parser.add_argument("--to", dest="last", help="last day, YYYY-MM-DD (included)")
+    parser.add_argument("--day-type", choices=["W", "A", "U"], help="only weekdays, Saturdays or Sundays/holidays")
+    add_output_arguments(parser)
+    return parser
+
+def build_analysis_parser():
+    parser = argparse.ArgumentParser(prog="main.py export", description="Export an analysis result.")
+    batch.add_command_arguments(parser)
+    add_output_arguments(parser)
+    return parser
+
+##################################################################
+#
+# main
+#
+# Given the command line arguments after "export", streams the
+# requested rows out and reports the rate.
+#
+def main(argv):
+    if len(argv) > 0 and argv[0] == "ridership":
+        args = build_ridership_parser().parse_args(argv)
+    else:
+        args = build_analysis_parser().parse_args(argv)
+    dbConn = sqlite3.connect(args.db)
+    try:
+        #the analyses read the rollups, so they have to exist and be current
+        rollups.refresh_rollups(dbConn)
+        if argv[0] == "ridership":
+            stationIDs = None
+            if args.station is not None:
+                resolver = stations.get_resolver(dbConn)
+                stationIDs = sorted(set(s[0] for pattern in args.station for s in resolver.like(pattern)))
+                if len(stationIDs) == 0:
+                    print("**No station found...", file=sys.stderr)
+                    return 1
+            dbCursor = ridership_slice(dbConn, stationIDs, args.first, args.last, args.day_type)
+            meter = export_batches(stream(dbCursor, args.batch_size), RIDERSHIP_COLUMNS,
+                                   args.format, args.output, args.quiet)
+        else:
+            result = analyses.run(dbConn, args.option, batch.params_of(args))
+            rows = result["rows"]
+            batches = (rows[i:i + args.batch_size] for i in range(0, len(rows), args.batch_size))
+            meter = export_batches(batches, result["columns"], args.format, args.output, args.quiet)
+    except analyses.AnalysisError as e:
+        print("**" + e.message, file=sys.stderr)
+        return 1
+    except ValueError as e:
+        print(f"**Could not export: {e}", file=sys.stderr)
+        return 1
+    finally:
+        dbConn.close()
+    if not args.quiet:
+        print(f"Exported {meter.summary()}", file=sys.stderr)
+    return 0
@@ -0,0 +1,173 @@
+# Overview: Synthetic CTA database generator.
+#
+#   python3 generate_db.py cta_1x.db
+#   python3 generate_db.py cta_10x.db --scale 10
+#   python3 generate_db.py cta_wide.db --station-scale 100 --year-scale 1
+#
+# Builds a database with the same tables and columns as CTA2_L_daily_ridership.db
+# (Stations, Stops, StopDetails, Lines, Ridership), at scale 1 about the size of the
+# real system (147 stations, 2001-2021). Station and year counts scale separately.
+# The same seed always produces the same database, so benchmark runs are comparable.
+
+import argparse
+import datetime
+import math
+import os
+import random
+import sqlite3
+import sys
+import time
+
+import ingest
+
+BASE_STATIONS = 147
+BASE_YEARS = 21
+FIRST_YEAR = 2001
+COLORS = ["Red", "Blue", "Brown", "Green", "Orange", "Pink", "Purple", "Yellow"]
+STREETS = ["Halsted", "Clark", "State", "Damen", "Western", "Kedzie", "Pulaski", "Cicero", "Austin",
+           "Harlem", "Belmont", "Fullerton", "Addison", "Irving Park", "Montrose", "Lawrence", "Chicago",
+           "Division", "Grand", "Madison", "Roosevelt", "Cermak", "35th", "47th", "63rd", "Garfield",
+           "Jackson", "Washington", "Lake", "Randolph", "Adams", "Monroe", "Quincy", "Wellington",
+           "Diversey", "Armitage", "North", "Sedgwick", "Logan", "California", "Ashland", "Racine"]
+#holidays that ride on the Sunday/holiday schedule, as (month, day)
+HOLIDAYS = [(1, 1), (7, 4), (12, 25)]
+#ride entries per executemany() call
+BATCH_ROWS = 50000
+
+##################################################################
+#
+# station_names
+#
+# Returns count unique station names built from Chicago street
+# names, e.g. "Halsted", "Clark/Lake", "Damen-Blue", "Western 3".
+#
+def station_names(count, rng):
+    names = []
+    seen = set()
+    i = 0
+    while len(names) < count:
+        street = STREETS[i % len(STREETS)]
+        form = (i // len(STREETS)) % 3
+        if form == 0:
+            name = street
+        elif form == 1:
+            name = f"{street}/{STREETS[(i * 7 + 3) % len(STREETS)]}"
+        else:
+            name = f"{street}-{COLORS[i % len(COLORS)]}"
+        round_ = i // (len(STREETS) * 3)
+        if round_ > 0:
+            name = f"{name} {round_ + 1}"
+        if name not in seen:
+            seen.add(name)
+            names.append(name)
+        i += 1
+    rng.shuffle(names)
+    return names
+
+##################################################################
+#
+# day_type
+#
+# Type_of_Day for a date: W weekday, A Saturday, U Sunday/holiday.
+#
+def day_type(date):
+    if (date.month, date.day) in HOLIDAYS or date.weekday() == 6:
+        return 'U'
+    if date.weekday() == 5:
+        return 'A'
+    return 'W'
+
+##################################################################
+#
+# generate
+#
+# Given an output path and scale factors, writes the database and
+# returns the number of ride entries.
+#
+def generate(path, stationScale, yearScale, seed, log):
+    rng = random.Random(seed)
+    if os.path.exists(path):
+        os.remove(path)
+    dbConn = sqlite3.connect(path)
+    dbConn.execute("Pragma journal_mode = OFF;")
+    dbConn.execute("Pragma synchronous = OFF;")
+    ingest.create_tables(dbConn)
+    dbCursor = dbConn.cursor()
+    numStations = max(1, round(BASE_STATIONS * stationScale))
+    numYears = max(1, round(BASE_YEARS * yearScale))
+    #lines
+    dbCursor.executemany("Insert Into Lines (Line_ID, Color) Values (?, ?);",
+                         [(i + 1, color) for i, color in enumerate(COLORS)])
+    #stations, each with a northbound/southbound or eastbound/westbound stop pair
+    stations = []
+    stops = []
+    stopLines = []
+    stopID = 30000
+    for i, name in enumerate(station_names(numStations, rng)):
+        stationID = 40000 + i * 10
+        stations.append((stationID, name))
+        latitude = rng.uniform(41.72, 42.07)
+        longitude = rng.uniform(-87.90, -87.60)
+        directions = ["N", "S"] if rng.random() < 0.7 else ["E", "W"]
+        lines = rng.sample(range(1, len(COLORS) + 1), 1 if rng.random() < 0.8 else 2)
+        ada = 1 if rng.random() < 0.6 else 0
+        for direction in directions:
+            stopID += 1
+            bound = {"N": "Northbound", "S": "Southbound", "E": "Eastbound", "W": "Westbound"}[direction]
+            stops.append((stopID, stationID, f"{name} ({bound})", direction, ada,
+                          round(latitude + rng.uniform(-0.0005, 0.0005), 6),
+                          round(longitude + rng.uniform(-0.0005, 0.0005), 6)))
+            for line in lines:
+                stopLines.append((stopID, line))
+    dbCursor.executemany("Insert Into Stations (Station_ID, Station_Name) Values (?, ?);", stations)
+    dbCursor.executemany("""Insert Into Stops (Stop_ID, Station_ID, Stop_Name, Direction, ADA, Latitude, Longitude)
+                            Values (?, ?, ?, ?, ?, ?, ?);""", stops)
+    dbCursor.executemany("Insert Into StopDetails (Stop_ID, Line_ID) Values (?, ?);", stopLines)
+    dbConn.commit()
+    #each station has its own typical weekday volume; Saturdays and Sundays are quieter
+    busyness = [math.exp(rng.gauss(8.0, 0.8)) for i in range(numStations)]
+    dayFactor = {'W': 1.0, 'A': 0.55, 'U': 0.4}
+    firstDay = datetime.date(FIRST_YEAR, 1, 1)
+    lastDay = datetime.date(FIRST_YEAR + numYears, 1, 1)
+    days = []
+    day = firstDay
+    while day < lastDay:
+        days.append((day.strftime("%Y-%m-%d 00:00:00.000"), day_type(day)))
+        day += datetime.timedelta(days=1)
+    total = 0
+    batch = []
+    started = time.perf_counter()
+    for i, (stationID, name) in enumerate(stations):
+        for rideDate, dayType in days:
+            riders = int(busyness[i] * dayFactor[dayType] * rng.uniform(0.75, 1.25))
+            batch.append((stationID, rideDate, dayType, riders))
+        if len(batch) >= BATCH_ROWS or i == len(stations) - 1:
+            dbCursor.executemany("""Insert Into Ridership (Station_ID, Ride_Date, Type_of_Day, Num_Riders)
+                                    Values (?, ?, ?, ?);""", batch)
+            dbConn.commit()
+            total += len(batch)
+            batch = []
+            log(f"  {i + 1}/{len(stations)} stations, {total:,} ride entries, "
+                f"{total / (time.perf_counter() - started):,.0f} rows/s")
+    dbConn.close()
+    return total
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Generate a synthetic CTA L ridership database.")
+    parser.add_argument("path", help="database file to create (overwritten if it exists)")
+    parser.add_argument("--scale", type=float, default=None, help="scale stations and years together")
+    parser.add_argument("--station-scale", type=float, default=1.0, help=f"stations = {BASE_STATIONS} x this")
+    parser.add_argument("--year-scale", type=float, default=1.0, help=f"years = {BASE_YEARS} x this, from {FIRST_YEAR}")
+    parser.add_argument("--seed", type=int, default=341, help="random seed")
+    parser.add_argument("--quiet", action="store_true", help="don't report progress")
+    args = parser.parse_args(argv)
+    stationScale = args.scale if args.scale is not None else args.station_scale
+    yearScale = args.scale if args.scale is not None else args.year_scale
+    log = (lambda message: None) if args.quiet else (lambda message: print(message, file=sys.stderr))
+    started = time.perf_counter()
+    rows = generate(args.path, stationScale, yearScale, args.seed, log)
+    print(f"Wrote {args.path}: {rows:,} ride entries in {time.perf_counter() - started:.1f} s")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,113 @@
+# Overview: Index maintenance for the CTA L analysis app.
+# Creates the covering indexes the menu options rely on, verifies them,
+# and reports each option's EXPLAIN QUERY PLAN before and after.
+
+import daynumbers
+import queries
+
+#(index name, table, columns)
+INDEXES = [
+    ("idx_ridership_station_date", "Ridership", ["Station_ID", "Ride_Date", "Num_Riders"]),
+    ("idx_ridership_daytype_station", "Ridership", ["Type_of_Day", "Station_ID"]),
+    ("idx_stations_name", "Stations", ["Station_Name"]),
+]
+
+##################################################################
+#
+# build_indexes
+#
+# Given a connection to the CTA database, creates any missing
+# indexes and refreshes the planner statistics.
+#
+def build_indexes(dbConn):
+    dbCursor = dbConn.cursor()
+    for name, table, columns in INDEXES:
+        dbCursor.execute(f"Create Index If Not Exists {name} On {table} ({', '.join(columns)});")
+    dbCursor.execute("Analyze;")
+    dbConn.commit()
+
+##################################################################
+#
+# verify_indexes
+#
+# Given a connection to the CTA database, checks every index exists
+# on the right table with the right columns in the right order.
+# Returns a list of (index name, problem) for the ones that don't.
+#
+def verify_indexes(dbConn):
+    dbCursor = dbConn.cursor()
+    problems = []
+    for name, table, columns in INDEXES:
+        dbCursor.execute("Select tbl_name From sqlite_master Where type = 'index' And name = ?;", [name])
+        row = dbCursor.fetchone()
+        if row is None:
+            problems.append((name, "missing"))
+            continue
+        if row[0].lower() != table.lower():
+            problems.append((name, f"on table {row[0]}, expected {table}"))
+            continue
+        dbCursor.execute(f"Pragma index_info({name});")
+        found = [r[2] for r in sorted(dbCursor.fetchall())]
+        if [c.lower() for c in found] != [c.lower() for c in columns]:
+            problems.append((name, f"columns ({', '.join(found)}), expected ({', '.join(columns)})"))
+    return problems
+
+##################################################################
+#
+# explain
+#
+# Given a connection and a statement, returns the lines of its
+# EXPLAIN QUERY PLAN output.
+#
+def explain(dbConn, sql, params):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("Explain Query Plan " + sql, params)
+    return [row[3] for row in dbCursor.fetchall()]
+
+##################################################################
+#
+# option_plans
+#
+# Given a connection to the CTA database, returns the plans of every
+# menu option's statements as {option: [[plan lines], ...]}, using
+# a real station and year from the database as sample input.
+#
+def option_plans(dbConn):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("Select Min(Station_ID) From Stations;")
+    stationID = dbCursor.fetchone()[0] or 0
+    dbCursor.execute("Select strftime('%Y', Max(Ride_Date)) From Ridership;")
+    year = dbCursor.fetchone()[0] or "2000"
+    dayRange = daynumbers.year_days(year) if daynumbers.has_day_numbers(dbConn) else None
+    plans = {}
+    for option, statements in queries.option_queries(stationID, year, dayRange).items():
+        plans[option] = [explain(dbConn, sql, params) for sql, params in statements]
+    return plans
+
+##################################################################
+#
+# report
+#
+# Given a connection to the CTA database, builds and verifies the
+# indexes and prints every menu option's query plan before and after.
+# Returns True if every index checked out.
+#
+def report(dbConn):
+    before = option_plans(dbConn)
+    print("Building indexes...")
+    build_indexes(dbConn)
+    after = option_plans(dbConn)
+    problems = verify_indexes(dbConn)
+    for name, table, columns in INDEXES:
+        status = dict(problems).get(name, "ok")
+        print(f"  {name} on {table}({', '.join(columns)}): {status}")
+    print()
+    for option in sorted(before):
+        print(f"Option {option}:")
+        for i in range(len(before[option])):
+            print(f"  statement {i + 1}")
+            for line in before[option][i]:
+                print(f"    before: {line}")
+            for line in after[option][i]:
+                print(f"    after:  {line}")
+    return len(problems) == 0
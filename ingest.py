@@ -0,0 +1,278 @@
+# Overview: Bulk loader for the public CTA data feeds.
+#
+#   python3 main.py ingest --stops CTA_L_Stops.csv --ridership CTA_L_Daily_Totals.csv
+#
+# --stops takes the "List of 'L' Stops" CSV (STOP_ID, DIRECTION_ID, STOP_NAME,
+# STATION_NAME, MAP_ID, ADA, one column per line, Location) and fills Stations,
+# Stops, Lines and StopDetails. --ridership takes the "'L' Station Entries - Daily
+# Totals" CSV (station_id, stationname, date, daytype, rides), plain or gzipped,
+# and appends to Ridership. Files are streamed in batches, one transaction per
+# batch, with the database in WAL mode. Loading is idempotent: only ride dates
+# newer than what a station already has are appended, so the same or a newer
+# feed can be loaded again at any time. The tables are created if missing.
+
+import argparse
+import csv
+import gzip
+import io
+import sqlite3
+import sys
+import time
+
+import batch
+import daynumbers
+import rollups
+
+#rows per executemany() and transaction
+BATCH_ROWS = 50000
+#line columns of the stops CSV -> Lines.Color
+LINE_COLUMNS = {"RED": "Red", "BLUE": "Blue", "G": "Green", "BRN": "Brown", "P": "Purple",
+                "PEXP": "Purple", "Y": "Yellow", "PNK": "Pink", "O": "Orange"}
+SCHEMA = """
+Create Table If Not Exists Stations (
+  Station_ID Integer Primary Key,
+  Station_Name Text
+);
+Create Table If Not Exists Stops (
+  Stop_ID Integer Primary Key,
+  Station_ID Integer,
+  Stop_Name Text,
+  Direction Text,
+  ADA Integer,
+  Latitude Real,
+  Longitude Real
+);
+Create Table If Not Exists Lines (
+  Line_ID Integer Primary Key,
+  Color Text
+);
+Create Table If Not Exists StopDetails (
+  Stop_ID Integer,
+  Line_ID Integer,
+  Primary Key (Stop_ID, Line_ID)
+);
+Create Table If Not Exists Ridership (
+  Station_ID Integer,
+  Ride_Date Text,
+  Type_of_Day Text,
+  Num_Riders Integer,
+  Primary Key (Station_ID, Ride_Date)
+);
+"""
+
+##################################################################
+#
+# create_tables
+#
+# Given a connection, creates the CTA tables if they don't exist.
+#
+def create_tables(dbConn):
+    dbConn.executescript(SCHEMA)
+
+##################################################################
+#
+# tune_for_loading
+#
+# Given a connection, switches the database to WAL and sets the
+# PRAGMAs that make large batched inserts fast. WAL stays on for
+# the file; the rest only last for this connection.
+#
+def tune_for_loading(dbConn):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("Pragma journal_mode = WAL;")
+    #WAL keeps the file consistent without a sync on every commit
+    dbCursor.execute("Pragma synchronous = NORMAL;")
+    dbCursor.execute("Pragma cache_size = -262144;")
+    dbCursor.execute("Pragma temp_store = MEMORY;")
+
+#text reader for a CSV file, gzipped or not
+def open_csv(path):
+    if path.endswith(".gz"):
+        return io.TextIOWrapper(gzip.open(path), encoding="utf-8-sig", newline="")
+    return open(path, encoding="utf-8-sig", newline="")
+
+#rows as dicts keyed by lower-case, trimmed column names
+def read_rows(csvFile):
+    reader = csv.reader(csvFile)
+    header = [name.strip().lower() for name in next(reader, [])]
+    for row in reader:
+        if len(row) == len(header):
+            yield dict(zip(header, row))
+
+##################################################################
+#
+# ride_date_style
+#
+# Given a connection, returns the text to append to YYYY-MM-DD so
+# new Ride_Date values match the ones already stored (the CTA
+# database stores a time of day; an empty one gets the same).
+#
+def ride_date_style(dbConn):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("Select Ride_Date From Ridership Limit 1;")
+    row = dbCursor.fetchone()
+    if row is None:
+        return " 00:00:00.000"
+    return row[0][10:]
+
+#"MM/DD/YYYY" (the feed) or "YYYY-MM-DD..." -> "YYYY-MM-DD"
+def iso_date(text):
+    text = text.strip()
+    if "/" in text:
+        month, day, year = text.split(" ")[0].split("/")
+        return f"{int(year):04d}-{int(month):02d}-{int(day):02d}"
+    return text[:10]
+
+#stream rows in lists of at most size
+def batches(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+##################################################################
+#
+# load_stops
+#
+# Given a connection and the path of a stops CSV, inserts or updates
+# the stations, stops and lines it lists. Returns the number of stops.
+#
+def load_stops(dbConn, path):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("Select Color, Line_ID From Lines;")
+    lineIDs = dict(dbCursor.fetchall())
+    stations = {}
+    stops = []
+    stopLines = []
+    with open_csv(path) as csvFile:
+        for row in read_rows(csvFile):
+            stationID = int(row["map_id"])
+            stations[stationID] = row["station_name"].strip()
+            latitude, longitude = [float(v) for v in row["location"].strip("() ").split(",")]
+            stops.append((int(row["stop_id"]), stationID, row["stop_name"].strip(), row["direction_id"].strip(),
+                          1 if row["ada"].strip().lower() in ("true", "1", "y") else 0, latitude, longitude))
+            for column, color in LINE_COLUMNS.items():
+                if row.get(column.lower(), "").strip().lower() in ("true", "1", "y"):
+                    if color not in lineIDs:
+                        dbCursor.execute("Insert Into Lines (Color) Values (?);", [color])
+                        lineIDs[color] = dbCursor.lastrowid
+                    stopLines.append((int(row["stop_id"]), lineIDs[color]))
+    dbCursor.executemany("""Insert Into Stations (Station_ID, Station_Name) Values (?, ?)
+                            On Conflict (Station_ID) Do Update Set Station_Name = excluded.Station_Name;""",
+                         list(stations.items()))
+    dbCursor.executemany("""Insert Into Stops (Stop_ID, Station_ID, Stop_Name, Direction, ADA, Latitude, Longitude)
+                            Values (?, ?, ?, ?, ?, ?, ?)
+                            On Conflict (Stop_ID) Do Update
+                            Set Station_ID = excluded.Station_ID, Stop_Name = excluded.Stop_Name,
+                                Direction = excluded.Direction, ADA = excluded.ADA,
+                                Latitude = excluded.Latitude, Longitude = excluded.Longitude;""", stops)
+    #a stop's lines are replaced, not merged, so a line dropped from the feed goes away
+    dbCursor.executemany("Delete From StopDetails Where Stop_ID = ?;", [(s[0],) for s in stops])
+    dbCursor.executemany("Insert Into StopDetails (Stop_ID, Line_ID) Values (?, ?);", sorted(set(stopLines)))
+    dbConn.commit()
+    return len(stops)
+
+##################################################################
+#
+# load_ridership
+#
+# Given a connection and the path of a daily totals CSV, appends the
+# ride entries newer than each station's latest Ride_Date, one batch
+# per transaction, and adds any station it hasn't seen. Calls
+# progress(rowsRead, rowsAdded) after each batch. Returns
+# (rowsRead, rowsAdded).
+#
+def load_ridership(dbConn, path, batchRows=BATCH_ROWS, progress=None):
+    dbCursor = dbConn.cursor()
+    suffix = ride_date_style(dbConn)
+    #on a migrated database the day number is written with the row rather than by the trigger
+    dayNumbers = daynumbers.has_day_numbers(dbConn)
+    #one index walk per station with idx_ridership_station_date
+    dbCursor.execute("Select Station_ID, Max(Ride_Date) From Ridership Group By Station_ID;")
+    latest = {stationID: rideDate[:10] for stationID, rideDate in dbCursor.fetchall()}
+    dbCursor.execute("Select Station_ID From Stations;")
+    knownStations = set(row[0] for row in dbCursor.fetchall())
+    rowsRead = 0
+    rowsAdded = 0
+    with open_csv(path) as csvFile:
+        for chunk in batches(read_rows(csvFile), batchRows):
+            rideRows = []
+            newStations = []
+            for row in chunk:
+                stationID = int(row["station_id"])
+                rideDate = iso_date(row["date"])
+                if rideDate <= latest.get(stationID, ""):
+                    continue
+                rideRow = (stationID, rideDate + suffix, row["daytype"].strip(), int(row["rides"].replace(",", "") or 0))
+                rideRows.append(rideRow + (daynumbers.day_number(rideDate),) if dayNumbers else rideRow)
+                if stationID not in knownStations:
+                    knownStations.add(stationID)
+                    newStations.append((stationID, row.get("stationname", "").strip()))
+            dbCursor.executemany("Insert Into Stations (Station_ID, Station_Name) Values (?, ?);", newStations)
+            #the watermarks are from before the load, so a day repeated within
+            #the feed is dropped by the primary key instead
+            if dayNumbers:
+                dbCursor.executemany("""Insert Or Ignore Into Ridership (Station_ID, Ride_Date, Type_of_Day, Num_Riders, Day_Number)
+                                        Values (?, ?, ?, ?, ?);""", rideRows)
+            else:
+                dbCursor.executemany("""Insert Or Ignore Into Ridership (Station_ID, Ride_Date, Type_of_Day, Num_Riders)
+                                        Values (?, ?, ?, ?);""", rideRows)
+            dbConn.commit()
+            rowsRead += len(chunk)
+            rowsAdded += dbCursor.rowcount if dbCursor.rowcount >= 0 else len(rideRows)
+            if progress is not None:
+                progress(rowsRead, rowsAdded)
+    return (rowsRead, rowsAdded)
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="main.py ingest", description="Load CTA CSV feeds into the database.")
+    parser.add_argument("--stops", action="append", default=[], help="'L' stops CSV (repeatable)")
+    parser.add_argument("--ridership", action="append", default=[], help="daily totals CSV, may be .gz (repeatable)")
+    parser.add_argument("--db", default=batch.DATABASE, help="path to the CTA database")
+    parser.add_argument("--batch-size", type=int, default=BATCH_ROWS, help="rows per transaction")
+    parser.add_argument("--quiet", action="store_true", help="only print the final summary")
+    return parser
+
+##################################################################
+#
+# main
+#
+# Given the command line arguments after "ingest", loads the files
+# and brings the rollups up to date.
+#
+def main(argv):
+    args = build_parser().parse_args(argv)
+    if len(args.stops) == 0 and len(args.ridership) == 0:
+        print("**Nothing to load, give --stops and/or --ridership...", file=sys.stderr)
+        return 2
+    dbConn = sqlite3.connect(args.db)
+    tune_for_loading(dbConn)
+    create_tables(dbConn)
+    try:
+        for path in args.stops:
+            print(f"{path}: {load_stops(dbConn, path):,} stops loaded")
+        for path in args.ridership:
+            started = time.perf_counter()
+            def progress(rowsRead, rowsAdded):
+                if not args.quiet:
+                    elapsed = time.perf_counter() - started
+                    print(f"  {rowsRead:,} rows read, {rowsAdded:,} added, "
+                          f"{rowsRead / elapsed:,.0f} rows/s", file=sys.stderr)
+            rowsRead, rowsAdded = load_ridership(dbConn, path, args.batch_size, progress)
+            elapsed = time.perf_counter() - started
+            print(f"{path}: {rowsRead:,} rows read, {rowsAdded:,} new ride entries added "
+                  f"in {elapsed:.1f} s ({rowsRead / max(elapsed, 1e-9):,.0f} rows/s)")
+    except (OSError, KeyError, ValueError) as e:
+        print(f"**Could not load: {e!r}", file=sys.stderr)
+        return 1
+    finally:
+        started = time.perf_counter()
+        added = rollups.refresh_rollups(dbConn)
+        if added > 0:
+            print(f"Rollups updated with {added:,} ride entries in {time.perf_counter() - started:.1f} s")
+        dbConn.close()
+    return 0
@@ -0,0 +1,159 @@
+# Overview: Local load generator for the CTA L query service.
+#
+#   python3 loadgen.py --workers 1,2,4,8 --seconds 5
+#
+# For each worker count, starts "main.py serve" on a free port, fires a mix of
+# analysis requests at it from many client threads for a fixed time, then
+# reports throughput and latency percentiles so scaling with workers is visible.
+# The servers run without the result cache unless --cache is given.
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import batch
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+##################################################################
+#
+# free_port
+#
+# Returns a TCP port nobody is listening on right now.
+#
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+##################################################################
+#
+# request_mix
+#
+# Given the base URL of a running server, returns the list of paths
+# to cycle through, built from real station names and years.
+#
+def request_mix(baseURL):
+    with urllib.request.urlopen(baseURL + "/option/1?station=%25", timeout=30) as response:
+        found = json.load(response)["result"]["rows"]
+    with urllib.request.urlopen(baseURL + "/stats", timeout=30) as response:
+        stats = json.load(response)["stats"]
+    year = (stats["end_date"] or "2000")[:4]
+    names = [row[1] for row in found[:20]] or ["none"]
+    paths = ["/option/3", "/option/5", "/option/4?line=Red&direction=N",
+             "/option/9?latitude=41.88&longitude=-87.63"]
+    for i in range(len(names)):
+        station = urllib.parse.quote(names[i])
+        other = urllib.parse.quote(names[(i + 1) % len(names)])
+        paths.append(f"/option/2?station={station}")
+        paths.append(f"/option/6?station={station}")
+        paths.append(f"/option/7?station={station}&year={year}")
+        paths.append(f"/option/8?station={station}&station2={other}&year={year}")
+    return paths
+
+##################################################################
+#
+# drive
+#
+# Given a base URL, the request paths, a client count and a
+# duration, hammers the server and returns (latencies, statuses).
+#
+def drive(baseURL, paths, clients, seconds):
+    stopAt = time.monotonic() + seconds
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+
+    def client(offset):
+        i = offset
+        while time.monotonic() < stopAt:
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(baseURL + paths[i % len(paths)], timeout=60) as response:
+                    response.read()
+                    status = response.status
+            except urllib.error.HTTPError as e:
+                status = e.code
+            except OSError:
+                status = "error"
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                statuses[status] = statuses.get(status, 0) + 1
+            i += 1
+
+    threads = [threading.Thread(target=client, args=(n * 7,)) for n in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, statuses
+
+#value at a percentile of an already sorted list
+def percentile(values, p):
+    if len(values) == 0:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+##################################################################
+#
+# wait_until_up
+#
+# Polls /health until the server answers or the process dies.
+#
+def wait_until_up(process, baseURL):
+    while process.poll() is None:
+        try:
+            with urllib.request.urlopen(baseURL + "/health", timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Measure CTA L query service throughput per worker count.")
+    parser.add_argument("--workers", default="1,2,4,8", help="comma separated worker counts to try")
+    parser.add_argument("--clients", type=int, default=0, help="client threads (default: 2 per worker)")
+    parser.add_argument("--seconds", type=float, default=5.0, help="how long to drive each server")
+    parser.add_argument("--db", default=batch.DATABASE, help="path to the CTA database")
+    parser.add_argument("--columnar", action="store_true", help="start the servers with the columnar engine")
+    parser.add_argument("--cache", action="store_true", help="let the servers cache results (measures cache hits, not workers)")
+    args = parser.parse_args(argv)
+    print(f"{'workers':>7} {'clients':>7} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}  statuses")
+    for workers in [int(w) for w in args.workers.split(",")]:
+        port = free_port()
+        baseURL = f"http://127.0.0.1:{port}"
+        command = [sys.executable, os.path.join(HERE, "main.py"), "serve", "--port", str(port),
+                   "--workers", str(workers), "--db", args.db]
+        if args.columnar:
+            command.append("--columnar")
+        #after the first pass over the mix every request would be a cache hit
+        if not args.cache:
+            command.append("--no-cache")
+        process = subprocess.Popen(command, stderr=subprocess.DEVNULL)
+        try:
+            if not wait_until_up(process, baseURL):
+                print(f"**Server with {workers} workers failed to start...")
+                return 1
+            paths = request_mix(baseURL)
+            clients = args.clients or workers * 2
+            latencies, statuses = drive(baseURL, paths, clients, args.seconds)
+        finally:
+            process.terminate()
+            process.wait()
+        latencies.sort()
+        print(f"{workers:>7} {clients:>7} {len(latencies) / args.seconds:>9.1f} "
+              f"{percentile(latencies, 50) * 1000:>8.2f} {percentile(latencies, 95) * 1000:>8.2f} "
+              f"{percentile(latencies, 99) * 1000:>8.2f}  {statuses}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,41 +1,90 @@
 # Overview: This program takes in user input, and analyzes CTA ridership data based on user command.
 # Data is fetched and analyzed using SQL Queries and Python. Some data is displayed using matplotlib.
 
+import time
+startTime = time.perf_counter()
+import os
 import sqlite3
-import matplotlib.pyplot as plt
+import sys
+import analyses
+import batch
+import columnar
+import dbstats
+import indexes
+import partitions
+import plots
+import querycontrol
+import querylog
+import resultcache
+import rollups
+
+##################################################################  
+#
+# load_pyplot
+#
+# matplotlib takes a while to import, so it is only loaded the
+# first time the user asks for a plot.
+#
+plt = None
+
+def load_pyplot():
+    global plt
+    if plt is None:
+        import matplotlib.pyplot
+        plt = matplotlib.pyplot
+    return plt
+
+##################################################################  
+#
+# flag_value
+#
+# Returns the value following a command line flag, e.g. 250 for
+# "--slow-ms 250", or default if the flag isn't there.
+#
+def flag_value(flag, default):
+    args = sys.argv[1:]
+    if flag in args and args.index(flag) + 1 < len(args):
+        return args[args.index(flag) + 1]
+    return default
 
 ##################################################################  
 #
 # print_stats
 #
-# Given a connection to the CTA database, executes various
-# SQL queries to retrieve and output basic stats.
+# Given a connection to the CTA database, outputs basic stats.
+# The stats are cached in the database and only recomputed with
+# SQL queries when the data has changed. With year partitions they
+# are added up over every partition instead.
 #
-def print_stats(dbConn):
-    #get number of stations
-    dbCursor = dbConn.cursor()
+def print_stats(dbConn, refresh=False):
+    if partitionSet is not None:
+        stats = partitionSet.stats(dbConn)
+    else:
+        stats = dbstats.get_stats(dbConn, refresh)
     print("General Statistics:")
-    dbCursor.execute("Select count(*) From Stations;")
-    row = dbCursor.fetchone();
-    print("  # of stations:", f"{row[0]:,}")
-    #get number of stops
-    dbCursor.execute("Select count(*) From Stops")
-    rowStops = dbCursor.fetchone();
-    print("  # of stops:", f"{rowStops[0]:,}")
-    #get number of ride entries
-    dbCursor.execute("Select count(*) From Ridership")
-    rowR_entries = dbCursor.fetchone();
-    print("  # of ride entries:", f"{rowR_entries[0]:,}")
-    #get date range
-    dbCursor.execute("Select MIN(DATE(Ride_Date)) AS start_date, MAX(DATE(Ride_Date)) AS end_date from Ridership")
-    rowD_entries = dbCursor.fetchone();
-    print(f"  date range: {rowD_entries[0]} - {rowD_entries[1]}")
-    #get total ridership
-    dbCursor.execute("Select SUM(Num_Riders) From Ridership")
-    rowT_riders = dbCursor.fetchone();
-    print("  Total ridership:", f"{rowT_riders[0]:,}")
+    #number of stations and stops
+    print("  # of stations:", f"{stats['stations']:,}")
+    print("  # of stops:", f"{stats['stops']:,}")
+    #number of ride entries
+    print("  # of ride entries:", f"{stats['ride_entries']:,}")
+    #date range
+    print(f"  date range: {stats['start_date']} - {stats['end_date']}")
+    #total ridership
+    print("  Total ridership:", f"{stats['total_riders']:,}")
     print()
 
+##################################################################  
+#
+# print_error
+#
+# Given an AnalysisError, prints its message the way the menu always
+# has, plus the closest station names if the user made a typo.
+#
+def print_error(error):
+    print("**" + error.message)
+    if len(error.suggestions) > 0:
+        print("  Did you mean:", ", ".join(error.suggestions))
+
 ##################################################################  
 #
 # handle menu options
@@ -60,6 +109,12 @@ def handler(user_input, dbConn):
     option8(dbConn)
   elif user_input == 9:
     option9(dbConn)
+  elif user_input == 10:
+    option10(dbConn)
+  elif user_input == 11:
+    option11(dbConn)
+  elif user_input == 12:
+    option12(dbConn)
   else:
     print("**Error, unknown command, try again...")
 
@@ -68,169 +123,105 @@ def handler(user_input, dbConn):
 # handle option 1
 def option1(dbConn):
    #find stations that match the user input
-    dbCursor = dbConn.cursor()
     print()
     user_input = input("Enter partial station name (wildcards _ and %): ")
-    dbCursor.execute("""Select Station_ID, Station_Name 
-                        From Stations 
-                        Where Station_Name Like ? 
-                        Order By Station_Name Asc;""", [user_input])
-    stations = dbCursor.fetchall()
-    #were stations found? 
-    if len(stations) == 0:
-        print("**No stations found...")
+    try:
+        result = analyses.find_stations(dbConn, user_input)
+    except analyses.AnalysisError as e:
+        #no stations found
+        print_error(e)
         return  
     #if found print stations
-    for stations in stations:
-        print(f"{stations[0]} : {stations[1]}")
+    for station in result["rows"]:
+        print(f"{station[0]} : {station[1]}")
 
 ##################################################################  
 #
 # handle option 2
 def option2(dbConn):
     #given station name from user
-    dbCursor = dbConn.cursor()
     print()
     user_input = input("Enter the name of the station you would like to analyze: ")
-    #find the number of riders on weekdays
-    dbCursor.execute("""Select Sum(Num_Riders) 
-                        From Ridership Join Stations On Ridership.Station_ID = Stations.Station_ID 
-                        Where Stations.Station_Name = ? AND Ridership.Type_of_Day = 'W'""", [user_input])
-    weekDays = dbCursor.fetchone();
-    #find the number of riders on Saturdays
-    dbCursor.execute("""Select Sum(Num_Riders) 
-                        From Ridership Join Stations On Ridership.Station_ID = Stations.Station_ID 
-                        Where Stations.Station_Name = ? AND Ridership.Type_of_Day = 'A'""", [user_input])
-    saturday = dbCursor.fetchone();
-    #find the number of riders on Sundays and holidays
-    dbCursor.execute("""Select Sum(Num_Riders) 
-                        From Ridership Join Stations On Ridership.Station_ID = Stations.Station_ID 
-                        Where Stations.Station_Name = ? AND Ridership.Type_of_Day = 'U'""", [user_input])
-    sundays_holidays = dbCursor.fetchone();
-    #find the total number of riders for specified station
-    dbCursor.execute("""Select Sum(Num_Riders) 
-                        From Ridership Join Stations On Ridership.Station_ID = Stations.Station_ID 
-                        Where Stations.Station_Name = ?;""", [user_input])
-    total = dbCursor.fetchone();
-    #check weekday data was found
-    if weekDays is None or weekDays[0] is None:
-        print("**No data found...")
+    #find the number of riders per type of day
+    try:
+        result = analyses.day_type_ridership(dbConn, user_input)
+    except analyses.AnalysisError as e:
+        #no weekday data found
+        print_error(e)
         return
-    #calculate percentages for weekdays, Saturdays, Sundays/holidays
-    wPercentage = weekDays[0] / total[0] * 100 if (weekDays and total and total[0] != 0) else 0
-    sPercentage = saturday[0] / total[0] * 100 if (saturday and total and total[0] != 0) else 0
-    s_hPercentage = sundays_holidays[0] / total[0] * 100 if (sundays_holidays and total and total[0] != 0) else 0
+    #weekdays, Saturdays, Sundays/holidays as (label, riders, percentage)
+    weekDays, saturday, sundays_holidays = result["rows"]
     #display ridership info for given station
     print(f"Percentage of ridership for the {user_input} station: ")
-    print(" Weekday ridership:", f"{weekDays[0]:,}", f"({wPercentage:.2f}%)")
-    print(" Saturday ridership:", f"{saturday[0]:,}", f"({sPercentage:.2f}%)")
-    print(" Sunday/holiday ridership:", f"{sundays_holidays[0]:,}", f"({s_hPercentage:.2f}%)")
-    print(" Total ridership: ", f"{total[0]:,}")
+    print(" Weekday ridership:", f"{weekDays[1]:,}", f"({weekDays[2]:.2f}%)")
+    print(" Saturday ridership:", f"{saturday[1]:,}", f"({saturday[2]:.2f}%)")
+    print(" Sunday/holiday ridership:", f"{sundays_holidays[1]:,}", f"({sundays_holidays[2]:.2f}%)")
+    print(" Total ridership: ", f"{result['total']:,}")
 
 ##################################################################  
 #
 # handle option 3
 def option3(dbConn):
-    #get weekday ridership for each station
-    dbCursor = dbConn.cursor()
-    dbCursor.execute("""Select Stations.Station_Name, Sum(Ridership.Num_Riders) As WeekdayRidership 
-                        From Ridership Join Stations On Ridership.Station_ID = Stations.Station_ID 
-                        Where Ridership.Type_of_Day = 'W' 
-                        Group By Stations.Station_Name 
-                        Order By WeekdayRidership Desc;""")
-    weekDayRiders = dbCursor.fetchall()
-    #get total weekday ridership for all stations combined
-    dbCursor.execute("Select Sum(Num_Riders) From Ridership Where Type_of_Day = 'W';")
-    riderTotal = dbCursor.fetchone()
+    #get weekday ridership for each station and its share of the total
+    result = analyses.weekday_ranking(dbConn)
     #display weekday ridership data per station including percentages
     print("Ridership on Weekdays for Each Station")
-    for station in weekDayRiders:
-        print(f"{station[0]} : {station[1]:,} ({station[1]/riderTotal[0]*100:.2f}%)")
+    for station in result["rows"]:
+        print(f"{station[0]} : {station[1]:,} ({station[2]:.2f}%)")
 
 ##################################################################  
 #
 # handle option 4
 def option4(dbConn):
     #user will input a line color
-    dbCursor = dbConn.cursor()
     print()
     user_input = input("Enter a line color (e.g. Red or Yellow): ")
-    #get that line color
-    dbCursor.execute("""Select Color 
-                        From Lines 
-                        Where LOWER(Color) = LOWER(?);""",[user_input])
-    colorCheck = dbCursor.fetchone()
     #make sure line color exists
-    if colorCheck is None or colorCheck[0] is None:
-        print("**No such line...")
+    try:
+        color = analyses.line_color(dbConn, user_input)
+    except analyses.AnalysisError as e:
+        print_error(e)
         return
     #user will input a direction
     direction = input("Enter a direction (N/S/W/E): ")
     #get stops given line color and direction
-    dbCursor.execute("""Select Stop_Name, Direction, ADA 
-                        From Stops Join StopDetails On Stops.Stop_ID = StopDetails.Stop_ID 
-                        Join Lines On StopDetails.Line_ID = Lines.Line_ID 
-                        Where Lines.Color = ? AND LOWER(Stops.Direction) = LOWER(?) 
-                        Order By Stop_Name Asc;""", [colorCheck[0], direction])
-    result_stops = dbCursor.fetchall()
-    #if there are no stops given that direction
-    if len(result_stops) == 0:
-        print("**That line does not run in the direction chosen...")
+    try:
+        result = analyses.line_stops(dbConn, color, direction)
+    except analyses.AnalysisError as e:
+        #no stops in that direction
+        print_error(e)
         return
     #check for handicap accessible and display stops, direction, and accessibility
-    for stop in result_stops:
-        ADA = "handicap accessible" if stop[2] == 1 else "not handicap accessible"
+    for stop in result["rows"]:
+        ADA = "handicap accessible" if stop[2] else "not handicap accessible"
         print(f"{stop[0]} : direction = {stop[1]} ({ADA})")
 
 ##################################################################  
 #
 # handle option 5
 def option5(dbConn):
-  #get total number of stops
-  dbCursor = dbConn.cursor()
-  dbCursor.execute("Select Count(Stop_ID) From Stops;")
-  totalStops = dbCursor.fetchone()
-  #get number of stops by color and seperate by direction
-  dbCursor.execute("""Select Lines.Color, Stops.Direction, Count(Stops.Stop_ID) 
-                      From Stops Join StopDetails On Stops.Stop_ID = StopDetails.Stop_ID 
-                      Join Lines On StopDetails.Line_ID = Lines.Line_ID  
-                      Group By Color, Direction 
-                      Order By Color Asc, Direction Asc;""")
-  allStops = dbCursor.fetchall()
-  #display stats and calculate percentages
+  #get number of stops by color and seperate by direction, with percentages
+  result = analyses.stop_counts(dbConn)
+  #display stats
   print("Number of Stops For Each Color By Direction")
-  for stop in allStops:
-    print(f"{stop[0]} going {stop[1]} : {stop[2]} ({(stop[2] / totalStops[0] * 100):.2f}%)")
+  for stop in result["rows"]:
+    print(f"{stop[0]} going {stop[1]} : {stop[2]} ({stop[3]:.2f}%)")
 
 ##################################################################  
 #
 # handle option 6
 def option6(dbConn):
   #get user input for station name 
-  dbCursor = dbConn.cursor()
   print()
   user_input = input("Enter a station name (wildcards _ and %): ")
-  #get specified station 
-  dbCursor.execute("""Select Station_Name 
-                      From Stations 
-                      Where Station_Name Like ?;""", [user_input])
-  stations = dbCursor.fetchall()
-  #check if stations were found
-  if len(stations) == 0:
-    print("**No station found...")
+  #get specified station and its total ridership per year
+  try:
+    stationID, name = analyses.resolve_station(dbConn, user_input)
+  except analyses.AnalysisError as e:
+    #no station or multiple stations found
+    print_error(e)
     return
-  #were multiple stations we found? 
-  if len(stations) > 1:
-    print("**Multiple stations found...")
-    return
-  #if only one station was found -> store in name var.
-  name = stations[0][0]
-  #get total ridership for that station per year
-  dbCursor.execute("""Select strftime('%Y', Ride_Date) As Year, Sum(Num_Riders) 
-                      From Ridership Join Stations on Ridership.Station_ID = Stations.Station_ID 
-                      Where Station_Name Like ? 
-                      Group By Year Order By Year""", [name])
-  results = dbCursor.fetchall()
+  results = analyses.yearly_ridership(dbConn, stationID, name)["rows"]
   #display station yearly ridership info
   print(f"Yearly Ridership at {name}")
   for row in results:
@@ -239,6 +230,7 @@ def option6(dbConn):
   plot = input("Plot? (y/n)")
   #ask user if they want a plot, if yes store data
   if plot == "y":
+    plt = load_pyplot()
     years, ridership = [],[]
     for row in results:
       years.append(row[0])
@@ -256,34 +248,19 @@ def option6(dbConn):
 # handle option 7
 def option7(dbConn):
   #get user input for station name
-  dbCursor = dbConn.cursor()
   print()
   user_input = input("Enter a station name (wildcards _ and %): ")
-  #get stations
-  dbCursor.execute("Select Station_Name From Stations Where Station_Name Like ?;", [user_input])
-  station = dbCursor.fetchall()
-  #if no stations were found
-  if len(station) == 0:
-    print("**No station found...")
-    return
-  #if there were multiple stations found
-  if len(station) > 1:
-    print("**Multiple stations found...")
-    return
-  #if only one station was found -> store in name var.
-  name = station[0][0]
-  #safety check
-  if name is None:
+  #get station
+  try:
+    stationID, name = analyses.resolve_station(dbConn, user_input)
+  except analyses.AnalysisError as e:
+    #no station or multiple stations found
+    print_error(e)
     return
   #user inputs a year
   year = input("Enter a year: ")
   #get monthly ridership for that station within specified year
-  dbCursor.execute("""Select strftime('%m/%Y', Ride_Date) as Monthly, Sum(Num_Riders) 
-                      From Ridership Join Stations On Ridership.Station_ID = Stations.Station_ID 
-                      Where Station_Name Like ? And strftime('%Y', Ride_Date) = ? 
-                      Group By Monthly 
-                      Order By Monthly;""", [name, year])
-  result = dbCursor.fetchall()
+  result = analyses.monthly_ridership(dbConn, stationID, name, year)["rows"]
   #display monthly ridership for that year
   print(f"Monthly Ridership at {name} for {year}")
   for row in result:
@@ -291,6 +268,7 @@ def option7(dbConn):
   #ask user if they want a plot, if yes store data
   plot = input("Plot? (y/n) ")
   if plot == "y":
+    plt = load_pyplot()
     months, ridership = [],[]
     for row in result:
       months.append(row[0].split("/")[0])
@@ -308,123 +286,47 @@ def option7(dbConn):
 # handle option 8
 def option8(dbConn):
   #user inputs a year
-  dbCursor = dbConn.cursor()
   print()
   year = input("Year to compare against? ")
   print()
   #user inputs first station to be compared
   user_input = input("Enter station 1 (wildcards _ and %): ")
   #get that station
-  dbCursor.execute("""Select Station_Name 
-                      From Stations 
-                      Where Station_Name Like ?;""", [user_input])
-  station1 = dbCursor.fetchall()
-  #if station wasn't found
-  if len(station1) == 0:
-    print("**No station found...")
-    return
-  #if there are multiple stations
-  if len(station1) > 1:
-    print("**Multiple stations found...")
+  try:
+    station1 = analyses.resolve_station(dbConn, user_input)
+  except analyses.AnalysisError as e:
+    #no station or multiple stations found
+    print_error(e)
     return
-  #if first station was found -> store that first station in name1 var.
-  name1 = station1[0][0]
   print()
   #user inputs second station to be compared
   user_input2 = input("Enter station 2 (wildcards _ and %): ")
   #get that station
-  dbCursor.execute("""Select Station_Name 
-                      From Stations 
-                      Where Station_Name Like ?;""", [user_input2])
-  station2 = dbCursor.fetchall()
-  #if station wasn't found
-  if len(station2) == 0:
-    print("**No station found...")
-    return
-  #if there are multiple stations
-  if len(station2) > 1:
-    print("**Multiple stations found...")
+  try:
+    station2 = analyses.resolve_station(dbConn, user_input2)
+  except analyses.AnalysisError as e:
+    print_error(e)
     return
-  #if second station was found -> store that first station in name2 var.
-  name2 = station2[0][0]
-  #get first 5 days ridership for FIRST STATION, station ID, and total ridership, given specified year
-  dbCursor.execute("""Select strftime('%Y-%m-%d', Ride_Date) As Year, Ridership.Station_ID, Ridership.Num_Riders 
-                      From Ridership Join Stations on Ridership.Station_ID = Stations.Station_ID 
-                      Where Station_Name Like ? And strftime('%Y', Ride_Date) = ? 
-                      Group By Year 
-                      Order By Year Limit 5;""", [name1, year])
-  results = dbCursor.fetchall()
-  #display first 5 days ridership FIRST STATION
-  print(f"Station 1: {results[0][1]} {name1}")
-  for r in results:
-    print(f"{r[0]} {r[2]}")
-  #get last 5 days ridership for FIRST STATION, station ID, and total ridership, given specified year
-  dbCursor.execute("""Select strftime('%Y-%m-%d', Ride_Date) As Year, Ridership.Station_ID, Ridership.Num_Riders 
-                        From Ridership Join Stations on Ridership.Station_ID = Stations.Station_ID 
-                        Where Station_Name Like ? And strftime('%Y', Ride_Date) = ? 
-                        Group By Year 
-                        Order By Year Desc Limit 5;""", [name1, year])
-  results1 = dbCursor.fetchall()
-  #display last 5 days ridership FIRST STATION
-  results1.reverse()
-  for r in results1:
-    print(f"{r[0]} {r[2]}")
-  #get first 5 days ridership for SECOND STATION, station ID, and total ridership, given specified year
-  dbCursor.execute("""Select strftime('%Y-%m-%d', Ride_Date) As Year, Ridership.Station_ID, Ridership.Num_Riders 
-                        From Ridership Join Stations on Ridership.Station_ID = Stations.Station_ID 
-                        Where Station_Name Like ? And strftime('%Y', Ride_Date) = ? 
-                        Group By Year 
-                        Order By Year Limit 5;""", [name2, year])
-  results2 = dbCursor.fetchall()
-  #display first 5 days ridership for SECOND STATION
-  print(f"Station 2: {results2[0][1]} {name2}")
-  for r in results2:
-    print(f"{r[0]} {r[2]}")
-  #get last 5 days ridership for SECOND STATION, station ID, and total ridership, given specified year
-  dbCursor.execute("""Select strftime('%Y-%m-%d', Ride_Date) As Year, Ridership.Station_ID, Ridership.Num_Riders 
-                      From Ridership Join Stations on Ridership.Station_ID = Stations.Station_ID 
-                      Where Station_Name Like ? And strftime('%Y', Ride_Date) = ? 
-                      Group By Year 
-                      Order By Year Desc Limit 5;""", [name2, year])
-  results3 = dbCursor.fetchall()
-  #display last 5 days ridership for SECOND STATION
-  results3.reverse()
-  for r in results3:
-    print(f"{r[0]} {r[2]}")
-  #get total number of riders for STATION ONE entire year
-  dbCursor.execute("""Select Ridership.Num_Riders 
-                      From Ridership Join Stations on Ridership.Station_ID = Stations.Station_ID 
-                      Where Station_Name Like ? And strftime('%Y', Ride_Date) = ? 
-                      Group By Ride_Date 
-                      Order By Ride_Date Asc;""", [name1, year])
-  firstResult = dbCursor.fetchall()
-  #get total number of riders for STATION TWO entire year
-  dbCursor.execute("""Select Ridership.Num_Riders 
-                      From Ridership Join Stations on Ridership.Station_ID = Stations.Station_ID 
-                      Where Station_Name Like ? And strftime('%Y', Ride_Date) = ? 
-                      Group By Ride_Date 
-                      Order By Ride_Date Asc;""", [name2, year])
-  secondResult = dbCursor.fetchall()
-  #store data for BOTH stations and initialize counter
-  counter = 1
-  x = []
-  y1 = []
-  y2 = []
-  for i in range(len(firstResult)):
-    x.append(counter)
-    y1.append(firstResult[i][0])
-    y2.append(secondResult[i][0])
-    counter+=1
-  #ask user if they want a plot if yes -> store data
+  #get first/last 5 days and the daily ridership of both stations for that year
+  result = analyses.compare_stations(dbConn, year, station1, station2)
+  #display first and last 5 days ridership for each station
+  for i in range(len(result["stations"])):
+    station = result["stations"][i]
+    print(f"Station {i + 1}: {station['station_id']} {station['station_name']}")
+    for r in station["first_days"] + station["last_days"]:
+      print(f"{r[0]} {r[1]}")
+  #ask user if they want a plot if yes -> plot data
   print()
   plot = input("Plot? (y/n) ")
   if plot == "y":
-    day, ridership = [],[]
-    #plot data
+    plt = load_pyplot()
+    #days are aligned on the date, so every station shares the x axis
+    x = [row[0] for row in result["rows"]]
     plt.figure(figsize = (9,9))
-    plt.legend([name1,name2])
-    plt.plot(x, y1)
-    plt.plot(x, y2)
+    #long series are thinned to about as many points as the plot is wide
+    for i in range(len(result["stations"])):
+      plt.plot(*plots.lttb(x, [row[i + 1] for row in result["rows"]], plots.DEFAULT_MAX_POINTS))
+    plt.legend([station["station_name"] for station in result["stations"]])
     plt.title(f"Ridership each Day of ({year})")
     plt.xlabel("Day")
     plt.ylabel("Number of Riders")
@@ -439,32 +341,19 @@ def option9(dbConn):
   print()
   user_input = input("Enter a latitude: ")
   #is latitude within range?
-  if float(user_input) > 43 or float(user_input) < 40:
-    print("**Latitude entered is out of bounds...")
+  try:
+    analyses.check_latitude(user_input)
+  except analyses.AnalysisError as e:
+    print_error(e)
     return
   #if yes continue and get user input longitude value
   user_input2 = input("Enter a longitude: ")
-  #is longitude within range?
-  if float(user_input2) < -88 or float(user_input2) > -87:
-    print("**Longitude entered is out of bounds...")
-    return
-  #formulas for latitude with user inputs
-  left_lim_latitude = round(float(user_input) - 1 / 69, 3)
-  right_lim_latitude = round(float(user_input) + 1 /69, 3)
-  #formulas for longitide with user inputs
-  left_lim_long = round(float(user_input2) - 1 / 51, 3)
-  right_lim_long = round(float(user_input2) + 1 / 51, 3)
-  #get station name, latitude, and longitude coordinates
-  dbCursor = dbConn.cursor()  
-  dbCursor.execute(f"""Select Station_Name, Latitude, Longitude 
-                        From Stops Join Stations on Stops.Station_ID = Stations.Station_ID 
-                        Where Latitude Between {left_lim_latitude} And {right_lim_latitude} And Longitude Between {left_lim_long} And {right_lim_long} 
-                        Group By Latitude, Longitude 
-                        Order By Stations.Station_Name, Stop_ID Asc;""")
-  result = dbCursor.fetchall()
-  #safety check
-  if len(result) == 0: 
-    print("**No stations found...")
+  #is longitude within range? if yes get every station within a mile
+  try:
+    result = analyses.nearby_stations(dbConn, user_input, user_input2, 1.0)["rows"]
+  except analyses.AnalysisError as e:
+    #out of bounds or no stations found
+    print_error(e)
     return
   #store data for plotting
   stationNames = []
@@ -483,45 +372,235 @@ def option9(dbConn):
   print()
   plot = input("Plot? (y/n) ")
   if plot == "y":
-    image = plt.imread("chicago.png")
-    xydims = [-87.9277, -87.5569, 41.7012, 42.0868] # area covered by
-    plt.imshow(image, extent=xydims)
+    plt = load_pyplot()
+    #decoded once and reused by every later plot
+    plt.imshow(plots.base_map(), extent=plots.MAP_EXTENT)
     plt.title("Stations Near You")
     plt.plot(x, y)
     #overlay data on top of image
     for row in result:
       plt.annotate(row[0], (row[2], row[1]))
 
-    plt.xlim([-87.9277, -87.5569])
-    plt.ylim([41.7012, 42.0868])
+    plt.xlim(plots.MAP_EXTENT[:2])
+    plt.ylim(plots.MAP_EXTENT[2:])
     plt.show()
 
+##################################################################  
+#
+# handle option 10
+def option10(dbConn):
+  #user will input a line color
+  print()
+  user_input = input("Enter a line color (e.g. Red or Yellow): ")
+  #get the handicap accessible stops on that line
+  try:
+    result = analyses.ada_stops(dbConn, user_input)
+  except analyses.AnalysisError as e:
+    #no such line or no accessible stops
+    print_error(e)
+    return
+  #display accessible stops and their direction
+  print(f"Handicap Accessible Stops on the {result['line']} Line")
+  for stop in result["rows"]:
+    print(f"{stop[0]} : direction = {stop[1]}")
+
+##################################################################  
+#
+# handle option 11
+def option11(dbConn):
+  #get stations where more than one line stops
+  result = analyses.transfer_stations(dbConn)
+  #display each station and the lines serving it
+  print("Stations Served by More Than One Line")
+  for station in result["rows"]:
+    print(f"{station[0]} : {station[1]} lines ({station[2]})")
+
+##################################################################  
+#
+# handle option 12
+def option12(dbConn):
+  #user will choose the end of the ranking, the page size and the filters
+  print()
+  order = input("Enter top or bottom: ").strip().lower()
+  count = input("How many stations per page? ")
+  dayType = input("Enter a day type (W, A, U or blank for all): ")
+  firstYear = input("Enter the first year (blank for all): ")
+  lastYear = input("Enter the last year (blank for all): ")
+  color = input("Enter a line color (blank for all): ")
+  #one page at a time, each continuing after the last station shown
+  cursor = None
+  while True:
+    try:
+      result = analyses.station_ranking(dbConn, order or "top", count, cursor, dayType, firstYear, lastYear, color)
+    except analyses.AnalysisError as e:
+      print_error(e)
+      return
+    if cursor is None:
+      print(f"{'Busiest' if result['order'] == 'top' else 'Quietest'} of {result['stations']} Stations "
+            f"(total ridership {result['total']:,})")
+    #display each station's rank, ridership and share of the total
+    for station in result["rows"]:
+      print(f"{station[0]}. {station[1]} : {station[2]:,} ({station[3]:.2f}%)")
+    cursor = result["next_cursor"]
+    if cursor is None or input("Show the next page? (y/n) ").strip().lower() != "y":
+      return
+
 ##################################################################  
 #
 # main
 #
+#startup-time measurement mode: time each startup step, then quit before the menu
+timeStartup = "--startup-time" in sys.argv[1:]
+timings = [("imports", time.perf_counter() - startTime)]
+#non-interactive modes: run one analysis, or a batch of them, without prompts
+if len(sys.argv) > 1 and sys.argv[1] in batch.COMMANDS:
+    sys.exit(batch.main(sys.argv[1:]))
+#server mode: answer the analyses as JSON over HTTP
+if len(sys.argv) > 1 and sys.argv[1] == "serve":
+    import server
+    sys.exit(server.main(sys.argv[2:]))
+#scan mode: series and anomaly flags for every station, in parallel
+if len(sys.argv) > 1 and sys.argv[1] == "scan":
+    import scan
+    sys.exit(scan.main(sys.argv[2:]))
+#export mode: stream ride entries or an analysis result to a file
+if len(sys.argv) > 1 and sys.argv[1] == "export":
+    import export
+    sys.exit(export.main(sys.argv[2:]))
+#render mode: write charts for many stations to PNG/SVG files, headless
+if len(sys.argv) > 1 and sys.argv[1] == "render":
+    sys.exit(plots.main(sys.argv[2:]))
+#ingest mode: load CTA CSV feeds into the database
+if len(sys.argv) > 1 and sys.argv[1] == "ingest":
+    import ingest
+    sys.exit(ingest.main(sys.argv[2:]))
+#migrate mode: add integer day numbers and the Calendar table
+if len(sys.argv) > 1 and sys.argv[1] == "migrate":
+    import daynumbers
+    sys.exit(daynumbers.main(sys.argv[2:]))
+#partition mode: split Ridership into one database file per year
+if len(sys.argv) > 1 and sys.argv[1] == "partition":
+    sys.exit(partitions.main(sys.argv[2:]))
+#connect to database; with --profile every statement is timed and slow ones logged,
+#with --query-thread the analyses run on a worker thread so it may not be tied to this one,
+#and with --partitions the database is the catalog of a set of year partitions
+queryThread = "--query-thread" in sys.argv[1:]
+databasePath = flag_value("--partitions", batch.DATABASE)
+#connecting would create an empty file at a wrong path
+if not os.path.exists(databasePath):
+    print("**" + databasePath + " not found...")
+    sys.exit(1)
+profiler = None
+if "--profile" in sys.argv[1:]:
+    dbConn = sqlite3.connect(databasePath, factory=querylog.ProfiledConnection, check_same_thread=not queryThread)
+    profiler = querylog.Profiler(dbConn, float(flag_value("--slow-ms", 100)),
+                                 flag_value("--slow-log", "slow_queries.log"))
+else:
+    dbConn = sqlite3.connect(databasePath, check_same_thread=not queryThread)
+timings.append(("connect", time.perf_counter() - startTime))
+if "--partitions" in sys.argv[1:] and not partitions.is_catalog(dbConn):
+    print("**" + databasePath + " is not a partition catalog...")
+    sys.exit(1)
+#the rollup tables are only created in a CTA database
+if not rollups.has_ridership(dbConn):
+    print("**" + databasePath + " has no Ridership table...")
+    sys.exit(1)
+#maintenance mode: build and verify indexes, report query plans, then quit
+if "--build-indexes" in sys.argv[1:]:
+    #the plans include the rollup queries, so the rollup has to exist
+    rollups.refresh_rollups(dbConn)
+    sys.exit(0 if indexes.report(dbConn) else 1)
 print('** Welcome to CTA L analysis app **')
 print()
-#connect to database
-dbConn = sqlite3.connect('CTA2_L_daily_ridership.db')
+#bring the ridership rollups up to date with any new ride entries
+rollups.refresh_rollups(dbConn)
+#and with any written while the menu is open
+analyses.use_rollup_keeper(rollups.RollupKeeper(dbConn))
+timings.append(("refresh rollups", time.perf_counter() - startTime))
+#answer the ridership aggregations from the year partitions the catalog lists
+partitionSet = None
+if "--partitions" in sys.argv[1:]:
+    partitionSet = partitions.open_catalog(dbConn, databasePath)
+    analyses.use_partitions(partitionSet)
+    timings.append(("open partitions", time.perf_counter() - startTime))
+#optionally answer the ridership aggregations from the columnar engine
+elif "--columnar" in sys.argv[1:]:
+    if columnar.available():
+        analyses.use_column_store(columnar.open_store(dbConn, batch.DATABASE))
+    else:
+        print("**numpy is not installed, using SQLite...")
+        print()
+    timings.append(("open columnar engine", time.perf_counter() - startTime))
 #call function to print statistics
-print_stats(dbConn)
-#display menu and take user input for menu commands 1-9
+print_stats(dbConn, "--refresh-stats" in sys.argv[1:])
+timings.append(("general statistics", time.perf_counter() - startTime))
+#reuse results of repeated analyses, optionally kept on disk between runs
+cache = resultcache.open_cache(dbConn, "--no-cache" not in sys.argv[1:],
+                               int(flag_value("--cache-size", resultcache.DEFAULT_SIZE)),
+                               flag_value("--cache-file", None))
+analyses.use_result_cache(cache)
+timings.append(("result cache", time.perf_counter() - startTime))
+#analyses report progress when slow, stop at --query-timeout seconds, and Ctrl-C cancels them
+queryTimeout = flag_value("--query-timeout", None)
+guard = querycontrol.QueryGuard(float(queryTimeout) if queryTimeout is not None else None,
+                                querycontrol.print_progress,
+                                profiler.on_progress if profiler is not None else None,
+                                useThread=queryThread)
+analyses.use_query_guard(guard)
+if profiler is not None:
+    profiler.flush("startup", time.perf_counter() - startTime)
+if timeStartup:
+    print("Startup time:")
+    previous = 0
+    for step, elapsed in timings:
+        print(f"  {step}: {(elapsed - previous) * 1000:.1f} ms")
+        previous = elapsed
+    print(f"  total: {previous * 1000:.1f} ms")
+    print(f"  matplotlib loaded: {'matplotlib' in sys.modules}")
+    sys.exit(0)
+#display menu and take user input for menu commands 1-12, plus the extra
+#commands of the features that are on
+commands = ["1-12"]
+if cache is not None:
+    commands.append("c for cache stats")
+if profiler is not None:
+    commands.append("t for query timings")
+prompt = f"Please enter a command ({', '.join(commands)}, x to exit): "
 while True:
     print()
-    user_input = input("Please enter a command (1-9, x to exit): ")
+    user_input = input(prompt)
     if user_input.isdigit():
         user_input = int(user_input)
-        if  1 <= user_input <= 9:
-            handler(user_input, dbConn)
+        if  1 <= user_input <= 12:
+            #Ctrl-C cancels only this command; a cancelled or timed out query, or a
+            #rollup that couldn't be refreshed, ends up here
+            try:
+                with querycontrol.interrupts_cancel(guard):
+                    if profiler is not None:
+                        with profiler.measure(f"option{user_input}"):
+                            handler(user_input, dbConn)
+                    else:
+                        handler(user_input, dbConn)
+            except analyses.AnalysisError as e:
+                print()
+                print_error(e)
         else:
            print("**Error, unknown command, try again...")
            print() 
+    elif user_input.lower() == 'c' and cache is not None:
+        print(resultcache.describe(cache.stats()))
+    elif user_input.lower() == 't' and profiler is not None:
+        print("\n".join(profiler.summary()))
     elif user_input.lower() == 'x':
         break
     else:
         print("**Error, unknown command, try again...")
         print() 
+if profiler is not None:
+    print("\n".join(profiler.summary()))
+if cache is not None:
+    cache.save(dbConn)
+guard.close()
 #
 # done
 #
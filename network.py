@@ -0,0 +1,156 @@
+# Overview: In-memory model of the L network (options 4, 5, 10 and 11).
+# Stations, stops and lines are small and rarely change, so they are read from
+# the database once (again after they change, see changes.Derived) and kept as __slots__ records, with indexes built up front:
+# stops by (line color, direction), ADA stops by color, stop counts by color and
+# direction, and the lines serving each station. Listings and counts are then
+# answered from memory instead of joining Stops, StopDetails and Lines each time.
+
+import changes
+import queries
+import stations
+
+class Line:
+    __slots__ = ("lineID", "color", "stops")
+
+    def __init__(self, lineID, color):
+        self.lineID = lineID
+        self.color = color
+        self.stops = []
+
+class Stop:
+    __slots__ = ("stopID", "stationID", "name", "direction", "ada", "latitude", "longitude", "lines")
+
+    def __init__(self, stopID, stationID, name, direction, ada, latitude, longitude):
+        self.stopID = stopID
+        self.stationID = stationID
+        self.name = name
+        self.direction = direction
+        self.ada = ada == 1
+        self.latitude = latitude
+        self.longitude = longitude
+        self.lines = []
+
+class Station:
+    __slots__ = ("stationID", "name", "stops", "colors")
+
+    def __init__(self, stationID, name):
+        self.stationID = stationID
+        self.name = name
+        self.stops = []
+        self.colors = []
+
+#sorts like SQL's Order By, NULLs first
+def sql_order(value):
+    return (value is not None, value)
+
+##################################################################
+#
+# Network
+#
+# Built from the rows of Stations, Stops, Lines and StopDetails. A
+# stop on two lines of the same color counts once per line, as it
+# does in the joins the SQL queries used.
+#
+class Network:
+    def __init__(self, stationRows, stopRows, lineRows, stopLineRows):
+        self.stations = {stationID: Station(stationID, name) for stationID, name in stationRows}
+        self.stops = {row[0]: Stop(*row) for row in stopRows}
+        self.lines = {lineID: Line(lineID, color) for lineID, color in lineRows}
+        #folded color -> the first line's color as stored, like "Where LOWER(Color) = LOWER(?)"
+        self.colors = {}
+        for line in self.lines.values():
+            if line.color is not None:
+                self.colors.setdefault(stations.fold(line.color), line.color)
+        #(color, folded direction) -> stops by name; color -> ADA stops by name
+        self.byColorDirection = {}
+        self.adaByColor = {}
+        #(color, direction) -> number of stops
+        self.counts = {}
+        for stopID, lineID in stopLineRows:
+            stop = self.stops.get(stopID)
+            line = self.lines.get(lineID)
+            if stop is None or line is None:
+                continue
+            stop.lines.append(line)
+            line.stops.append(stop)
+            direction = stations.fold(stop.direction) if stop.direction is not None else None
+            self.byColorDirection.setdefault((line.color, direction), []).append(stop)
+            if stop.ada:
+                self.adaByColor.setdefault(line.color, []).append(stop)
+            self.counts[(line.color, stop.direction)] = self.counts.get((line.color, stop.direction), 0) + 1
+        for stopList in list(self.byColorDirection.values()) + list(self.adaByColor.values()):
+            stopList.sort(key=lambda stop: sql_order(stop.name))
+        #station -> colors of the lines stopping there
+        for stop in self.stops.values():
+            station = self.stations.get(stop.stationID)
+            if station is None:
+                continue
+            station.stops.append(stop)
+            for line in stop.lines:
+                if line.color is not None and line.color not in station.colors:
+                    station.colors.append(line.color)
+        for station in self.stations.values():
+            station.colors.sort()
+        self.stopCounts = sorted(((color, direction, count) for (color, direction), count in self.counts.items()),
+                                 key=lambda row: (sql_order(row[0]), sql_order(row[1])))
+
+    #the line color as stored for a color typed in any case, None if there's no such line
+    def line_color(self, color):
+        return self.colors.get(stations.fold(color))
+
+    #stops of the lines of this color going this direction (any case), by stop name
+    def stops_on(self, color, direction):
+        return self.byColorDirection.get((color, stations.fold(direction)), [])
+
+    #ADA accessible stops of the lines of this color, by stop name
+    def ada_stops(self, color):
+        return self.adaByColor.get(color, [])
+
+    #IDs of the stations served by lines of this color
+    def stations_served_by(self, color):
+        return [station.stationID for station in self.stations.values() if color in station.colors]
+
+    #[(color, direction, stops)] ordered by color then direction
+    def stop_counts(self):
+        return self.stopCounts
+
+    #stations served by at least minLines line colors, most lines first, then by name
+    def transfer_stations(self, minLines=2):
+        found = [station for station in self.stations.values() if len(station.colors) >= minLines]
+        found.sort(key=lambda station: (-len(station.colors), sql_order(station.name), station.stationID))
+        return found
+
+##################################################################
+#
+# load_network
+#
+# Given a connection to the CTA database, reads the stations, stops
+# and lines and builds a Network.
+#
+def load_network(dbConn):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute(queries.STATION_NAMES)
+    stationRows = dbCursor.fetchall()
+    dbCursor.execute(queries.NETWORK_STOPS)
+    stopRows = dbCursor.fetchall()
+    dbCursor.execute(queries.NETWORK_LINES)
+    lineRows = dbCursor.fetchall()
+    dbCursor.execute(queries.NETWORK_STOP_LINES)
+    return Network(stationRows, stopRows, lineRows, dbCursor.fetchall())
+
+_network = changes.Derived(["Stations", "Stops", "Lines", "StopDetails"], load_network)
+
+##################################################################
+#
+# get_network
+#
+# Given a connection to the CTA database, returns the shared network
+# model, loading it on first use and again after the stations,
+# stops or lines change.
+#
+def get_network(dbConn):
+    return _network.get(dbConn)
+
+#forget the network model, e.g. before switching to another database
+def reset():
+    _network.reset()
@@ -0,0 +1,326 @@
+# Overview: Year-partitioned ridership for the CTA L analysis app.
+#
+#   python3 main.py partition --catalog partitions/cta.db
+#   python3 main.py --partitions partitions/cta.db
+#
+# Ridership is split into one SQLite file per year next to a catalog database.
+# The catalog holds the small tables (Stations, Stops, Lines, StopDetails), an
+# empty Ridership with the same schema so the shared code still finds it, and the
+# Partitions table listing each year's file. Every partition has its own Ridership
+# index and rollup. PartitionSet mirrors the ColumnStore methods: a question about
+# one year (options 7 and 8) opens only that year's file, and whole-history ones
+# (options 2, 3 and 6, and the general statistics) run on every partition at once
+# on a thread pool and add up the partial sums. Partitions are read-only copies:
+# run the partition command again after loading new data.
+
+import argparse
+import concurrent.futures
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import indexes
+import queries
+import readonly
+import rollups
+
+#tables copied whole into the catalog; Ridership is copied empty
+CATALOG_TABLES = ["Stations", "Stops", "Lines", "StopDetails"]
+#rows per executemany() while splitting
+BATCH_ROWS = 50000
+DEFAULT_WORKERS = min(8, os.cpu_count() or 1)
+
+#Partition_ID keeps growing across rebuilds, so its watermark tells a
+#saved result cache the partitions were rebuilt (see resultcache)
+PARTITIONS = """Create Table If Not Exists Partitions (
+                  Partition_ID Integer Primary Key Autoincrement,
+                  Year Integer Not Null Unique,
+                  File Text Not Null,
+                  Ride_Entries Integer Not Null,
+                  First_Date Text,
+                  Last_Date Text
+                );"""
+
+#one partition's share of the general statistics
+PARTITION_STATS = "Select Count(*), Min(Ride_Date), Max(Ride_Date), Sum(Num_Riders) From Ridership;"
+
+#"catalog.db" -> "catalog.2015.db", in the catalog's directory
+def partition_file(catalogPath, year):
+    stem = os.path.splitext(os.path.basename(catalogPath))[0]
+    return f"{stem}.{year}.db"
+
+##################################################################
+#
+# is_catalog
+#
+# Given a connection, returns True if its database is a partition
+# catalog.
+#
+def is_catalog(dbConn):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("Select 1 From sqlite_master Where type = 'table' And name = 'Partitions';")
+    return dbCursor.fetchone() is not None
+
+#the Create statement of a table in dbConn's database
+def table_sql(dbConn, table):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("Select sql From sqlite_master Where type = 'table' And name = ?;", [table])
+    row = dbCursor.fetchone()
+    if row is None:
+        raise sqlite3.OperationalError(f"no such table: {table}")
+    return row[0]
+
+#a new partition file, tuned for one bulk load into a file nobody reads yet
+def create_partition(path, ridershipSQL):
+    if os.path.exists(path):
+        os.remove(path)
+    partConn = sqlite3.connect(path)
+    partConn.execute("Pragma journal_mode = OFF;")
+    partConn.execute("Pragma synchronous = OFF;")
+    partConn.execute(ridershipSQL)
+    return partConn
+
+##################################################################
+#
+# partition_database
+#
+# Given a connection to the CTA database and the catalog path,
+# writes one partition file per year and fills the catalog. Each
+# partition is built under a temporary name and swapped in at the
+# end. Rows without a valid Ride_Date are left out. Calls
+# progress(year, rows) as each partition is finished.
+# Returns {year: rows}.
+#
+def partition_database(dbConn, catalogPath, progress=None):
+    directory = os.path.dirname(os.path.abspath(catalogPath))
+    os.makedirs(directory, exist_ok=True)
+    ridershipSQL = table_sql(dbConn, "Ridership")
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("Pragma table_info(Ridership);")
+    columns = [row[1] for row in dbCursor.fetchall()]
+    insert = f"Insert Into Ridership ({', '.join(columns)}) Values ({', '.join(['?'] * len(columns))});"
+    dateColumn = [c.lower() for c in columns].index("ride_date")
+    #one pass over Ridership, each row routed to its year's file; a row
+    #without a valid Ride_Date has no year, and the rollup leaves it out too
+    partConns = {}
+    pending = {}
+    def flush(year):
+        partConns[year].executemany(insert, pending[year])
+        pending[year] = []
+    dbCursor.execute(f"Select {', '.join(columns)} From Ridership Where strftime('%Y', Ride_Date) Is Not Null;")
+    while True:
+        rows = dbCursor.fetchmany(BATCH_ROWS)
+        if len(rows) == 0:
+            break
+        for row in rows:
+            year = int(row[dateColumn][:4])
+            if year not in partConns:
+                partConns[year] = create_partition(os.path.join(directory, partition_file(catalogPath, year) + ".tmp"),
+                                                   ridershipSQL)
+                pending[year] = []
+            pending[year].append(row)
+            if len(pending[year]) >= BATCH_ROWS:
+                flush(year)
+    #index, roll up and describe each partition
+    built = {}
+    for year in sorted(partConns):
+        flush(year)
+        partConn = partConns[year]
+        partConn.commit()
+        for name, table, indexColumns in indexes.INDEXES:
+            if table == "Ridership" and all(c in columns for c in indexColumns):
+                partConn.execute(f"Create Index {name} On Ridership ({', '.join(indexColumns)});")
+        rollups.refresh_rollups(partConn)
+        partConn.execute("Analyze;")
+        partCursor = partConn.cursor()
+        partCursor.execute(PARTITION_STATS)
+        count, firstDate, lastDate, riders = partCursor.fetchone()
+        built[year] = (count, firstDate[:10], lastDate[:10])
+        partConn.close()
+        if progress is not None:
+            progress(year, count)
+    #the catalog: small tables, an empty Ridership, and the partition list
+    catalogConn = sqlite3.connect(catalogPath)
+    catalogCursor = catalogConn.cursor()
+    for table in CATALOG_TABLES + ["Ridership"]:
+        catalogCursor.execute(f"Drop Table If Exists {table};")
+        catalogCursor.execute(table_sql(dbConn, table))
+        if table != "Ridership":
+            dbCursor.execute(f"Select * From {table};")
+            rows = dbCursor.fetchall()
+            if len(rows) > 0:
+                catalogCursor.executemany(f"Insert Into {table} Values ({', '.join(['?'] * len(rows[0]))});", rows)
+    for name, table, indexColumns in indexes.INDEXES:
+        if table in CATALOG_TABLES:
+            catalogCursor.execute(f"Create Index If Not Exists {name} On {table} ({', '.join(indexColumns)});")
+    catalogCursor.execute(PARTITIONS)
+    catalogCursor.execute("Delete From Partitions;")
+    for year, (count, firstDate, lastDate) in built.items():
+        file = partition_file(catalogPath, year)
+        os.replace(os.path.join(directory, file + ".tmp"), os.path.join(directory, file))
+        catalogCursor.execute("""Insert Into Partitions (Year, File, Ride_Entries, First_Date, Last_Date)
+                                 Values (?, ?, ?, ?, ?);""", [year, file, count, firstDate, lastDate])
+    catalogConn.commit()
+    catalogConn.close()
+    return {year: built[year][0] for year in built}
+
+##################################################################
+#
+# PartitionSet
+#
+# The year partitions listed in a catalog. Each thread opens its own
+# read-only connection to a partition the first time it needs it.
+# Each method mirrors one of the SQL queries in queries.py.
+#
+class PartitionSet:
+    def __init__(self, directory, partitionRows, workers=DEFAULT_WORKERS):
+        self.files = {year: os.path.join(directory, file) for year, file in partitionRows}
+        self.years = sorted(self.files)
+        self.local = threading.local()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max(1, workers), thread_name_prefix="partition")
+
+    def __len__(self):
+        return len(self.files)
+
+    #this thread's connection to one year's partition
+    def _connection(self, year):
+        conns = getattr(self.local, "conns", None)
+        if conns is None:
+            conns = self.local.conns = {}
+        if year not in conns:
+            conns[year] = readonly.connect_read_only(self.files[year])
+        return conns[year]
+
+    #rows of a statement on one year's partition, [] if there's no such year
+    def query(self, year, sql, params=()):
+        year = str(year).strip()
+        if not year.isdigit() or int(year) not in self.files:
+            return []
+        dbCursor = self._connection(int(year)).cursor()
+        dbCursor.execute(sql, params)
+        return dbCursor.fetchall()
+
+    #rows of a statement on every partition (or those of years), run in parallel,
+    #as one list per year in year order
+    def fan_out(self, sql, params=(), years=None):
+        return list(self.executor.map(lambda year: self.query(year, sql, params), years or self.years))
+
+    #option 2: {Type_of_Day: riders} for one station
+    def day_type_ridership(self, stationID):
+        totals = {}
+        for rows in self.fan_out(queries.DAY_TYPE_RIDERSHIP, [stationID]):
+            for dayType, riders in rows:
+                if riders is not None:
+                    totals[dayType] = totals.get(dayType, 0) + riders
+        return totals
+
+    #option 3: [(Station_ID, weekday riders)] for every station with weekday rows
+    def weekday_ridership(self):
+        totals = {}
+        for rows in self.fan_out(queries.WEEKDAY_RIDERSHIP_BY_STATION_ID):
+            for stationID, riders in rows:
+                totals[stationID] = totals.get(stationID, 0) + (riders or 0)
+        return sorted(totals.items())
+
+    #option 6: [(year as text, riders)] for one station; each partition is one year
+    def yearly_ridership(self, stationID):
+        return [row for rows in self.fan_out(queries.YEARLY_RIDERSHIP, [stationID]) for row in rows]
+
+    #option 7: [("MM/YYYY", riders)] for one station in one year
+    def monthly_ridership(self, stationID, year):
+        return self.query(year, queries.MONTHLY_RIDERSHIP, [stationID, year])
+
+    #option 8: [("YYYY-MM-DD", riders)] for every day of one station's year
+    def daily_ridership(self, stationID, year):
+        start, end = queries.year_range(year)
+        rows = self.query(year, queries.daily_ridership_of(1), [stationID, start, end])
+        return [(day, riders) for stationID, day, riders in rows]
+
+    #option 12: [(Station_ID, riders)] matching a ranking's filters (see
+    #queries.ranking_filter), asking only the partitions in the year range
+    def station_riders(self, where, params, firstYear=None, lastYear=None):
+        years = [year for year in self.years
+                 if (firstYear is None or year >= firstYear) and (lastYear is None or year <= lastYear)]
+        if len(years) == 0:
+            return []
+        totals = {}
+        for rows in self.fan_out(queries.station_riders_of(where), params, years):
+            for stationID, riders in rows:
+                totals[stationID] = totals.get(stationID, 0) + (riders or 0)
+        return sorted(totals.items())
+
+    ##################################################################
+    #
+    # stats
+    #
+    # Given a connection to the catalog, returns the general statistics
+    # in the shape dbstats.get_stats() does, with the ride entries, date
+    # range and total ridership added up over every partition.
+    #
+    def stats(self, dbConn):
+        dbCursor = dbConn.cursor()
+        dbCursor.execute("Select count(*) From Stations;")
+        stations = dbCursor.fetchone()[0]
+        dbCursor.execute("Select count(*) From Stops")
+        stops = dbCursor.fetchone()[0]
+        parts = [rows[0] for rows in self.fan_out(PARTITION_STATS) if rows[0][0] > 0]
+        return {"stations": stations, "stops": stops,
+                "ride_entries": sum(part[0] for part in parts),
+                "start_date": min(part[1] for part in parts)[:10] if parts else None,
+                "end_date": max(part[2] for part in parts)[:10] if parts else None,
+                "total_riders": sum(part[3] or 0 for part in parts) if parts else None}
+
+    def close(self):
+        self.executor.shutdown()
+
+##################################################################
+#
+# open_catalog
+#
+# Given a connection to a catalog and its path, returns the
+# PartitionSet of the partitions it lists.
+#
+def open_catalog(dbConn, catalogPath, workers=DEFAULT_WORKERS):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("Select Year, File From Partitions Order By Year;")
+    return PartitionSet(os.path.dirname(os.path.abspath(catalogPath)), dbCursor.fetchall(), workers)
+
+#the command line needs batch, which imports this module
+def build_parser():
+    import batch
+    parser = argparse.ArgumentParser(prog="main.py partition",
+                                     description="Split Ridership into one database file per year.")
+    parser.add_argument("--db", default=batch.DATABASE, help="path to the CTA database to split")
+    parser.add_argument("--catalog", required=True, help="path of the catalog database to write")
+    parser.add_argument("--quiet", action="store_true", help="only print the final summary")
+    return parser
+
+##################################################################
+#
+# main
+#
+# Given the command line arguments after "partition", splits the
+# database into year partitions.
+#
+def main(argv):
+    args = build_parser().parse_args(argv)
+    if os.path.abspath(args.catalog) == os.path.abspath(args.db):
+        print("**The catalog can't be the database being split...", file=sys.stderr)
+        return 2
+    dbConn = readonly.connect_read_only(args.db)
+    started = time.perf_counter()
+    def progress(year, rows):
+        if not args.quiet:
+            print(f"  {year}: {rows:,} ride entries", file=sys.stderr)
+    try:
+        built = partition_database(dbConn, args.catalog, progress)
+    except (OSError, sqlite3.Error) as e:
+        print(f"**Could not partition: {e}", file=sys.stderr)
+        return 1
+    finally:
+        dbConn.close()
+    print(f"{sum(built.values()):,} ride entries split into {len(built)} partitions "
+          f"in {time.perf_counter() - started:.1f} s")
+    return 0
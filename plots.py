@@ -0,0 +1,340 @@
+# Overview: Plot helpers and the headless chart renderer.
+#
+#   python3 main.py render --all-stations --charts yearly,daily --output charts
+#   python3 main.py render --station "Clark%" --year 2019 --charts monthly,daily,map --format svg
+#
+# base_map() decodes chicago.png once per process, for the menu and the
+# renderer alike. lttb() thins long series to about as many points as the chart
+# has pixels (Largest-Triangle-Three-Buckets keeps the peaks and dips that plain
+# striding would drop). ChartRenderer draws with the Agg backend straight to
+# PNG/SVG files, without pyplot, keeping one figure per chart type and only
+# swapping the data between renders; --workers renders batches of stations in
+# parallel processes, each with its own renderer and read-only connection.
+
+import argparse
+import datetime
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import analyses
+import batch
+import daynumbers
+import queries
+import readonly
+import rollups
+import stations
+
+#longitude/latitude covered by chicago.png
+MAP_EXTENT = [-87.9277, -87.5569, 41.7012, 42.0868]
+MAP_IMAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "chicago.png")
+CHARTS = ["yearly", "monthly", "daily", "map"]
+#zlib level for PNG files; encoding at the default level took longer than drawing
+PNG_COMPRESSION = 1
+#points kept per series; about the width of a 9 inch chart at 100 dpi
+DEFAULT_MAX_POINTS = 900
+#station batches per worker, so a slow batch doesn't leave the others idle
+BATCHES_PER_WORKER = 4
+
+_baseMap = None
+_baseMapLock = threading.Lock()
+
+##################################################################
+#
+# base_map
+#
+# Returns chicago.png as a decoded image array, reading the file
+# only the first time.
+#
+def base_map():
+    global _baseMap
+    with _baseMapLock:
+        if _baseMap is None:
+            import matplotlib.image
+            _baseMap = matplotlib.image.imread(MAP_IMAGE)
+        return _baseMap
+
+##################################################################
+#
+# lttb
+#
+# Given x and y values and how many points to keep, returns the x
+# and y of the points Largest-Triangle-Three-Buckets picks: the first
+# and last, plus from each bucket in between the point forming the
+# largest triangle with the previous pick and the next bucket's mean.
+#
+def lttb(xs, ys, threshold):
+    n = len(xs)
+    if threshold >= n or threshold < 3:
+        return (list(xs), list(ys))
+    sampledX = [xs[0]]
+    sampledY = [ys[0]]
+    bucket = (n - 2) / (threshold - 2)
+    previous = 0
+    for i in range(threshold - 2):
+        start = int(i * bucket) + 1
+        end = int((i + 1) * bucket) + 1
+        #mean of the next bucket, or the last point after the final bucket
+        nextEnd = min(int((i + 2) * bucket) + 1, n - 1)
+        if end < nextEnd:
+            meanX = sum(xs[end:nextEnd]) / (nextEnd - end)
+            meanY = sum(ys[end:nextEnd]) / (nextEnd - end)
+        else:
+            meanX, meanY = xs[n - 1], ys[n - 1]
+        px, py = xs[previous], ys[previous]
+        best = -1
+        chosen = start
+        for j in range(start, end):
+            area = abs((px - meanX) * (ys[j] - py) - (px - xs[j]) * (meanY - py))
+            if area > best:
+                best = area
+                chosen = j
+        sampledX.append(xs[chosen])
+        sampledY.append(ys[chosen])
+        previous = chosen
+    sampledX.append(xs[n - 1])
+    sampledY.append(ys[n - 1])
+    return (sampledX, sampledY)
+
+##################################################################
+#
+# ChartRenderer
+#
+# Draws line charts and station maps to files with the Agg backend.
+# Each chart type has one figure that is reused: the lines, labels
+# and annotations are updated in place instead of building a new
+# figure per chart.
+#
+class ChartRenderer:
+    def __init__(self, format="png", dpi=100, maxPoints=DEFAULT_MAX_POINTS):
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+        import matplotlib.dates
+        import matplotlib.image
+        import matplotlib.ticker
+        self.dates = matplotlib.dates
+        self.ticker = matplotlib.ticker
+        self.image = matplotlib.image
+        self.format = format
+        self.dpi = dpi
+        self.maxPoints = maxPoints
+        #line charts
+        self.lineFigure = Figure(figsize=(9, 9))
+        FigureCanvasAgg(self.lineFigure)
+        self.lineAxes = self.lineFigure.add_subplot()
+        self.lines = []
+        #station maps, with the base map drawn once
+        self.mapFigure = Figure(figsize=(9, 9))
+        FigureCanvasAgg(self.mapFigure)
+        self.mapAxes = self.mapFigure.add_subplot()
+        self.mapAxes.imshow(base_map(), extent=MAP_EXTENT)
+        self.mapAxes.set_xlim(MAP_EXTENT[0], MAP_EXTENT[1])
+        self.mapAxes.set_ylim(MAP_EXTENT[2], MAP_EXTENT[3])
+        self.mapPoints = self.mapAxes.plot([], [], "o", color="red", markersize=4)[0]
+        self.mapLabels = []
+        self.mapBackground = None
+
+    ##################################################################
+    #
+    # line_chart
+    #
+    # Given the output path (without extension), a title, axis labels
+    # and [(label, xs, ys)], draws one line per series, thinned to
+    # maxPoints, and returns the file written. dates=True treats xs as
+    # matplotlib date numbers.
+    #
+    def line_chart(self, path, title, xlabel, ylabel, seriesList, dates=False):
+        axes = self.lineAxes
+        while len(self.lines) < len(seriesList):
+            self.lines.append(axes.plot([], [])[0])
+        for line, (label, xs, ys) in zip(self.lines, seriesList):
+            thinX, thinY = lttb(xs, ys, self.maxPoints)
+            line.set_data(thinX, thinY)
+            line.set_label(label)
+            line.set_visible(True)
+        for line in self.lines[len(seriesList):]:
+            line.set_data([], [])
+            line.set_visible(False)
+        if dates:
+            locator = self.dates.AutoDateLocator()
+            axes.xaxis.set_major_locator(locator)
+            axes.xaxis.set_major_formatter(self.dates.AutoDateFormatter(locator))
+        else:
+            #years and months are whole numbers
+            axes.xaxis.set_major_locator(self.ticker.MaxNLocator(integer=True))
+            axes.xaxis.set_major_formatter(self.ticker.ScalarFormatter(useOffset=False))
+        axes.relim()
+        axes.autoscale_view()
+        axes.set_title(title)
+        axes.set_xlabel(xlabel)
+        axes.set_ylabel(ylabel)
+        if len(seriesList) > 1:
+            axes.legend(handles=self.lines[:len(seriesList)])
+        elif axes.get_legend() is not None:
+            axes.get_legend().remove()
+        return self.save(self.lineFigure, path)
+
+    ##################################################################
+    #
+    # station_map
+    #
+    # Given the output path (without extension), a title and rows of
+    # (station name, latitude, longitude), marks and labels them on
+    # the base map and returns the file written.
+    #
+    def station_map(self, path, title, rows):
+        canvas = self.mapFigure.canvas
+        if self.format == "png" and self.mapBackground is None:
+            #the map without stations or title, drawn once
+            self.mapFigure.set_dpi(self.dpi)
+            canvas.draw()
+            self.mapBackground = canvas.copy_from_bbox(self.mapFigure.bbox)
+        for label in self.mapLabels:
+            label.remove()
+        self.mapPoints.set_data([row[2] for row in rows], [row[1] for row in rows])
+        self.mapLabels = [self.mapAxes.annotate(row[0], (row[2], row[1]), fontsize=8) for row in rows]
+        self.mapAxes.set_title(title)
+        if self.format != "png":
+            return self.save(self.mapFigure, path)
+        #paste the rendered map back and draw only what changed on top
+        canvas.restore_region(self.mapBackground)
+        self.mapAxes.draw_artist(self.mapPoints)
+        for label in self.mapLabels:
+            self.mapAxes.draw_artist(label)
+        self.mapAxes.draw_artist(self.mapAxes.title)
+        fileName = f"{path}.png"
+        self.image.imsave(fileName, canvas.buffer_rgba(), format="png", dpi=self.dpi,
+                          pil_kwargs={"compress_level": PNG_COMPRESSION})
+        return fileName
+
+    def save(self, figure, path):
+        fileName = f"{path}.{self.format}"
+        options = {"pil_kwargs": {"compress_level": PNG_COMPRESSION}} if self.format == "png" else {}
+        figure.savefig(fileName, format=self.format, dpi=self.dpi, **options)
+        return fileName
+
+#matplotlib date number of each "YYYY-MM-DD"
+def date_numbers(days):
+    epoch = datetime.date(1970, 1, 1).toordinal()
+    return [datetime.date.fromisoformat(day[:10]).toordinal() - epoch for day in days]
+
+##################################################################
+#
+# render_station
+#
+# Given a connection, a renderer, a station, its location, the year
+# (or None) and the charts wanted, renders them into directory.
+# Returns the files written.
+#
+def render_station(dbConn, renderer, directory, stationID, name, location, year, charts):
+    written = []
+    base = os.path.join(directory, f"{stationID}")
+    if "yearly" in charts:
+        rows = analyses.yearly_ridership(dbConn, stationID, name)["rows"]
+        written.append(renderer.line_chart(f"{base}_yearly", f"Yearly Ridership at {name}", "Year",
+                                           "Number of Riders", [(name, [int(r[0]) for r in rows], [r[1] for r in rows])]))
+    if "monthly" in charts and year is not None:
+        rows = analyses.monthly_ridership(dbConn, stationID, name, year)["rows"]
+        written.append(renderer.line_chart(f"{base}_monthly_{year}", f"Monthly Ridership at {name} ({year})", "Month",
+                                           "Number of Riders", [(name, [int(r[0][:2]) for r in rows], [r[1] for r in rows])]))
+    if "daily" in charts:
+        if year is not None:
+            result = analyses.compare_stations(dbConn, year, (stationID, name))
+            dayNumbers, riders = date_numbers(result["dates"]), [row[1] for row in result["rows"]]
+            title = f"Ridership each Day of ({year}) at {name}"
+        else:
+            #the whole history, which is where thinning matters
+            dbCursor = dbConn.cursor()
+            if daynumbers.has_day_numbers(dbConn):
+                #already days since 1970-01-01, matplotlib's date numbers
+                dbCursor.execute(queries.STATION_DAY_HISTORY, [stationID])
+                rows = dbCursor.fetchall()
+                dayNumbers = [r[0] for r in rows]
+            else:
+                dbCursor.execute(queries.STATION_DAILY_HISTORY, [stationID])
+                rows = dbCursor.fetchall()
+                dayNumbers = date_numbers([r[0] for r in rows])
+            riders = [r[1] or 0 for r in rows]
+            title = f"Daily Ridership at {name}"
+        written.append(renderer.line_chart(f"{base}_daily" + (f"_{year}" if year is not None else ""), title, "Day",
+                                           "Number of Riders", [(name, dayNumbers, riders)], dates=True))
+    if "map" in charts and location is not None:
+        try:
+            rows = analyses.nearby_stations(dbConn, location[0], location[1], 1.0)["rows"]
+        except analyses.AnalysisError:
+            rows = []
+        written.append(renderer.station_map(f"{base}_map", f"Stations Near {name}", rows))
+    return written
+
+#runs in a worker: renders a batch of stations with the worker's renderer
+#(see readonly.process_pool), returns the files written
+def render_batch(directory, stationList, locations, year, charts):
+    dbConn, renderer = readonly.worker_connection(), readonly.worker_state()
+    return sum(len(render_station(dbConn, renderer, directory, stationID, name, locations.get(stationID), year, charts))
+               for stationID, name in stationList)
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="main.py render", description="Render charts for many stations to files.")
+    parser.add_argument("--station", action="append", help="station name, wildcards _ and %% (repeatable)")
+    parser.add_argument("--all-stations", action="store_true", help="every station")
+    parser.add_argument("--charts", default="yearly,daily", help=f"comma separated, from {','.join(CHARTS)}")
+    parser.add_argument("--year", help="year for the monthly and daily charts (daily covers all years without it)")
+    parser.add_argument("--format", choices=["png", "svg"], default="png", help="image format")
+    parser.add_argument("--dpi", type=int, default=100, help="resolution of PNG files")
+    parser.add_argument("--max-points", type=int, default=DEFAULT_MAX_POINTS, help="points kept per line")
+    parser.add_argument("--output", default="charts", help="directory to write to")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes, 1 renders in-process")
+    parser.add_argument("--db", default=batch.DATABASE, help="path to the CTA database")
+    return parser
+
+##################################################################
+#
+# main
+#
+# Given the command line arguments after "render", renders the
+# charts for every chosen station and reports the rate.
+#
+def main(argv):
+    args = build_parser().parse_args(argv)
+    charts = [chart.strip() for chart in args.charts.split(",") if chart.strip() != ""]
+    unknown = [chart for chart in charts if chart not in CHARTS]
+    if len(unknown) > 0:
+        print(f"**Unknown chart: {', '.join(unknown)}...", file=sys.stderr)
+        return 2
+    dbConn = sqlite3.connect(args.db)
+    rollups.refresh_rollups(dbConn)
+    resolver = stations.get_resolver(dbConn)
+    if args.all_stations:
+        chosen = resolver.like("%")
+    else:
+        chosen = sorted(set(s for pattern in args.station or [] for s in resolver.like(pattern)))
+    if len(chosen) == 0:
+        print("**No station found...", file=sys.stderr)
+        return 1
+    dbCursor = dbConn.cursor()
+    dbCursor.execute(queries.STATION_LOCATIONS)
+    locations = {stationID: (latitude, longitude) for stationID, latitude, longitude in dbCursor.fetchall()}
+    os.makedirs(args.output, exist_ok=True)
+    started = time.perf_counter()
+    written = 0
+    workers = max(1, min(args.workers, len(chosen)))
+    if workers == 1:
+        renderer = ChartRenderer(args.format, args.dpi, args.max_points)
+        for stationID, name in chosen:
+            written += len(render_station(dbConn, renderer, args.output, stationID, name,
+                                          locations.get(stationID), args.year, charts))
+    else:
+        size = -(-len(chosen) // (workers * BATCHES_PER_WORKER))
+        with readonly.process_pool(workers, args.db, ChartRenderer,
+                                   (args.format, args.dpi, args.max_points)) as pool:
+            futures = [pool.submit(render_batch, args.output, chosen[i:i + size], locations, args.year, charts)
+                       for i in range(0, len(chosen), size)]
+            for future in futures:
+                written += future.result()
+    elapsed = time.perf_counter() - started
+    dbConn.close()
+    print(f"Rendered {written:,} charts for {len(chosen):,} stations to {args.output} "
+          f"in {elapsed:.1f} s ({written / max(elapsed, 1e-9):,.1f} charts/s)")
+    return 0
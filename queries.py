@@ -0,0 +1,201 @@
+# Overview: SQL used by the CTA L analysis app menu options.
+# Time filters are written as half-open Ride_Date ranges so SQLite can
+# walk an index on Ride_Date instead of calling strftime() on every row.
+# Databases with day numbers (see daynumbers.py) use integer Day_Number
+# ranges instead, and dates are formatted only for the rows returned.
+
+##################################################################
+#
+# year_range
+#
+# Given a year typed by the user, returns the half-open range
+# [start, end) of Ride_Date values that fall within that year.
+# A year that isn't a number gives an empty range, so it matches
+# nothing just like strftime('%Y', Ride_Date) = ? used to.
+#
+def year_range(year):
+    year = str(year).strip()
+    if not year.isdigit():
+        return ("", "")
+    return (f"{int(year):04d}-01-01", f"{int(year) + 1:04d}-01-01")
+
+##################################################################
+#
+# station names, loaded once into the station resolver (options 1, 2, 6, 7, 8)
+#
+STATION_NAMES = """Select Station_ID, Station_Name
+                   From Stations
+                   Order By Station_Name Asc;"""
+
+##################################################################
+#
+# option 2
+#
+DAY_TYPE_RIDERSHIP = """Select Type_of_Day, Sum(Num_Riders)
+                        From RidershipRollup
+                        Where Station_ID = ?
+                        Group By Type_of_Day;"""
+
+##################################################################
+#
+# option 3
+#
+#the grand total comes along on every row (a window over the groups), not from a second scan
+WEEKDAY_RIDERSHIP_BY_STATION = """Select Stations.Station_Name, Sum(RidershipRollup.Num_Riders) As WeekdayRidership,
+                                         Sum(Sum(RidershipRollup.Num_Riders)) Over () As Total
+                                  From RidershipRollup Join Stations On RidershipRollup.Station_ID = Stations.Station_ID
+                                  Where RidershipRollup.Type_of_Day = 'W'
+                                  Group By Stations.Station_Name
+                                  Order By WeekdayRidership Desc;"""
+
+#per Station_ID, for adding up over year partitions (see partitions.py)
+WEEKDAY_RIDERSHIP_BY_STATION_ID = """Select Station_ID, Sum(Num_Riders)
+                                     From RidershipRollup
+                                     Where Type_of_Day = 'W'
+                                     Group By Station_ID;"""
+
+##################################################################
+#
+# options 4, 5, 10 and 11: the network model, loaded once (see network.py)
+#
+NETWORK_STOPS = """Select Stop_ID, Station_ID, Stop_Name, Direction, ADA, Latitude, Longitude
+                   From Stops
+                   Order By Stop_ID;"""
+
+NETWORK_LINES = """Select Line_ID, Color
+                   From Lines
+                   Order By Line_ID;"""
+
+NETWORK_STOP_LINES = """Select Stop_ID, Line_ID
+                        From StopDetails
+                        Order By Stop_ID, Line_ID;"""
+
+##################################################################
+#
+# options 6, 7 and 8 (stations already resolved to a Station_ID)
+#
+YEARLY_RIDERSHIP = """Select Cast(Year As Text) As Year, Sum(Num_Riders)
+                      From RidershipRollup
+                      Where Station_ID = ?
+                      Group By Year Order By Year"""
+
+MONTHLY_RIDERSHIP = """Select printf('%02d/%04d', Month, Year) as Monthly, Sum(Num_Riders)
+                       From RidershipRollup
+                       Where Station_ID = ? And Year = ?
+                       Group By Monthly
+                       Order By Monthly;"""
+
+#every day of a year for several stations in one pass over the
+#(Station_ID, Ride_Date) index -> (station ids..., year start, year end)
+def daily_ridership_of(numStations):
+    return f"""Select Station_ID, strftime('%Y-%m-%d', Ride_Date) As Day, Num_Riders
+               From Ridership
+               Where Station_ID In ({", ".join(["?"] * numStations)}) And Ride_Date >= ? And Ride_Date < ?
+               Group By Station_ID, Ride_Date
+               Order By Station_ID, Ride_Date;"""
+
+#the same with day numbers, over the (Station_ID, Day_Number) index
+#-> (station ids..., first day, day after the last)
+def daily_ridership_by_day_of(numStations):
+    return f"""Select Station_ID, Day_Number, Num_Riders
+               From Ridership
+               Where Station_ID In ({", ".join(["?"] * numStations)}) And Day_Number >= ? And Day_Number < ?
+               Group By Station_ID, Day_Number
+               Order By Station_ID, Day_Number;"""
+
+##################################################################
+#
+# option 12 (see rankings.py)
+#
+#(Where clause, params) on RidershipRollup for a ranking's filters,
+#each one left out when it's None
+def ranking_filter(dayType, firstYear, lastYear, stationIDs):
+    conditions = ["1 = 1"]
+    params = []
+    if dayType is not None:
+        conditions.append("RidershipRollup.Type_of_Day = ?")
+        params.append(dayType)
+    if firstYear is not None:
+        conditions.append("RidershipRollup.Year >= ?")
+        params.append(firstYear)
+    if lastYear is not None:
+        conditions.append("RidershipRollup.Year <= ?")
+        params.append(lastYear)
+    if stationIDs is not None:
+        conditions.append(f"RidershipRollup.Station_ID In ({', '.join(['?'] * len(stationIDs))})")
+        params.extend(stationIDs)
+    return (" And ".join(conditions), params)
+
+#every station's riders, its share and the grand total in one pass:
+#the windows run over the grouped rows -> (name, riders, share, total)
+def station_totals_of(where):
+    return f"""Select Stations.Station_Name, Sum(RidershipRollup.Num_Riders) As Riders,
+                      Coalesce(Sum(RidershipRollup.Num_Riders) * 100.0 / Sum(Sum(RidershipRollup.Num_Riders)) Over (), 0),
+                      Sum(Sum(RidershipRollup.Num_Riders)) Over ()
+               From RidershipRollup Join Stations On RidershipRollup.Station_ID = Stations.Station_ID
+               Where {where}
+               Group By Stations.Station_Name;"""
+
+#per Station_ID, for adding up over year partitions (see partitions.py)
+def station_riders_of(where):
+    return f"""Select Station_ID, Sum(Num_Riders)
+               From RidershipRollup
+               Where {where}
+               Group By Station_ID;"""
+
+##################################################################
+#
+# option 9
+#
+#every stop location, loaded once into the spatial index
+STOP_LOCATIONS = """Select Stop_ID, Station_Name, Latitude, Longitude
+                    From Stops Join Stations on Stops.Station_ID = Stations.Station_ID
+                    Group By Latitude, Longitude
+                    Order By Stations.Station_Name, Stop_ID Asc;"""
+
+##################################################################
+#
+# chart rendering (plots.py)
+#
+#a station's every day, for the whole-history daily chart
+STATION_DAILY_HISTORY = """Select strftime('%Y-%m-%d', Ride_Date), Num_Riders
+                           From Ridership
+                           Where Station_ID = ?
+                           Order By Ride_Date;"""
+
+STATION_DAY_HISTORY = """Select Day_Number, Num_Riders
+                         From Ridership
+                         Where Station_ID = ?
+                         Order By Day_Number;"""
+
+#where each station is: the middle of its stops
+STATION_LOCATIONS = """Select Station_ID, Avg(Latitude), Avg(Longitude)
+                       From Stops
+                       Group By Station_ID;"""
+
+##################################################################
+#
+# option_queries
+#
+# Given a sample Station_ID and year, returns the statements each
+# menu option runs, as {option: [(sql, params), ...]}. Used to show
+# query plans without going through the input() prompts. dayRange
+# is the year's day numbers on a database that has them.
+#
+def option_queries(stationID, year, dayRange=None):
+    start, end = year_range(year) if dayRange is None else dayRange
+    dailyRidership = daily_ridership_of(2) if dayRange is None else daily_ridership_by_day_of(2)
+    #a weekday leaderboard for option 12
+    rankingWhere, rankingParams = ranking_filter('W', None, None, None)
+    return {
+        1: [(STATION_NAMES, [])],
+        2: [(DAY_TYPE_RIDERSHIP, [stationID])],
+        3: [(WEEKDAY_RIDERSHIP_BY_STATION, [])],
+        4: [(NETWORK_STOPS, []), (NETWORK_LINES, []), (NETWORK_STOP_LINES, [])],
+        5: [(NETWORK_STOPS, []), (NETWORK_LINES, []), (NETWORK_STOP_LINES, [])],
+        6: [(YEARLY_RIDERSHIP, [stationID])],
+        7: [(MONTHLY_RIDERSHIP, [stationID, year])],
+        8: [(dailyRidership, [stationID, stationID, start, end])],
+        9: [(STOP_LOCATIONS, [])],
+        12: [(station_totals_of(rankingWhere), rankingParams)],
+    }
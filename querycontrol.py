@@ -0,0 +1,164 @@
+# Overview: Progress reports, time limits and cancellation for SQLite queries.
+# QueryGuard runs an analysis with a progress handler on its connection: after
+# REPORT_AFTER seconds it reports how long the query has been running, and past
+# the time limit it makes SQLite abort the statement. cancel() (Ctrl-C at the
+# menu, see interrupts_cancel) calls Connection.interrupt(), so only the running
+# statement fails and the connection stays usable. Aborted statements come back as
+# QueryTimeout or QueryCancelled, which are AnalysisErrors like any other failed
+# analysis. SQLite allows one progress handler per connection, so the profiler's
+# (see querylog) is called from the guard's and put back afterwards. Optionally
+# the analysis runs on a worker thread while the menu thread waits, so Ctrl-C is
+# handled right away even when SQLite isn't calling back.
+
+import concurrent.futures
+import contextlib
+import signal
+import sqlite3
+import sys
+import time
+
+import analyses
+import querylog
+
+#VM steps between progress callbacks; the profiler's granularity, so its step counts stay right
+PROGRESS_STEPS = querylog.STEP_GRANULARITY
+#seconds a query runs before progress is reported, and between reports
+REPORT_AFTER = 1.0
+REPORT_EVERY = 0.5
+
+class QueryCancelled(analyses.AnalysisError):
+    pass
+
+class QueryTimeout(QueryCancelled):
+    pass
+
+#progress reporter for the menu: one line on stderr, rewritten in place and
+#cleared when the query ends (elapsed is None)
+def print_progress(elapsed):
+    if elapsed is None:
+        print("\r" + " " * 50 + "\r", end="", file=sys.stderr, flush=True)
+    else:
+        print(f"\r  working... {elapsed:.1f} s (Ctrl-C to cancel)", end="", file=sys.stderr, flush=True)
+
+##################################################################
+#
+# QueryGuard
+#
+# Runs one analysis at a time with a time limit (seconds, or None
+# for none) and progress reports through report(elapsed seconds).
+# chained is a progress handler already on the connection, called
+# on every callback. With useThread the analysis runs on a worker
+# thread, which needs a connection opened with check_same_thread=False.
+#
+class QueryGuard:
+    def __init__(self, timeout=None, report=None, chained=None, steps=PROGRESS_STEPS, useThread=False):
+        self.timeout = timeout
+        self.report = report
+        self.chained = chained
+        self.steps = steps
+        self.executor = None
+        if useThread:
+            self.executor = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="query")
+        #connection of the running analysis, None when idle
+        self.dbConn = None
+        self.cancelled = False
+        self.deadline = None
+        self.started = 0.0
+        self.nextReport = 0.0
+        self.reported = False
+
+    @property
+    def running(self):
+        return self.dbConn is not None
+
+    #progress handler: nonzero makes SQLite abort the statement
+    def on_progress(self):
+        if self.chained is not None:
+            self.chained()
+        if self.cancelled:
+            return 1
+        now = time.monotonic()
+        if self.deadline is not None and now > self.deadline:
+            return 1
+        if self.report is not None and now >= self.nextReport:
+            self.nextReport = now + REPORT_EVERY
+            self.reported = True
+            self.report(now - self.started)
+        return 0
+
+    #abort the running statement (and any the analysis starts after it); safe from any thread
+    def cancel(self):
+        self.cancelled = True
+        dbConn = self.dbConn
+        if dbConn is not None:
+            dbConn.interrupt()
+
+    ##################################################################
+    #
+    # run
+    #
+    # Given a connection and a function running an analysis on it,
+    # returns what the function returns. Raises QueryTimeout or
+    # QueryCancelled if its statements were aborted. An analysis run
+    # from inside another is simply called.
+    #
+    def run(self, dbConn, compute):
+        if self.dbConn is not None:
+            return compute()
+        self.cancelled = False
+        self.reported = False
+        self.started = time.monotonic()
+        self.deadline = self.started + self.timeout if self.timeout is not None else None
+        self.nextReport = self.started + REPORT_AFTER
+        self.dbConn = dbConn
+        dbConn.set_progress_handler(self.on_progress, self.steps)
+        try:
+            if self.executor is None:
+                result = compute()
+            else:
+                future = self.executor.submit(compute)
+                try:
+                    result = future.result()
+                except QueryCancelled:
+                    #Ctrl-C while waiting: let the worker stop before the connection is used again
+                    concurrent.futures.wait([future])
+                    raise
+        except sqlite3.OperationalError as e:
+            if self.cancelled:
+                raise QueryCancelled("Query cancelled...")
+            if self.deadline is not None and time.monotonic() > self.deadline:
+                raise QueryTimeout("Query took longer than the time limit...")
+            raise e
+        finally:
+            dbConn.set_progress_handler(self.chained, self.steps if self.chained is not None else 0)
+            self.dbConn = None
+            if self.reported:
+                self.report(None)
+        if self.cancelled:
+            #cancelled after its last statement; the user asked not to wait for it
+            raise QueryCancelled("Query cancelled...")
+        return result
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+
+##################################################################
+#
+# interrupts_cancel
+#
+# Context manager for the main thread: while inside it, Ctrl-C
+# cancels the guard's running query and raises QueryCancelled
+# instead of KeyboardInterrupt, so the menu can carry on.
+#
+@contextlib.contextmanager
+def interrupts_cancel(guard):
+    def on_interrupt(signum, frame):
+        running = guard.running
+        guard.cancel()
+        raise QueryCancelled("Query cancelled..." if running else "Cancelled...")
+    previous = signal.signal(signal.SIGINT, on_interrupt)
+    try:
+        yield guard
+    finally:
+        signal.signal(signal.SIGINT, previous)
@@ -0,0 +1,223 @@
+# Overview: Query instrumentation for the CTA L analysis app.
+# With --profile, the menu's connection is opened with ProfiledConnection, whose
+# cursors time every statement (execute plus fetches) and count the rows it
+# returns. SQLite's trace callback supplies the statement text with its bound
+# values and the progress handler counts the VM steps it took. Each distinct
+# statement's EXPLAIN QUERY PLAN is captured once. Statements slower than the
+# threshold are appended to a slow-query log, and summary() gives per-option
+# totals for the menu to print on exit or on demand.
+
+import contextlib
+import sqlite3
+import time
+
+#VM steps per progress callback; the step counts are multiples of this
+STEP_GRANULARITY = 1000
+#statements sqlite3 issues on its own around ours; not worth tracing
+TRANSACTION_STATEMENTS = ("BEGIN", "COMMIT", "ROLLBACK", "SAVEPOINT", "RELEASE")
+
+##################################################################
+#
+# Statement
+#
+# One execution of one SQL statement.
+#
+class Statement:
+    __slots__ = ("sql", "params", "expanded", "seconds", "rows", "steps", "plan")
+
+    def __init__(self, sql, params):
+        self.sql = sql
+        self.params = params
+        self.expanded = None
+        self.seconds = 0.0
+        self.rows = 0
+        self.steps = 0
+        self.plan = None
+
+##################################################################
+#
+# ProfiledCursor
+#
+# Cursor that charges the time spent in execute() and the fetches
+# that follow it to the statement, and counts the rows fetched.
+#
+class ProfiledCursor(sqlite3.Cursor):
+    statement = None
+
+    def execute(self, sql, params=()):
+        profiler = self.connection.profiler
+        self.statement = profiler.begin(sql, params)
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, params)
+        finally:
+            self.statement.seconds += time.perf_counter() - started
+            profiler.current = None
+
+    def fetchone(self):
+        row = self._timed(super().fetchone)
+        if row is not None and self.statement is not None:
+            self.statement.rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._timed(lambda: super(ProfiledCursor, self).fetchmany(self.arraysize if size is None else size))
+        if self.statement is not None:
+            self.statement.rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(super().fetchall)
+        if self.statement is not None:
+            self.statement.rows += len(rows)
+        return rows
+
+    #fetches run the rest of the statement, so they count towards it
+    def _timed(self, fetch):
+        if self.statement is None:
+            return fetch()
+        profiler = self.connection.profiler
+        profiler.current = self.statement
+        started = time.perf_counter()
+        try:
+            return fetch()
+        finally:
+            self.statement.seconds += time.perf_counter() - started
+            profiler.current = None
+
+##################################################################
+#
+# ProfiledConnection
+#
+# Connection whose cursors are ProfiledCursors. Pass it as the
+# factory to sqlite3.connect(), then create a Profiler for it.
+#
+class ProfiledConnection(sqlite3.Connection):
+    profiler = None
+
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
+##################################################################
+#
+# Profiler
+#
+# Collects the statements run on a ProfiledConnection, grouped by
+# the section (menu option) they ran in.
+#
+class Profiler:
+    def __init__(self, dbConn, slowMs=100.0, logPath="slow_queries.log"):
+        self.dbConn = dbConn
+        self.slowMs = slowMs
+        self.logPath = logPath
+        self.current = None
+        self.statements = []
+        #section -> {"calls", "seconds", "statements", "rows", "slowest"}
+        self.totals = {}
+        #sql text -> EXPLAIN QUERY PLAN lines
+        self.plans = {}
+        dbConn.profiler = self
+        dbConn.set_trace_callback(self.on_trace)
+        dbConn.set_progress_handler(self.on_progress, STEP_GRANULARITY)
+
+    def begin(self, sql, params):
+        statement = Statement(sql, params)
+        self.current = statement
+        self.statements.append(statement)
+        return statement
+
+    #trace callback: the statement as SQLite runs it, values bound
+    def on_trace(self, text):
+        if self.current is not None and self.current.expanded is None \
+                and not text.upper().startswith(TRANSACTION_STATEMENTS):
+            self.current.expanded = text
+
+    #progress callback: count steps, never interrupt
+    def on_progress(self):
+        if self.current is not None:
+            self.current.steps += STEP_GRANULARITY
+        return 0
+
+    ##################################################################
+    #
+    # measure
+    #
+    # Context manager around one menu option (or startup step); the
+    # statements run inside it are added to that section's totals and
+    # any slow ones are logged when it ends.
+    #
+    @contextlib.contextmanager
+    def measure(self, section):
+        self.flush(None, 0.0)
+        started = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.flush(section, time.perf_counter() - started)
+
+    #charge the statements run since the last flush to a section
+    #(None drops them)
+    def flush(self, section, elapsed):
+        statements = self.statements
+        self.statements = []
+        self.current = None
+        if section is not None:
+            self.finish(section, statements, elapsed)
+
+    def finish(self, section, statements, elapsed):
+        totals = self.totals.setdefault(section, {"calls": 0, "seconds": 0.0, "wall_seconds": 0.0,
+                                                  "statements": 0, "rows": 0, "slowest": None})
+        totals["calls"] += 1
+        totals["wall_seconds"] += elapsed
+        for statement in statements:
+            statement.plan = self.plan_of(statement.sql, statement.params)
+            totals["statements"] += 1
+            totals["seconds"] += statement.seconds
+            totals["rows"] += statement.rows
+            if totals["slowest"] is None or statement.seconds > totals["slowest"].seconds:
+                totals["slowest"] = statement
+            if statement.seconds * 1000 >= self.slowMs:
+                self.log_slow(section, statement)
+
+    #EXPLAIN QUERY PLAN for a statement, computed once per SQL text
+    def plan_of(self, sql, params):
+        if sql not in self.plans:
+            try:
+                #a plain cursor, so the plan query itself isn't profiled
+                dbCursor = sqlite3.Cursor(self.dbConn)
+                dbCursor.execute("Explain Query Plan " + sql, params)
+                self.plans[sql] = [row[3] for row in dbCursor.fetchall()]
+            except sqlite3.Error:
+                #not a query, e.g. Pragma or Create Table
+                self.plans[sql] = []
+        return self.plans[sql]
+
+    def log_slow(self, section, statement):
+        with open(self.logPath, "a") as logFile:
+            logFile.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {section} {statement.seconds * 1000:.1f} ms "
+                          f"{statement.rows} rows ~{statement.steps} steps\n")
+            logFile.write("  " + " ".join((statement.expanded or statement.sql).split()) + "\n")
+            for line in statement.plan:
+                logFile.write("    " + line + "\n")
+
+    ##################################################################
+    #
+    # summary
+    #
+    # Returns the lines of the per-option timing summary.
+    #
+    def summary(self):
+        lines = ["Query timings:"]
+        if len(self.totals) == 0:
+            lines.append("  no queries yet")
+        for section, totals in self.totals.items():
+            lines.append(f"  {section}: {totals['calls']} call(s), {totals['statements']} statements, "
+                         f"{totals['rows']:,} rows, {totals['seconds'] * 1000:.1f} ms in SQL "
+                         f"of {totals['wall_seconds'] * 1000:.1f} ms")
+            slowest = totals["slowest"]
+            if slowest is not None:
+                lines.append(f"    slowest: {slowest.seconds * 1000:.1f} ms, {slowest.rows:,} rows: "
+                             + " ".join(slowest.sql.split())[:100])
+                for line in slowest.plan:
+                    lines.append("      " + line)
+        return lines
@@ -0,0 +1,102 @@
+# Overview: Station leaderboards (option 12).
+# A ranking is chosen by type of day, a range of years and a line color. The
+# per-station totals behind it come from one pass over the rollup that also works
+# out the grand total and every station's share with window functions (see
+# queries.station_totals_of), so the total isn't a second scan. The totals are
+# kept in the result cache, and each page is picked out of them with a bounded
+# heap: heapq.nsmallest(k) costs O(n log k) and never sorts the whole station set.
+# Pages are keyset based: the cursor names the last station shown, and the next
+# page is the k stations that come after it in ranking order, so a page is right
+# even if earlier pages were never fetched.
+
+import base64
+import heapq
+import json
+
+ORDERS = ("top", "bottom")
+DEFAULT_LIMIT = 10
+#typed day type -> Type_of_Day; "" or "all" means every day
+DAY_TYPES = {"w": 'W', "weekday": 'W', "a": 'A', "saturday": 'A',
+             "u": 'U', "sunday": 'U', "holiday": 'U', "sunday/holiday": 'U'}
+
+class RankingError(ValueError):
+    pass
+
+#"Weekday", "w", "" ... -> 'W', 'W', None
+def day_type(text):
+    if text is None or text.strip().lower() in ("", "all"):
+        return None
+    if text.strip().lower() not in DAY_TYPES:
+        raise RankingError("Day type entered is not W, A, U or all...")
+    return DAY_TYPES[text.strip().lower()]
+
+#"2015" -> 2015, "" or None -> None
+def year(text):
+    if text is None or str(text).strip() == "":
+        return None
+    if not str(text).strip().isdigit():
+        raise RankingError("Year entered is not a number...")
+    return int(str(text).strip())
+
+#"10" -> 10; a page holds at least one station
+def limit(text):
+    if text is None or str(text).strip() == "":
+        return DEFAULT_LIMIT
+    if not str(text).strip().isdigit() or int(str(text).strip()) < 1:
+        raise RankingError("Number of stations entered is not a positive number...")
+    return int(str(text).strip())
+
+#sort key of a (name, riders, share) row: smaller comes first in the ranking
+def rank_key(order):
+    if order == "top":
+        return lambda row: (-row[1], row[0])
+    return lambda row: (row[1], row[0])
+
+##################################################################
+#
+# encode_cursor / decode_cursor
+#
+# A cursor is the last row's rank and (riders, name), as URL-safe
+# text, so it can be passed back on the command line or in a query
+# string.
+#
+def encode_cursor(order, rank, row):
+    text = json.dumps([order, rank, row[1], row[0]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(text.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor, order):
+    try:
+        text = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        cursorOrder, rank, riders, name = json.loads(text)
+        if cursorOrder != order or not isinstance(rank, int) or not isinstance(riders, int):
+            raise ValueError(cursor)
+    except (ValueError, TypeError, UnicodeDecodeError):
+        raise RankingError("That page cursor is not valid for this ranking...")
+    return (rank, (name, riders))
+
+##################################################################
+#
+# page
+#
+# Given [(name, riders, share)] for every station, the order ("top"
+# or "bottom"), how many to show and the cursor of the previous page
+# (or None), returns (rows, next cursor). Rows are (rank, name,
+# riders, share); the next cursor is None on the last page.
+#
+def page(totals, order, count, cursor=None):
+    if order not in ORDERS:
+        raise RankingError("Order entered is not top or bottom...")
+    key = rank_key(order)
+    rank = 0
+    candidates = totals
+    if cursor is not None:
+        rank, last = decode_cursor(cursor, order)
+        lastKey = key(last)
+        candidates = (row for row in totals if key(row) > lastKey)
+    #one more than asked for tells whether there's another page
+    found = heapq.nsmallest(count + 1, candidates, key=key)
+    rows = [(rank + i + 1, name, riders, share) for i, (name, riders, share) in enumerate(found[:count])]
+    nextCursor = None
+    if len(found) > count:
+        nextCursor = encode_cursor(order, rank + count, found[count - 1])
+    return (rows, nextCursor)
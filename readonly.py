@@ -0,0 +1,67 @@
+# Overview: Read-only access to the CTA database for threads and worker processes.
+# connect_read_only() is shared by the query service's connection pool, the year
+# partitions and the bulk commands. process_pool() starts the worker processes of
+# the bulk commands (scan, render): each worker opens one read-only connection
+# when it starts, plus whatever per-process state the command needs. Kept apart
+# from server.py so importing it (plots.py is imported by the menu) doesn't load
+# the HTTP server.
+
+import argparse
+import concurrent.futures
+import sqlite3
+import urllib.parse
+
+##################################################################
+#
+# connect_read_only
+#
+# Given a database path, opens a connection that can't write: the
+# file is opened read-only and query_only is set. It may be used
+# from any thread.
+#
+def connect_read_only(dbPath):
+    uri = "file:" + urllib.parse.quote(dbPath) + "?mode=ro"
+    dbConn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    dbConn.execute("Pragma query_only = 1;")
+    return dbConn
+
+#this worker process's read-only connection, and what setup() returned
+_workerConn = None
+_workerState = None
+
+def init_worker(dbPath, setup, setupArgs):
+    global _workerConn, _workerState
+    _workerConn = connect_read_only(dbPath)
+    if setup is not None:
+        _workerState = setup(*setupArgs)
+
+def worker_connection():
+    return _workerConn
+
+def worker_state():
+    return _workerState
+
+##################################################################
+#
+# process_pool
+#
+# Given a number of workers and a database path, returns a process
+# pool whose workers each open a read-only connection to it, then
+# call setup(*setupArgs) if given and keep the result for
+# worker_state().
+#
+def process_pool(workers, dbPath, setup=None, setupArgs=()):
+    #imported here so the menu, which imports this module, doesn't pay for it
+    import multiprocessing
+    #forked workers don't re-run main.py, which has no __main__ guard
+    context = None
+    if "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+    return concurrent.futures.ProcessPoolExecutor(workers, mp_context=context, initializer=init_worker,
+                                                  initargs=(dbPath, setup, setupArgs))
+
+#argparse type for --workers: at least one process
+def worker_count(text):
+    if not text.strip().isdigit() or int(text) < 1:
+        raise argparse.ArgumentTypeError(f"expected a positive number of workers, got '{text}'")
+    return int(text)
@@ -0,0 +1,195 @@
+# Overview: Result cache for the CTA L analyses.
+# Analysis results are kept in a bounded LRU map keyed by the analysis and its
+# arguments (station patterns are already resolved to Station_IDs by then, so
+# "UIC%" and "UIC-Halsted" share an entry). Within a run, a connection whose
+# PRAGMA data_version or total_changes moved, or that the cache hasn't seen yet,
+# compares the tables' versions with those the entries were computed from and
+# empties the cache if they differ; a result whose computation overlapped a
+# change isn't kept. Optionally the cache is saved to a file and loaded on the
+# next start, but only if the schema version and the tables' versions (rowid
+# watermarks and change counts, see changes.py) are still what they were when it
+# was saved.
+
+import collections
+import os
+import pickle
+import sqlite3
+import threading
+
+import changes
+import partitions
+
+#tables the analyses read; any change to them makes a saved cache stale
+TABLES = ["Stations", "Stops", "Lines", "StopDetails", "Ridership"]
+DEFAULT_SIZE = 256
+
+#durable description of the data: survives restarts, unlike data_version
+def database_signature(dbConn):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("Pragma schema_version;")
+    signature = {"schema_version": dbCursor.fetchone()[0],
+                 "versions": changes.versions(dbConn, TABLES)}
+    #a catalog's own tables don't change when its partitions are rebuilt
+    if partitions.is_catalog(dbConn):
+        signature["partitions"] = changes.versions(dbConn, ["Partitions"])
+    return signature
+
+##################################################################
+#
+# ResultCache
+#
+# Bounded LRU cache of analysis results, shared by every connection
+# to one database. Safe to use from several threads. Results are
+# shared between callers, so they must not be modified.
+#
+class ResultCache:
+    def __init__(self, maxEntries=DEFAULT_SIZE, path=None):
+        self.maxEntries = maxEntries
+        self.path = path
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        #id(dbConn) -> (data_version, total_changes) when last checked
+        self.versions = {}
+        #database_signature() the entries were computed from
+        self.signature = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.loaded = 0
+
+    #empty the cache if the data changed since the entries were computed;
+    #data_version only compares within one connection, so a connection seen
+    #for the first time, or whose data_version moved, compares the tables'
+    #versions instead. Returns the connection's data_version
+    def check(self, dbConn):
+        version = changes.data_version(dbConn)
+        with self.lock:
+            if self.versions.get(id(dbConn)) == version:
+                return version
+        signature = database_signature(dbConn)
+        with self.lock:
+            self.versions[id(dbConn)] = version
+            if signature != self.signature:
+                if self.signature is not None and len(self.entries) > 0:
+                    self.entries.clear()
+                    self.invalidations += 1
+                self.signature = signature
+        return version
+
+    ##################################################################
+    #
+    # get
+    #
+    # Given a connection, a hashable key and a function computing the
+    # result, returns the cached result or computes and stores it.
+    # Errors raised by compute are passed on, not cached. A result is
+    # not stored if the data changed while it was being computed.
+    #
+    def get(self, dbConn, key, compute):
+        version = self.check(dbConn)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+        #computed outside the lock so other threads aren't held up
+        result = compute()
+        #it may mix data from before and after the change
+        if changes.data_version(dbConn) != version:
+            return result
+        with self.lock:
+            self.entries[key] = result
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxEntries:
+                self.entries.popitem(last=False)
+        return result
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self.entries), "max_entries": self.maxEntries,
+                    "hits": self.hits, "misses": self.misses,
+                    "hit_rate": self.hits / lookups if lookups else 0.0,
+                    "invalidations": self.invalidations, "loaded": self.loaded}
+
+    ##################################################################
+    #
+    # load
+    #
+    # Given a connection, reads the saved cache if there is one and
+    # the database still matches it. Returns the number of entries.
+    #
+    def load(self, dbConn):
+        if self.path is None or not os.path.exists(self.path):
+            return 0
+        try:
+            with open(self.path, "rb") as cacheFile:
+                saved = pickle.load(cacheFile)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            return 0
+        if saved.get("signature") != database_signature(dbConn):
+            return 0
+        with self.lock:
+            for key, result in saved["entries"][-self.maxEntries:]:
+                self.entries[key] = result
+            self.loaded = len(self.entries)
+        return self.loaded
+
+    #write the cache to its file (if it has one), most recently used last
+    def save(self, dbConn):
+        if self.path is None:
+            return
+        #signature first: a change after it makes the saved file stale, and
+        #one before it empties the cache in check()
+        signature = database_signature(dbConn)
+        self.check(dbConn)
+        with self.lock:
+            entries = list(self.entries.items())
+        saved = {"signature": signature, "entries": entries}
+        temporary = self.path + ".tmp"
+        with open(temporary, "wb") as cacheFile:
+            pickle.dump(saved, cacheFile, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, self.path)
+
+##################################################################
+#
+# add_arguments
+#
+# Adds the cache options shared by the batch and serve commands.
+#
+def add_arguments(parser):
+    parser.add_argument("--no-cache", action="store_true", help="don't cache analysis results")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_SIZE, help="results kept in the cache")
+    parser.add_argument("--cache-file", help="save the cache here on exit and load it on start")
+
+##################################################################
+#
+# open_cache
+#
+# Given a connection and the cache settings, returns a ResultCache
+# loaded from its file if there is one, or None if caching is off.
+# On a writable connection the change count triggers are installed
+# first; a file saved before they existed isn't loaded. Save with
+# the same connection: a change seen through it since it was opened
+# empties the cache before it is written.
+#
+def open_cache(dbConn, enabled=True, maxEntries=DEFAULT_SIZE, path=None):
+    if not enabled:
+        return None
+    cache = ResultCache(maxEntries, path)
+    try:
+        installed = changes.install(dbConn, TABLES)
+    except sqlite3.OperationalError:
+        #read-only connection: whatever counters there are will do
+        installed = []
+    cache.check(dbConn)
+    if not installed:
+        cache.load(dbConn)
+    return cache
+
+#"hits/misses" line for the menu and the command line tools
+def describe(stats):
+    return (f"Result cache: {stats['hits']:,} hits, {stats['misses']:,} misses "
+            f"({stats['hit_rate'] * 100:.0f}% hit rate), {stats['entries']}/{stats['max_entries']} entries, "
+            f"{stats['invalidations']} invalidations, {stats['loaded']} loaded from disk")
@@ -0,0 +1,177 @@
+# Overview: Builds and maintains ridership rollup tables for the CTA L analysis app.
+# Ridership is summarized per station, year, month and type of day so the analysis
+# options can answer from a few hundred summary rows instead of scanning every ride entry.
+# On a database with day numbers (see daynumbers.py) the year and month of each new
+# row come from the Calendar table instead of strftime() on Ride_Date.
+# New rows are folded in by rowid; an Update or Delete anywhere in Ridership is
+# seen through its change count (see changes.py) and rebuilds the rollup.
+# Programs refresh the rollup at startup; the long-running ones (the menu, batch
+# and the query service) also keep it current through a RollupKeeper, so rows
+# another program writes later show up in the rollup-backed options too.
+
+import threading
+
+import changes
+import daynumbers
+
+#False for a database without ride entries to roll up, e.g. a file
+#sqlite3.connect() just created because the path was wrong
+def has_ridership(dbConn):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("Select Count(*) From sqlite_master Where type = 'table' And name = 'Ridership';")
+    return dbCursor.fetchone()[0] > 0
+
+##################################################################
+#
+# create_rollups
+#
+# Given a connection to the CTA database, creates the rollup table
+# and its bookkeeping table if they do not exist yet.
+#
+def create_rollups(dbConn):
+    dbCursor = dbConn.cursor()
+    #one row per station, year, month and type of day
+    dbCursor.execute("""Create Table If Not Exists RidershipRollup (
+                          Station_ID Integer Not Null,
+                          Year Integer Not Null,
+                          Month Integer Not Null,
+                          Type_of_Day Text Not Null,
+                          Num_Riders Integer Not Null,
+                          Num_Days Integer Not Null,
+                          Primary Key (Station_ID, Year, Month, Type_of_Day)
+                        ) Without Rowid;""")
+    #remembers how far into Ridership the rollup has been built, and
+    #Ridership's change count at the time
+    dbCursor.execute("""Create Table If Not Exists RollupState (
+                          Name Text Primary Key,
+                          Last_Row_ID Integer Not Null,
+                          Last_Ride_Date Text,
+                          Changes Integer);""")
+    #rollups built before the change count was kept
+    dbCursor.execute("Pragma table_info(RollupState);")
+    if "changes" not in [row[1].lower() for row in dbCursor.fetchall()]:
+        dbCursor.execute("Alter Table RollupState Add Column Changes Integer;")
+    #every program refreshes the rollups on a writable connection first, so
+    #this is where every table gets its counters; changes made to Ridership
+    #before its triggers existed weren't counted -> rebuild
+    if "Ridership" in changes.install(dbConn, changes.TABLES):
+        dbCursor.execute("Update RollupState Set Changes = Null;")
+        dbConn.commit()
+
+##################################################################
+#
+# rebuild_rollups
+#
+# Given a connection to the CTA database, throws away the rollup
+# and rebuilds it from every row in Ridership.
+#
+def rebuild_rollups(dbConn):
+    create_rollups(dbConn)
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("Delete From RidershipRollup;")
+    dbCursor.execute("Delete From RollupState Where Name = 'Ridership';")
+    return refresh_rollups(dbConn)
+
+##################################################################
+#
+# refresh_rollups
+#
+# Given a connection to the CTA database, folds any Ridership rows
+# added since the last refresh into the rollup. New rows are found
+# through the rowid watermark, so an up-to-date rollup costs two
+# index lookups. If rows were updated or deleted since, the rollup is
+# rebuilt instead. Returns the number of ride entries folded in.
+#
+def refresh_rollups(dbConn):
+    create_rollups(dbConn)
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("Select Last_Row_ID, Changes From RollupState Where Name = 'Ridership';")
+    state = dbCursor.fetchone()
+    lastRowID = state[0] if state is not None else 0
+    maxRowID, changeCount = changes.versions(dbConn, ["Ridership"])["Ridership"]
+    #rows already rolled up were updated or deleted -> start over
+    if state is not None and state[1] != changeCount:
+        return rebuild_rollups(dbConn)
+    #nothing new since last time
+    if maxRowID == lastRowID:
+        return 0
+    #Ridership shrank or was reloaded -> start over
+    if maxRowID < lastRowID:
+        return rebuild_rollups(dbConn)
+    #count the new rows and fold them into the matching summary rows; rows
+    #without a station or a valid date can't be placed and are left out, a
+    #missing type of day is kept as '' so totals still match Sum(Num_Riders)
+    dbCursor.execute("""Select Count(*), Max(Ride_Date)
+                        From Ridership
+                        Where rowid > ? And rowid <= ?;""", [lastRowID, maxRowID])
+    newRows = dbCursor.fetchone()
+    if daynumbers.has_day_numbers(dbConn):
+        daynumbers.fill_calendar(dbConn, lastRowID, maxRowID)
+        yearMonth = """Select Ridership.Station_ID, Calendar.Year, Calendar.Month,
+                              Coalesce(Ridership.Type_of_Day, ''), Coalesce(Sum(Ridership.Num_Riders), 0), Count(*)
+                       From Ridership Join Calendar On Calendar.Day_Number = Ridership.Day_Number
+                       Where Ridership.rowid > ? And Ridership.rowid <= ?
+                             And Ridership.Station_ID Is Not Null"""
+    else:
+        yearMonth = """Select Station_ID,
+                              Cast(strftime('%Y', Ride_Date) As Integer),
+                              Cast(strftime('%m', Ride_Date) As Integer),
+                              Coalesce(Type_of_Day, ''), Coalesce(Sum(Num_Riders), 0), Count(*)
+                       From Ridership
+                       Where rowid > ? And rowid <= ?
+                             And Station_ID Is Not Null And strftime('%Y', Ride_Date) Is Not Null"""
+    dbCursor.execute(f"""Insert Into RidershipRollup (Station_ID, Year, Month, Type_of_Day, Num_Riders, Num_Days)
+                         {yearMonth}
+                         Group By 1, 2, 3, 4
+                         On Conflict (Station_ID, Year, Month, Type_of_Day) Do Update
+                         Set Num_Riders = Num_Riders + excluded.Num_Riders,
+                             Num_Days = Num_Days + excluded.Num_Days;""", [lastRowID, maxRowID])
+    dbCursor.execute("""Insert Into RollupState (Name, Last_Row_ID, Last_Ride_Date, Changes)
+                        Values ('Ridership', ?, ?, ?)
+                        On Conflict (Name) Do Update
+                        Set Last_Row_ID = excluded.Last_Row_ID,
+                            Last_Ride_Date = Max(Coalesce(Last_Ride_Date, ''), excluded.Last_Ride_Date),
+                            Changes = excluded.Changes;""",
+                     [maxRowID, newRows[1], changeCount])
+    dbConn.commit()
+    return newRows[0]
+
+#True if the rollup holds every Ridership row as it is now
+def is_current(dbConn):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("Select Last_Row_ID, Changes From RollupState Where Name = 'Ridership';")
+    state = dbCursor.fetchone()
+    maxRowID, changeCount = changes.versions(dbConn, ["Ridership"])["Ridership"]
+    if state is None:
+        return maxRowID == 0
+    return state[0] == maxRowID and state[1] == changeCount
+
+##################################################################
+#
+# RollupKeeper
+#
+# Given a writable connection to the CTA database, keeps the rollup
+# in step with Ridership for as long as a program runs. current() is
+# called with whichever connection is about to read the rollup, and
+# refreshes it through the writable one if Ridership has changed
+# since. A connection whose data_version hasn't moved since it was
+# last found current skips the check. Safe to use from several
+# threads if the writable connection may be used from any thread.
+#
+class RollupKeeper:
+    def __init__(self, writerConn):
+        self.writerConn = writerConn
+        self.lock = threading.Lock()
+        #id(dbConn) -> data_version when the rollup was last current
+        self.seen = {}
+
+    def current(self, dbConn):
+        version = changes.data_version(dbConn)
+        with self.lock:
+            if self.seen.get(id(dbConn)) == version:
+                return
+            if not is_current(dbConn):
+                refresh_rollups(self.writerConn)
+                #the refresh moved data_version; checked again next time
+                return
+            self.seen[id(dbConn)] = version
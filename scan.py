@@ -0,0 +1,259 @@
+# Overview: All-stations series and anomaly scan.
+#
+#   python3 main.py scan --output scan_results --workers 8
+#   python3 main.py scan --table --method rolling --window 29 --threshold 3.5
+#
+# Computes every station's daily, monthly and yearly ridership and flags abnormal days
+# (closures, events) with a robust z-score: 0.6745 * (riders - median) / MAD,
+# compared only against days of the same type (weekday, Saturday,
+# Sunday/holiday). "year" takes the median over the station's same-type days in
+# that year; "rolling" takes it over the nearest --window same-type days, which
+# follows trends. Stations are split into Station_ID ranges of roughly equal
+# row counts (from the rollup) and scanned by a process pool, each worker on its
+# own read-only connection. Results are written as CSV files to --output in
+# Station_ID order, the same on every run, and with --table the flagged days also
+# go to the RidershipAnomalies table.
+
+import argparse
+import csv
+import os
+import sqlite3
+import time
+
+import batch
+import readonly
+import rollups
+
+METHODS = ["year", "rolling"]
+#modified z-score above which a day is flagged (Iglewicz and Hoaglin)
+DEFAULT_THRESHOLD = 3.5
+#same-type days in the rolling window, centered on the day
+DEFAULT_WINDOW = 29
+#Station_ID ranges per worker, so a slow range doesn't leave the others idle
+RANGES_PER_WORKER = 4
+
+##################################################################
+#
+# station_ranges
+#
+# Given a connection and a number of ranges, splits the stations
+# with ride entries into (low, high) Station_ID ranges, inclusive,
+# holding roughly the same number of ride entries each.
+#
+def station_ranges(dbConn, count):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("""Select Station_ID, Sum(Num_Days)
+                        From RidershipRollup
+                        Group By Station_ID
+                        Order By Station_ID;""")
+    stations = dbCursor.fetchall()
+    total = sum(days for stationID, days in stations)
+    ranges = []
+    low = None
+    filled = 0
+    for stationID, days in stations:
+        if low is None:
+            low = stationID
+        filled += days
+        if filled >= total * (len(ranges) + 1) / count:
+            ranges.append((low, stationID))
+            low = None
+    if low is not None:
+        ranges.append((low, stations[-1][0]))
+    return ranges
+
+##################################################################
+#
+# spread
+#
+# Given the riders of the days a day is compared against, returns
+# (median, scale) for the modified z-score: MAD / 0.6745, or when
+# over half of them equal the median, 1.253314 x the mean absolute
+# deviation. The scale is 0 when they don't vary at all.
+#
+def spread(values):
+    ordered = sorted(values)
+    n = len(ordered)
+    median = (ordered[(n - 1) // 2] + ordered[n // 2]) / 2
+    deviations = sorted(abs(v - median) for v in ordered)
+    mad = (deviations[(n - 1) // 2] + deviations[n // 2]) / 2
+    if mad > 0:
+        return (median, mad / 0.6745)
+    return (median, 1.253314 * sum(deviations) / n)
+
+##################################################################
+#
+# scan_station
+#
+# Given one station's [(Ride_Date, day type, riders)] in date order and
+# the scan settings, returns (daily, monthly, yearly, anomalies) rows.
+#
+def scan_station(stationID, days, method, window, threshold):
+    daily = {}
+    monthly = {}
+    yearly = {}
+    byType = {}
+    for date, dayType, riders in days:
+        riders = riders or 0
+        daily[date[:10]] = daily.get(date[:10], 0) + riders
+        monthly[date[:7]] = monthly.get(date[:7], 0) + riders
+        yearly[date[:4]] = yearly.get(date[:4], 0) + riders
+        byType.setdefault(dayType, []).append((date, riders))
+    anomalies = []
+    for dayType, series in byType.items():
+        values = [riders for date, riders in series]
+        #year -> (first, last + 1) index of its same-type days
+        years = {}
+        for i, (date, riders) in enumerate(series):
+            years[date[:4]] = (years.get(date[:4], (i, i))[0], i + 1)
+        #(low, high) -> spread; every day of a year shares one
+        spreads = {}
+        for i, (date, riders) in enumerate(series):
+            if method == "year":
+                low, high = years[date[:4]]
+            else:
+                low = max(0, min(i - window // 2, len(series) - window))
+                high = min(len(series), low + window)
+            if high - low < 3:
+                continue
+            if (low, high) not in spreads:
+                spreads[(low, high)] = spread(values[low:high])
+            median, scale = spreads[(low, high)]
+            if scale > 0 and abs(riders - median) / scale > threshold:
+                anomalies.append((stationID, date, dayType, riders, median, round((riders - median) / scale, 2)))
+    anomalies.sort(key=lambda row: row[1])
+    return ([(stationID, day, riders) for day, riders in sorted(daily.items())],
+            [(stationID, month, riders) for month, riders in sorted(monthly.items())],
+            [(stationID, year, riders) for year, riders in sorted(yearly.items())],
+            anomalies)
+
+##################################################################
+#
+# scan_range
+#
+# Runs in a worker: scans every station with low <= Station_ID <=
+# high and returns (rows read, daily, monthly, yearly, anomalies).
+#
+def scan_range(low, high, method, window, threshold):
+    dbCursor = readonly.worker_connection().cursor()
+    #one pass over the (Station_ID, Ride_Date) index for the whole range
+    dbCursor.execute("""Select Station_ID, Ride_Date, Type_of_Day, Num_Riders
+                        From Ridership
+                        Where Station_ID >= ? And Station_ID <= ?
+                        Order By Station_ID, Ride_Date;""", [low, high])
+    results = ([], [], [], [])
+    rowsRead = 0
+    current = None
+    days = []
+    #rows arrive station by station; scan each one as soon as it's complete
+    for stationID, date, dayType, riders in dbCursor:
+        rowsRead += 1
+        if stationID != current and current is not None:
+            for found, rows in zip(results, scan_station(current, days, method, window, threshold)):
+                found.extend(rows)
+            days = []
+        current = stationID
+        days.append((date, dayType, riders))
+    if current is not None:
+        for found, rows in zip(results, scan_station(current, days, method, window, threshold)):
+            found.extend(rows)
+    return (rowsRead,) + results
+
+##################################################################
+#
+# ResultFiles
+#
+# CSV files for the scan results, written a range at a time.
+#
+class ResultFiles:
+    HEADERS = {"daily": ["station_id", "ride_date", "riders"],
+               "monthly": ["station_id", "month", "riders"],
+               "yearly": ["station_id", "year", "riders"],
+               "anomalies": ["station_id", "ride_date", "type_of_day", "riders", "expected", "score"]}
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.files = {}
+        self.writers = {}
+        for name, header in self.HEADERS.items():
+            self.files[name] = open(os.path.join(directory, name + ".csv"), "w", newline="")
+            self.writers[name] = csv.writer(self.files[name])
+            self.writers[name].writerow(header)
+
+    def write(self, daily, monthly, yearly, anomalies):
+        self.writers["daily"].writerows(daily)
+        self.writers["monthly"].writerows(monthly)
+        self.writers["yearly"].writerows(yearly)
+        self.writers["anomalies"].writerows(anomalies)
+
+    def close(self):
+        for resultFile in self.files.values():
+            resultFile.close()
+
+#(re)create the table the flagged days are stored in
+def create_anomaly_table(dbConn):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("Drop Table If Exists RidershipAnomalies;")
+    dbCursor.execute("""Create Table RidershipAnomalies (
+                          Station_ID Integer Not Null,
+                          Ride_Date Text Not Null,
+                          Type_of_Day Text,
+                          Num_Riders Integer,
+                          Expected Real,
+                          Score Real,
+                          Primary Key (Station_ID, Ride_Date)
+                        );""")
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="main.py scan", description="Series and anomaly scan of every station.")
+    parser.add_argument("--method", choices=METHODS, default="rolling", help="what each day is compared against")
+    parser.add_argument("--window", type=int, default=DEFAULT_WINDOW, help="same-type days in the rolling window")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="flag days scoring above this")
+    parser.add_argument("--workers", type=readonly.worker_count, default=os.cpu_count() or 1,
+                        help="worker processes")
+    parser.add_argument("--output", default="scan_results", help="directory for the CSV files")
+    parser.add_argument("--table", action="store_true", help="also store flagged days in RidershipAnomalies")
+    parser.add_argument("--db", default=batch.DATABASE, help="path to the CTA database")
+    return parser
+
+##################################################################
+#
+# main
+#
+# Given the command line arguments after "scan", scans every station
+# in parallel and writes the results.
+#
+def main(argv):
+    args = build_parser().parse_args(argv)
+    started = time.perf_counter()
+    dbConn = sqlite3.connect(args.db)
+    #the ranges are balanced using the rollup, so bring it up to date first
+    rollups.refresh_rollups(dbConn)
+    ranges = station_ranges(dbConn, max(1, args.workers * RANGES_PER_WORKER))
+    if args.table:
+        create_anomaly_table(dbConn)
+        dbConn.commit()
+    results = ResultFiles(args.output)
+    rowsRead = 0
+    flagged = 0
+    try:
+        with readonly.process_pool(args.workers, args.db) as pool:
+            futures = [pool.submit(scan_range, low, high, args.method, args.window, args.threshold)
+                       for low, high in ranges]
+            #in submission (Station_ID) order, so the files are the same every run;
+            #later ranges keep running while an earlier one is waited for
+            for future in futures:
+                rangeRows, daily, monthly, yearly, anomalies = future.result()
+                results.write(daily, monthly, yearly, anomalies)
+                if args.table:
+                    dbConn.executemany("Insert Into RidershipAnomalies Values (?, ?, ?, ?, ?, ?);", anomalies)
+                    dbConn.commit()
+                rowsRead += rangeRows
+                flagged += len(anomalies)
+    finally:
+        results.close()
+        dbConn.close()
+    elapsed = time.perf_counter() - started
+    print(f"Scanned {rowsRead:,} ride entries in {len(ranges)} station ranges with {args.workers} workers "
+          f"in {elapsed:.1f} s ({rowsRead / max(elapsed, 1e-9):,.0f} rows/s); {flagged:,} days flagged")
+    return 0
@@ -0,0 +1,270 @@
+# Overview: HTTP/JSON query service for the CTA L analyses.
+#
+#   python3 main.py serve --port 8341 --workers 8
+#
+#   GET /option/6?station=UIC-Halsted        -> {"option": 6, "result": {...}}
+#   GET /option/9?latitude=41.87&longitude=-87.65&miles=0.5
+#   GET /option/9?latitude=41.87&longitude=-87.65&miles=2&nearest=3
+#   GET /option/8?year=2019&station=Clark/Lake&station2=Belmont-North&stations=UIC-Halsted
+#   GET /option/12?order=top&limit=5&day_type=W&first_year=2015&cursor=...
+#   GET /stats                               -> general statistics
+#   GET /health                              -> {"status": "ok"}
+#
+# Requests are handled by a fixed pool of worker threads, each borrowing a
+# read-only SQLite connection (mode=ro, query_only) from a shared pool, so
+# readers never block each other and work alongside a WAL-mode writer. Each
+# request has a time limit enforced through SQLite's progress handler, and
+# requests beyond the worker and queue capacity are turned away with 503.
+
+import argparse
+import json
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import analyses
+import batch
+import columnar
+import dbstats
+import querycontrol
+import readonly
+import resultcache
+import rollups
+
+#SQLite VM steps between deadline checks; each check takes the GIL,
+#so checking too often serializes otherwise parallel queries
+PROGRESS_STEPS = 100000
+
+#query string keys -> analyses.run() parameter names
+PARAM_NAMES = {"station": "station", "station2": "station2", "year": "year", "line": "line",
+               "direction": "direction", "latitude": "latitude", "lat": "latitude",
+               "longitude": "longitude", "lon": "longitude", "miles": "miles", "nearest": "nearest",
+               "order": "order", "limit": "limit", "cursor": "cursor", "day_type": "day_type",
+               "first_year": "first_year", "last_year": "last_year"}
+
+##################################################################
+#
+# ConnectionPool
+#
+# Fixed set of read-only connections to the database. Threads take
+# one with acquire() and give it back with release().
+#
+class ConnectionPool:
+    def __init__(self, dbPath, size):
+        self.dbPath = dbPath
+        self.connections = queue.Queue()
+        for i in range(size):
+            self.connections.put(self.connect())
+
+    def connect(self):
+        return readonly.connect_read_only(self.dbPath)
+
+    def acquire(self, timeout):
+        try:
+            return self.connections.get(timeout=timeout)
+        except queue.Empty:
+            raise querycontrol.QueryTimeout("No database connection became free in time...")
+
+    def release(self, dbConn):
+        self.connections.put(dbConn)
+
+    def close(self):
+        while not self.connections.empty():
+            self.connections.get().close()
+
+##################################################################
+#
+# run_with_timeout
+#
+# Given a connection, a time limit in seconds and a function taking
+# the connection, calls it, aborting any SQLite statement still
+# running once the limit has passed.
+#
+def run_with_timeout(dbConn, seconds, function):
+    guard = querycontrol.QueryGuard(seconds, steps=PROGRESS_STEPS)
+    return guard.run(dbConn, lambda: function(dbConn))
+
+##################################################################
+#
+# PooledHTTPServer
+#
+# HTTPServer that hands each accepted request to a fixed thread
+# pool. At most `workers` requests run at once and at most
+# `maxPending` more wait; anything beyond that gets 503 right away.
+#
+class PooledHTTPServer(HTTPServer):
+    def __init__(self, address, handlerClass, pool, workers, maxPending, timeout):
+        #set up before binding: a failed bind calls server_close()
+        self.pool = pool
+        self.timeout_seconds = timeout
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cta-worker")
+        self.slots = threading.BoundedSemaphore(workers + maxPending)
+        super().__init__(address, handlerClass)
+
+    def process_request(self, request, client_address):
+        if not self.slots.acquire(blocking=False):
+            self.reject(request)
+            return
+        self.executor.submit(self.process_request_worker, request, client_address)
+
+    def process_request_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.slots.release()
+
+    #answer 503 without tying up a worker
+    def reject(self, request):
+        body = json.dumps({"error": "Server is busy, try again..."}).encode()
+        try:
+            request.sendall(b"HTTP/1.0 503 Service Unavailable\r\nContent-Type: application/json\r\n"
+                            + f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=True)
+        self.pool.close()
+
+##################################################################
+#
+# AnalysisHandler
+#
+# Turns GET requests into analyses.run() calls and writes the
+# result as JSON.
+#
+class AnalysisHandler(BaseHTTPRequestHandler):
+    #HTTP/1.0 closes the connection after each response, so an idle
+    #client never holds on to a worker
+    verbose = False
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        parts = [p for p in url.path.split("/") if p != ""]
+        query = urllib.parse.parse_qs(url.query)
+        if parts == ["health"]:
+            self.send_json(200, {"status": "ok"})
+        elif parts == ["stats"]:
+            self.answer(lambda dbConn: {"stats": dbstats.get_stats(dbConn), "cache": cache_stats()})
+        elif len(parts) == 2 and parts[0] == "option" and parts[1].isdigit():
+            option = int(parts[1])
+            params = {}
+            for key, values in query.items():
+                if key == "stations":
+                    #repeatable: ?stations=A&stations=B
+                    params["stations"] = values
+                elif key in PARAM_NAMES:
+                    params[PARAM_NAMES[key]] = values[-1]
+            self.answer(lambda dbConn: {"option": option, "params": params,
+                                        "result": analyses.run(dbConn, option, params)})
+        else:
+            self.send_json(404, {"error": "Unknown path..."})
+
+    #run a function on a pooled connection and send what it returns
+    def answer(self, function):
+        server = self.server
+        try:
+            dbConn = server.pool.acquire(server.timeout_seconds)
+            try:
+                body = run_with_timeout(dbConn, server.timeout_seconds, function)
+            finally:
+                server.pool.release(dbConn)
+        except querycontrol.QueryTimeout as e:
+            self.send_json(504, {"error": e.message})
+            return
+        except analyses.AnalysisError as e:
+            self.send_json(400, {"error": e.message, "suggestions": e.suggestions})
+            return
+        except (ValueError, sqlite3.Error) as e:
+            self.send_json(500, {"error": str(e)})
+            return
+        self.send_json(200, body)
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.verbose:
+            super().log_message(format, *args)
+
+#result cache counters for /stats, None when caching is off
+def cache_stats():
+    cache = analyses._resultCache
+    return cache.stats() if cache is not None else None
+
+##################################################################
+#
+# build_parser
+#
+def build_parser():
+    parser = argparse.ArgumentParser(prog="main.py serve", description="Serve the CTA L analyses as JSON over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8341, help="port to listen on")
+    parser.add_argument("--workers", type=int, default=8, help="worker threads, one connection each")
+    parser.add_argument("--max-pending", type=int, default=64, help="requests allowed to wait for a worker")
+    parser.add_argument("--timeout", type=float, default=10.0, help="seconds a request may take")
+    parser.add_argument("--db", default=batch.DATABASE, help="path to the CTA database")
+    parser.add_argument("--columnar", action="store_true", help="use the columnar engine (needs numpy)")
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    resultcache.add_arguments(parser)
+    return parser
+
+##################################################################
+#
+# main
+#
+# Given the command line arguments after "serve", brings the rollups
+# and cached statistics up to date, then serves until interrupted.
+# Requests for the rollup-backed options refresh it again first if
+# Ridership has changed since.
+#
+def main(argv):
+    args = build_parser().parse_args(argv)
+    #connecting would create an empty file at a wrong path
+    if not os.path.exists(args.db):
+        print(f"**{args.db} not found...", file=sys.stderr)
+        return 2
+    #the only writes: the rollup, the cached statistics and the change
+    #counters, here and whenever a request finds Ridership has changed
+    dbConn = sqlite3.connect(args.db, check_same_thread=False)
+    if not rollups.has_ridership(dbConn):
+        print(f"**{args.db} has no Ridership table...", file=sys.stderr)
+        return 2
+    rollups.refresh_rollups(dbConn)
+    analyses.use_rollup_keeper(rollups.RollupKeeper(dbConn))
+    dbstats.get_stats(dbConn)
+    if args.columnar and columnar.available():
+        analyses.use_column_store(columnar.open_store(dbConn, args.db))
+    cache = resultcache.open_cache(dbConn, not args.no_cache, args.cache_size, args.cache_file)
+    analyses.use_result_cache(cache)
+    pool = ConnectionPool(args.db, args.workers)
+    AnalysisHandler.verbose = args.verbose
+    httpd = PooledHTTPServer((args.host, args.port), AnalysisHandler, pool,
+                             args.workers, args.max_pending, args.timeout)
+    print(f"Serving CTA L analyses on http://{args.host}:{httpd.server_address[1]} "
+          f"with {args.workers} workers", file=sys.stderr, flush=True)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        if cache is not None:
+            cache.save(dbConn)
+        dbConn.close()
+    return 0
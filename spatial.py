@@ -0,0 +1,115 @@
+# Overview: In-process spatial index over the CTA stops.
+# Stops are loaded from the database once (again after they change) and bucketed into a lat/long grid,
+# so radius and nearest-stop lookups only look at the few cells near the point
+# and measure real (haversine) distance in miles.
+
+import math
+
+import changes
+import queries
+
+EARTH_RADIUS_MILES = 3958.8
+#grid cell size in degrees, roughly 0.7 miles north-south around Chicago
+CELL_DEGREES = 0.01
+
+##################################################################
+#
+# haversine
+#
+# Given two latitude/longitude points in degrees, returns the
+# great-circle distance between them in miles.
+#
+def haversine(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * math.asin(math.sqrt(a))
+
+##################################################################
+#
+# StopIndex
+#
+# Grid index over (Stop_ID, Station_Name, Latitude, Longitude) rows.
+# Results keep the order the rows were loaded in, which is station
+# name then stop id.
+#
+class StopIndex:
+    def __init__(self, stops, cellDegrees=CELL_DEGREES):
+        self.stops = list(stops)
+        self.cellDegrees = cellDegrees
+        self.cells = {}
+        for i, stop in enumerate(self.stops):
+            self.cells.setdefault(self._cell(stop[2], stop[3]), []).append(i)
+
+    def __len__(self):
+        return len(self.stops)
+
+    def _cell(self, lat, lon):
+        return (math.floor(lat / self.cellDegrees), math.floor(lon / self.cellDegrees))
+
+    #(position, distance) of every stop within the given number of miles of the point
+    def _search(self, lat, lon, miles):
+        #how many degrees a mile is here, north-south and east-west
+        dLat = math.degrees(miles / EARTH_RADIUS_MILES)
+        cosLat = max(math.cos(math.radians(lat)), 1e-9)
+        dLon = dLat / cosLat
+        lowRow, lowCol = self._cell(lat - dLat, lon - dLon)
+        highRow, highCol = self._cell(lat + dLat, lon + dLon)
+        found = []
+        for row in range(lowRow, highRow + 1):
+            for col in range(lowCol, highCol + 1):
+                for i in self.cells.get((row, col), ()):
+                    stop = self.stops[i]
+                    distance = haversine(lat, lon, stop[2], stop[3])
+                    if distance <= miles:
+                        found.append((i, distance))
+        return found
+
+    #(stop, distance in miles) for every stop within the given radius
+    #of the point, in load order
+    def within(self, lat, lon, miles):
+        found = sorted(self._search(lat, lon, miles))
+        return [(self.stops[i], distance) for i, distance in found]
+
+    #up to k (stop, distance in miles) pairs closest to the point, nearest
+    #first, ignoring anything farther than maxMiles. The search radius starts
+    #at one grid cell and doubles until k stops are inside it.
+    def nearest(self, lat, lon, k, maxMiles):
+        if k <= 0:
+            return []
+        miles = min(math.radians(self.cellDegrees) * EARTH_RADIUS_MILES, maxMiles)
+        while True:
+            found = self._search(lat, lon, miles)
+            if len(found) >= k or miles >= maxMiles:
+                break
+            miles = min(miles * 2, maxMiles)
+        found.sort(key=lambda pair: (pair[1], pair[0]))
+        return [(self.stops[i], distance) for i, distance in found[:k]]
+
+##################################################################
+#
+# load_index
+#
+# Given a connection to the CTA database, reads every stop location
+# and builds a StopIndex. Stops sharing a location are kept once.
+#
+def load_index(dbConn):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute(queries.STOP_LOCATIONS)
+    return StopIndex(dbCursor.fetchall())
+
+_index = changes.Derived(["Stations", "Stops"], load_index)
+
+##################################################################
+#
+# get_index
+#
+# Given a connection to the CTA database, returns the shared stop
+# index, loading it on first use and again after the stations or
+# stops change.
+#
+def get_index(dbConn):
+    return _index.get(dbConn)
+
+#forget the stop index, e.g. before switching to another database
+def reset():
+    _index.reset()
@@ -0,0 +1,134 @@
+# Overview: In-memory station name index for the CTA L analysis app.
+# Station names are loaded once (again after the Stations table changes) and kept
+# sorted, so the LIKE patterns users type (with _ and % wildcards) become a prefix
+# range lookup plus a match over a handful of names, and typos can be answered
+# with ranked suggestions.
+
+import bisect
+import difflib
+import re
+
+import changes
+import queries
+
+_ASCII_LOWER = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+
+##################################################################
+#
+# fold
+#
+# SQLite's LIKE ignores case for ASCII letters only, so names and
+# patterns are compared after lower-casing just A-Z.
+#
+def fold(text):
+    return text.translate(_ASCII_LOWER)
+
+##################################################################
+#
+# like_to_regex
+#
+# Given a LIKE pattern, returns (literal prefix, compiled regex) where
+# the prefix is everything before the first wildcard (folded) and the
+# regex matches folded names the same way LIKE would.
+#
+def like_to_regex(pattern):
+    folded = fold(pattern)
+    prefix = re.split(r"[%_]", folded, maxsplit=1)[0]
+    parts = []
+    for ch in folded:
+        if ch == "%":
+            parts.append(".*")
+        elif ch == "_":
+            parts.append(".")
+        else:
+            parts.append(re.escape(ch))
+    return prefix, re.compile("".join(parts), re.DOTALL)
+
+##################################################################
+#
+# StationResolver
+#
+# Sorted index over (Station_ID, Station_Name) rows. Rows with a
+# NULL name or id are left out: LIKE and = never match them either.
+#
+class StationResolver:
+    def __init__(self, stations):
+        #sorted by folded name for prefix lookups
+        self.entries = sorted(((fold(name), name, stationID) for stationID, name in stations
+                               if name is not None and stationID is not None))
+        self.keys = [entry[0] for entry in self.entries]
+        self.byName = {}
+        self.byID = {}
+        for key, name, stationID in self.entries:
+            self.byName.setdefault(name, []).append(stationID)
+            self.byID[stationID] = name
+
+    def __len__(self):
+        return len(self.entries)
+
+    #every (Station_ID, Station_Name) whose name matches the LIKE pattern,
+    #ordered by Station_Name like the old "Order By Station_Name" query
+    def like(self, pattern):
+        prefix, regex = like_to_regex(pattern)
+        #only names starting with the literal prefix can match
+        low = bisect.bisect_left(self.keys, prefix)
+        high = bisect.bisect_left(self.keys, prefix + "\U0010ffff") if prefix else len(self.keys)
+        found = [(stationID, name) for key, name, stationID in self.entries[low:high] if regex.fullmatch(key)]
+        found.sort(key=lambda station: (station[1], station[0]))
+        return found
+
+    #Station_IDs of the stations named exactly this (case-sensitive, like =)
+    def exact(self, name):
+        return list(self.byName.get(name, []))
+
+    #Station_Name of a Station_ID, None if there's no such station
+    def name_of(self, stationID):
+        return self.byID.get(stationID)
+
+    #up to limit (score, Station_ID, Station_Name) best guesses for a
+    #mistyped name, best first; wildcards in the text are ignored
+    def suggest(self, text, limit=5, cutoff=0.6):
+        text = fold(text.replace("%", "").replace("_", ""))
+        if text == "":
+            return []
+        scored = []
+        matcher = difflib.SequenceMatcher()
+        matcher.set_seq2(text)
+        for key, name, stationID in self.entries:
+            matcher.set_seq1(key)
+            if matcher.real_quick_ratio() < cutoff or matcher.quick_ratio() < cutoff:
+                continue
+            score = matcher.ratio()
+            if score >= cutoff:
+                scored.append((score, stationID, name))
+        scored.sort(key=lambda s: (-s[0], s[2]))
+        return scored[:limit]
+
+##################################################################
+#
+# load_resolver
+#
+# Given a connection to the CTA database, reads every station name
+# and builds a StationResolver.
+#
+def load_resolver(dbConn):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute(queries.STATION_NAMES)
+    return StationResolver(dbCursor.fetchall())
+
+_resolver = changes.Derived(["Stations"], load_resolver)
+
+##################################################################
+#
+# get_resolver
+#
+# Given a connection to the CTA database, returns the shared station
+# resolver, loading it on first use and again after the stations
+# change.
+#
+def get_resolver(dbConn):
+    return _resolver.get(dbConn)
+
+#forget the resolver, e.g. before switching to another database
+def reset():
+    _resolver.reset()